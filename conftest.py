@@ -0,0 +1,152 @@
+"""
+  conftest.py - pytest hooks shared by the test files
+
+"""
+
+import os
+import re
+import shutil
+import sys
+import time
+
+import pytest
+
+import lcnc_timing
+from lcnc_fuzz import reset
+from lcnc_sim import install
+from lcnc_timing import LATENCIES, VirtualClock, set_clock
+from lcnc_tooltable import write_temp_config
+from lcnc_trace import TRACE
+
+pytest_plugins = ["lcnc_results"]
+
+# Configuration the simulator runs a temporary copy of under --sim, so tests may overwrite its tool table
+SIM_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs")
+
+# Real milliseconds a qtbot.wait still processes Qt events for under --sim
+SIM_QT_WAIT = 10
+
+
+def pytest_addoption(parser):
+    """Trace output, repeat and simulator options"""
+    parser.addoption("--trace-dir", default="traces",
+                     help="Directory for JSON Lines traces of failed tests")
+    parser.addoption("--trace-all", action="store_true",
+                     help="Write the trace of every test, not only the failed ones")
+    parser.addoption("--repeat-count", type=int, default=1,
+                     help="Run each selected test N times, select tests with -k")
+    parser.addoption("--sim", action="store_true",
+                     help="Run against the lcnc_sim simulator in virtual time instead of LinuxCNC")
+
+
+def pytest_configure(config):
+    """Under --sim, install the simulator as linuxcnc before the test modules import it"""
+    if config.getoption("--sim"):
+        clock = VirtualClock()
+        set_clock(clock)
+        config.sim_ini = write_temp_config(0, SIM_CONFIG)
+        install(config.sim_ini, clock)
+
+
+def pytest_unconfigure(config):
+    """Remove the configuration copy the simulator ran"""
+    if getattr(config, "sim_ini", None):
+        shutil.rmtree(os.path.dirname(config.sim_ini), ignore_errors=True)
+
+
+def pytest_generate_tests(metafunc):
+    """Repeat every test --repeat-count times"""
+    count = metafunc.config.getoption("--repeat-count")
+    if count > 1:
+        metafunc.fixturenames.append("repeat_index")
+        metafunc.parametrize("repeat_index", range(count), indirect=True, ids=lambda i: f"repeat{i}")
+
+
+@pytest.fixture
+def repeat_index(request):
+    """
+    Index of the current repetition under --repeat-count
+    Tests of a module that imports linuxcnc start every repetition from estop and manual mode,
+    not from the state the previous repetition left
+    """
+    module = sys.modules.get("linuxcnc")
+    if module is not None and getattr(request.module, "linuxcnc", None) is module:
+        reset(module)
+    return request.param
+
+
+def pytest_collection_modifyitems(config, items):
+    """Under --sim, skip the tests marked no_sim"""
+    if not config.getoption("--sim"):
+        return
+    skip = pytest.mark.skip(reason="needs LinuxCNC, not the simulator")
+    for item in items:
+        if "no_sim" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture(autouse=True)
+def virtual_time(request, monkeypatch):
+    """
+    Under --sim, time.sleep/time.perf_counter and qtbot.wait of a test module that imports linuxcnc
+    advance the virtual clock, modules testing helpers without the controller keep real time
+    qtbot.wait still runs the Qt event loop for up to SIM_QT_WAIT real milliseconds
+    """
+    if not request.config.getoption("--sim") or getattr(request.module, "linuxcnc", None) is not sys.modules.get(
+            "linuxcnc"):
+        return None
+    clock = lcnc_timing.CLOCK
+    if getattr(request.module, "time", None) is time:
+        monkeypatch.setattr(request.module, "time", clock)
+    if "qtbot" in request.fixturenames:
+        qtbot = request.getfixturevalue("qtbot")
+        wait = qtbot.wait
+
+        def virtual_wait(ms: int) -> None:
+            clock.sleep(ms / 1000)
+            wait(min(ms, SIM_QT_WAIT))
+
+        monkeypatch.setattr(qtbot, "wait", virtual_wait)
+    return clock
+
+
+def trace_path(config, nodeid: str) -> str:
+    """
+    :param config: pytest config
+    :param nodeid: Test node id
+    :return: JSON Lines file for the test
+    """
+    return os.path.join(config.getoption("--trace-dir"), re.sub(r"[^\w.-]+", "_", nodeid) + ".jsonl")
+
+
+@pytest.fixture(autouse=True)
+def trace(request):
+    """Start a fresh trace for every test, the TraceBuffer is also available as a fixture"""
+    TRACE.begin(request.node.nodeid)
+    return TRACE
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_makereport(item, call):
+    """Flush the trace once the test body has run, if it failed or --trace-all is set"""
+    outcome = yield
+    report = outcome.get_result()
+    if report.when == "call" and TRACE.events and (report.failed or item.config.getoption("--trace-all")):
+        TRACE.flush(trace_path(item.config, item.nodeid))
+
+
+def pytest_terminal_summary(terminalreporter):
+    """Report the transition latencies recorded during the session"""
+    if LATENCIES.samples or LATENCIES.timeouts:
+        terminalreporter.section("transition latency")
+        terminalreporter.write_line(LATENCIES.report())
+
+
+def pytest_sessionfinish(session):
+    """Store the transition latency summaries with the run"""
+    recorder = session.config.pluginmanager.get_plugin("lcnc_results_recorder")
+    if recorder is None:
+        return
+    for name in LATENCIES.samples:
+        for key, value in LATENCIES.summary(name).items():
+            recorder.add_benchmark("session", f"{name} {key}", value, "" if key in ("count", "timeouts") else "s")
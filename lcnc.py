@@ -4,14 +4,32 @@
   Written by Chad A. Woitas AKA satiowadahc
 
 """
+# pylint: disable=wrong-import-position
+import time
 
+IMPORT_START = time.perf_counter()
+
+import argparse
+import functools
+import importlib
 from typing import Optional
 
 from PyQt5 import QtCore, QtWidgets
 from lcnc_window_ui import Ui_lcnc_test_window
 import sys
 
-import linuxcnc
+from lcnc_errors import ErrorDrain, format_error, track
+from lcnc_server import StatusClient
+from lcnc_status import StatusSubscriptions
+from lcnc_watchdog import CONNECTED, DISCONNECTED, RECONNECTING, ConnectionWatchdog
+
+IMPORT_END = time.perf_counter()
+
+# Rows in the code table, built when the first status arrives
+TABLE_ROWS = 30
+
+# Connection state in client mode while connected to the status server but before its first snapshot
+SERVER_WAIT = "waiting for status server"
 
 # fmt: off
 GCODES = { "0": "G0", "10": "G1", "20": "G2",
@@ -46,52 +64,178 @@ GCODES = { "0": "G0", "10": "G1", "20": "G2",
 # fmt: on
 
 
+@functools.lru_cache(maxsize=None)
+def load_linuxcnc():
+    """
+    Import the linuxcnc extension on first use, so the window can be shown before it loads
+    :return: linuxcnc module
+    """
+    return importlib.import_module("linuxcnc")
+
+
 class LcncWindow(QtWidgets.QMainWindow):
     """Main Window class for testing linuxcnc"""
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, profile_startup=False, server=None, drain_errors=True):
         super().__init__()
+        self.startup = {"init": time.perf_counter()}
+        self.profile_startup = profile_startup
+        # Address of a lcnc_server.py status server, None polls LinuxCNC directly
+        self.server = server
+        # False leaves the error channel to another reader in the process, it hands each error to one reader only
+        self.drain_errors = drain_errors
 
         self.ui = Ui_lcnc_test_window()
         self.ui.setupUi(self)
 
         self.status_labels = []
         self.code_labels = []
-        for i in range(30):
-            self.ui.verticalLayout.addLayout(self.create_line(" "))
 
-        self.status = linuxcnc.stat()
-        self.command = linuxcnc.command()
+        # Created on the first tick and after LinuxCNC restarts, see connect()
+        self.status = None
+        self.command = None
+        self.watchdog = ConnectionWatchdog(self.connect, lambda old, new: self.update_connection())
+        # State reported by on_connection_changed, in client mode the server's own connection to LinuxCNC
+        self.connection = self.watchdog.state
+        # Error channel drain of the current connection, None in client mode or without drain_errors
+        self.errors: Optional[ErrorDrain] = None
+        self.errors_shown = 0
+
+        self.codes_changed = False
+        self.subscriptions = StatusSubscriptions()
+        self.subscriptions.subscribe("gcodes", self.on_codes_changed)
+        self.subscriptions.subscribe("mcodes", self.on_codes_changed)
 
         self.cyclic_timer = QtCore.QTimer()
         self.cyclic_timer.timeout.connect(self.periodic)
         self.cyclic_timer.setInterval(500)
         self.cyclic_timer.start()
+        QtCore.QTimer.singleShot(0, self.periodic)
+
+        self.startup["window"] = time.perf_counter()
+
+    def connect(self):
+        """
+        Import linuxcnc and create the stat and command channels,
+        or subscribe to the status server in client mode, where there is no command channel
+        :return: (stat, command), used by the watchdog on every reconnect
+        """
+        if self.server is not None:
+            return StatusClient(self.server), None
+        start = time.perf_counter()
+        linuxcnc = load_linuxcnc()
+        self.startup.setdefault("linuxcnc_import", time.perf_counter() - start)
+        stat = linuxcnc.stat()
+        if not self.drain_errors:
+            return stat, linuxcnc.command()
+        if self.errors is not None:
+            self.errors.stop()
+        self.errors = ErrorDrain(linuxcnc.error_channel())
+        self.errors_shown = 0
+        self.errors.start()
+        return stat, track(linuxcnc.command(), self.errors)
+
+    def connection_state(self):
+        """
+        :return: Watchdog state, in client mode the server's state once the server is reached
+        """
+        if self.server is None or self.watchdog.state != CONNECTED:
+            return self.watchdog.state
+        return self.watchdog.status.state or SERVER_WAIT
+
+    def update_connection(self):
+        """Call on_connection_changed when connection_state() changed"""
+        state = self.connection_state()
+        if state != self.connection:
+            old, self.connection = self.connection, state
+            self.on_connection_changed(old, state)
 
-        self.is_running = True
+    def on_connection_changed(self, old, new):
+        """Report connection state changes once, instead of every tick"""
+        if new == CONNECTED:
+            message = "Linuxcnc detected"
+            if self.watchdog.last_recovery is not None:
+                message += f", recovered in {self.watchdog.last_recovery:.1f} s"
+        elif new == SERVER_WAIT:
+            message = f"Linuxcnc {new} {self.server}"
+        elif self.watchdog.state == CONNECTED:
+            # Client mode, the server is reached but its own connection to LinuxCNC is down
+            if new == DISCONNECTED:
+                self.subscriptions.reset()
+            message = f"Linuxcnc {new} at status server {self.server}"
+        elif new == DISCONNECTED:
+            self.subscriptions.reset()
+            message = f"Linuxcnc Not Detected: {self.watchdog.last_error}, retry in {self.watchdog.delay():.1f} s"
+        else:
+            message = f"Linuxcnc {new}"
+        if new != RECONNECTING:
+            print(message)
+        self.ui.statusbar.showMessage(message)
 
     def periodic(self):
         """Fetch Information and update the display"""
 
-        try:
-            self.status.poll()
+        polled = self.watchdog.tick()
+        self.status = self.watchdog.status
+        self.command = self.watchdog.command
+        self.update_connection()
 
-            if not self.is_running:
-                print("Linuxcnc detected")
-            self.is_running = True
-        except Exception as e:
-            print(e)
-            if self.is_running:
-                self.is_running = False
-                print("Linuxcnc Not Detected")
-
-        if self.is_running:
+        if polled and self.connection != SERVER_WAIT:
             try:
-                self.load_table()
+                self.codes_changed = False
+                self.subscriptions.dispatch(self.status)
+                if self.codes_changed:
+                    self.load_table()
             except Exception as e:
                 print(e)
+                self.ui.statusbar.showMessage(f"Display update failed: {e}")
+
+        if self.errors is not None and self.errors.received != self.errors_shown:
+            self.errors_shown = self.errors.received
+            self.ui.statusbar.showMessage(format_error(self.errors.last))
+
+        self.startup.setdefault("first_poll", time.perf_counter())
+        self.check_startup_profile()
+
+    def closeEvent(self, event):  # pylint: disable=invalid-name
+        """Stop draining the error channel with the window"""
+        if self.errors is not None:
+            self.errors.stop()
+        super().closeEvent(event)
+
+    def paintEvent(self, event):  # pylint: disable=invalid-name
+        """Record the first paint for the startup profile"""
+        if "first_paint" not in self.startup:
+            self.startup["first_paint"] = time.perf_counter()
+            QtCore.QTimer.singleShot(0, self.check_startup_profile)
+        super().paintEvent(event)
+
+    def check_startup_profile(self):
+        """Print startup timings and quit once painted and polled, in --profile-startup mode"""
+        if not self.profile_startup or "first_paint" not in self.startup or "first_poll" not in self.startup:
+            return
+        self.profile_startup = False
+        print(f"imports:         {(IMPORT_END - IMPORT_START) * 1000:8.1f} ms")
+        for key in sorted(["window", "first_paint", "first_data", "first_poll"], key=lambda k: self.startup.get(k, 0)):
+            if key in self.startup:
+                print(f"{key + ':':16} {(self.startup[key] - IMPORT_START) * 1000:8.1f} ms")
+        if "linuxcnc_import" in self.startup:
+            print(f"linuxcnc import: {self.startup['linuxcnc_import'] * 1000:8.1f} ms")
+        QtWidgets.QApplication.quit()
+
+    def on_codes_changed(self, field, old, new):
+        """
+        Subscription callback for gcodes and mcodes
+        The table is redrawn once per tick, after every callback has run
+        """
+        self.codes_changed = True
 
     def load_table(self):
         """Parse Gcodes and add them to the table"""
+        if not self.status_labels:
+            for _ in range(TABLE_ROWS):
+                self.ui.verticalLayout.addLayout(self.create_line(" "))
+            self.startup["first_data"] = time.perf_counter()
+
         current_codes = list(self.status.gcodes)
 
         self.ui.verticalLayout.update()
@@ -137,7 +281,15 @@ class LcncWindow(QtWidgets.QMainWindow):
 
 
 if __name__ == '__main__':
-    app = QtWidgets.QApplication(sys.argv)
-    lcnc = LcncWindow()
+    parser = argparse.ArgumentParser(description="Qt5 Window for monitoring Linuxcnc Status")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Print import, first paint and first data timings, then exit")
+    parser.add_argument("--connect", metavar="ADDRESS",
+                        help="Show the status of a lcnc_server.py server, unix:/path or host:port, "
+                             "instead of polling LinuxCNC")
+    args, qt_args = parser.parse_known_args()
+
+    app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
+    lcnc = LcncWindow(profile_startup=args.profile_startup, server=args.connect)
     lcnc.show()
     sys.exit(app.exec_())
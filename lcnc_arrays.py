@@ -0,0 +1,101 @@
+"""
+  lcnc_arrays.py - NumPy views over array valued status fields
+
+  linuxcnc.stat hands out tuples, so each field is converted once per
+  snapshot. The arrays are read only and shared by every check after that.
+
+"""
+
+from typing import Iterable, Optional
+
+import numpy as np
+
+EPS = 0.0001
+
+ARRAY_FIELDS = ("ain", "aout", "din", "dout", "actual_position", "joint_actual_position", "tool_table")
+
+# Field order of a tool_table entry
+TOOL_DTYPE = np.dtype([
+    ("id", np.int32),
+    ("xoffset", np.float64), ("yoffset", np.float64), ("zoffset", np.float64),
+    ("aoffset", np.float64), ("boffset", np.float64), ("coffset", np.float64),
+    ("uoffset", np.float64), ("voffset", np.float64), ("woffset", np.float64),
+    ("diameter", np.float64), ("frontangle", np.float64), ("backangle", np.float64),
+    ("orientation", np.int32),
+])
+
+FIELD_DTYPES = {
+    "ain": np.float64,
+    "aout": np.float64,
+    "din": np.int8,
+    "dout": np.int8,
+    "actual_position": np.float64,
+    "joint_actual_position": np.float64,
+}
+
+
+def field_array(name: str, value) -> np.ndarray:
+    """
+    Convert one status field to a read only array
+    :param name: Status attribute name
+    :param value: Value read from linuxcnc.stat
+    :return: 1D array, or a TOOL_DTYPE structured array for tool_table
+    """
+    if name == "tool_table":
+        array = np.array([tuple(tool) for tool in value], dtype=TOOL_DTYPE)
+    else:
+        array = np.asarray(value, dtype=FIELD_DTYPES.get(name, np.float64))
+    array.flags.writeable = False
+    return array
+
+
+class StatArrays:
+    """Array snapshot of the array valued fields of a polled stat object"""
+
+    def __init__(self, stat, fields: Optional[Iterable[str]] = None):
+        """
+        :param stat: linuxcnc.stat object, already polled
+        :param fields: Fields to convert, all of ARRAY_FIELDS if None
+        """
+        for name in ARRAY_FIELDS if fields is None else fields:
+            setattr(self, name, field_array(name, getattr(stat, name)))
+
+
+def _describe(bad: np.ndarray, actual: np.ndarray, expected: np.ndarray, limit: int = 5) -> str:
+    indexes = np.flatnonzero(bad)
+    details = ", ".join(f"[{i}] {actual.flat[i]} != {expected.flat[i]}" for i in indexes[:limit])
+    more = f" (+{len(indexes) - limit} more)" if len(indexes) > limit else ""
+    return f"{len(indexes)} of {actual.size} values differ: {details}{more}"
+
+
+def assert_allclose(actual, expected, eps: float = EPS, mask=None) -> None:
+    """
+    Assert every element is within eps of the expected value
+    :param actual: Array or sequence read from status
+    :param expected: Expected values, or a scalar for all of them
+    :param eps: Absolute tolerance
+    :param mask: Optional boolean array, only True elements are checked
+    """
+    actual = np.asarray(actual, dtype=np.float64)
+    expected = np.broadcast_to(np.asarray(expected, dtype=np.float64), actual.shape)
+    bad = ~np.isclose(actual, expected, rtol=0, atol=eps)
+    if mask is not None:
+        bad &= np.asarray(mask, dtype=bool)
+    if bad.any():
+        raise AssertionError(_describe(bad, actual, expected))
+
+
+def assert_masked_equal(actual, expected, mask=None) -> None:
+    """
+    Assert exact equality, optionally only where mask is True
+    :param actual: Array or sequence read from status
+    :param expected: Expected values, or a scalar for all of them
+    :param mask: Optional boolean array, only True elements are checked
+    """
+    actual = np.asarray(actual)
+    expected = np.broadcast_to(np.asarray(expected), actual.shape)
+    bad = actual != expected
+    if mask is not None:
+        bad &= np.asarray(mask, dtype=bool)
+    if bad.any():
+        raise AssertionError(_describe(bad, actual, expected))
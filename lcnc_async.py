@@ -0,0 +1,176 @@
+"""
+  lcnc_async.py - asyncio wrappers for linuxcnc status and command
+
+  Blocking NML calls (poll, wait_complete) run in an executor so one
+  event loop can wait on several things, or several machines, at once.
+
+  linuxcnc is imported where a stat or command is created or its constants
+  are needed, so the wrappers can be tested against lcnc_sim without it.
+
+"""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import Executor
+from typing import AsyncIterator, Dict, Iterable, Optional, Tuple
+
+from lcnc_status import diff_snapshots, take_snapshot
+
+# Seconds between polls while waiting for a change
+POLL_INTERVAL = 0.01
+
+
+class AsyncStat:
+    """asyncio wrapper around linuxcnc.stat"""
+
+    def __init__(self, stat=None, executor: Optional[Executor] = None):
+        """
+        :param stat: linuxcnc.stat object, a new one is created if None
+        :param executor: Executor for blocking calls, the loop default if None
+        """
+        if stat is None:
+            import linuxcnc  # pylint: disable=import-outside-toplevel
+            stat = linuxcnc.stat()
+        self.stat = stat
+        self.executor = executor
+        # poll() and the getattr calls after it must not interleave between threads
+        self._lock = threading.Lock()
+
+    def _poll_snapshot(self, fields: Optional[Iterable[str]]) -> Dict[str, object]:
+        with self._lock:
+            self.stat.poll()
+            return take_snapshot(self.stat, fields)
+
+    async def poll(self, fields: Optional[Iterable[str]] = None) -> Dict[str, object]:
+        """
+        Poll the controller without blocking the event loop
+        :param fields: Fields to include in the snapshot, all if None
+        :return: Snapshot dictionary
+        """
+        loop = asyncio.get_running_loop()
+        if fields is not None:
+            fields = list(fields)
+        return await loop.run_in_executor(self.executor, self._poll_snapshot, fields)
+
+    async def changed(self, fields: Optional[Iterable[str]] = None,
+                      baseline: Optional[Dict[str, object]] = None,
+                      interval: float = POLL_INTERVAL,
+                      timeout: Optional[float] = None) -> Dict[str, Tuple[object, object]]:
+        """
+        Wait until any of the given fields differ from the baseline
+        :param fields: Fields to watch, all if None
+        :param baseline: Snapshot to compare against, polled now if None
+        :param interval: Seconds between polls
+        :param timeout: Seconds before asyncio.TimeoutError, wait forever if None
+        :return: Dictionary of field name to (old, new)
+        """
+        if fields is not None:
+            fields = list(fields)
+        if baseline is None:
+            baseline = await self.poll(fields)
+
+        async def _wait_for_change():
+            while True:
+                await asyncio.sleep(interval)
+                modified = diff_snapshots(baseline, await self.poll(fields))
+                if modified:
+                    return modified
+
+        return await asyncio.wait_for(_wait_for_change(), timeout)
+
+    async def stream(self, interval: float = POLL_INTERVAL,
+                     fields: Optional[Iterable[str]] = None) -> AsyncIterator[Dict[str, object]]:
+        """
+        Yield a fresh snapshot every interval seconds
+        :param interval: Seconds between snapshots
+        :param fields: Fields to include in each snapshot, all if None
+        """
+        if fields is not None:
+            fields = list(fields)
+        while True:
+            yield await self.poll(fields)
+            await asyncio.sleep(interval)
+
+
+class AsyncCommand:
+    """asyncio wrapper around linuxcnc.command"""
+
+    def __init__(self, command=None, stat: Optional[AsyncStat] = None,
+                 executor: Optional[Executor] = None):
+        """
+        :param command: linuxcnc.command object, a new one is created if None
+        :param stat: AsyncStat used to watch the interpreter, a new one is created if None
+        :param executor: Executor for blocking calls, the loop default if None
+        """
+        if command is None:
+            import linuxcnc  # pylint: disable=import-outside-toplevel
+            command = linuxcnc.command()
+        self.command = command
+        self.stat = stat if stat is not None else AsyncStat(executor=executor)
+        self.executor = executor
+
+    async def _call(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args))
+
+    async def wait_complete_async(self, timeout: float = 5.0) -> int:
+        """
+        Non blocking version of command.wait_complete
+        :param timeout: Seconds to wait
+        :return: RCS status, -1 on timeout
+        """
+        return await self._call(self.command.wait_complete, timeout)
+
+    async def state_async(self, state: int, timeout: float = 5.0) -> int:
+        """
+        Send a state command and wait for it to complete
+        :param state: One of STATE_ESTOP, STATE_ESTOP_RESET, STATE_ON, STATE_OFF
+        :param timeout: Seconds to wait for completion
+        :return: RCS status, -1 on timeout
+        """
+        await self._call(self.command.state, state)
+        return await self.wait_complete_async(timeout)
+
+    async def mode_async(self, mode: int, timeout: float = 5.0) -> int:
+        """
+        Send a mode command and wait for it to complete
+        :param mode: One of MODE_MDI, MODE_AUTO, MODE_MANUAL
+        :param timeout: Seconds to wait for completion
+        :return: RCS status, -1 on timeout
+        """
+        await self._call(self.command.mode, mode)
+        return await self.wait_complete_async(timeout)
+
+    async def interp_idle(self, interval: float = POLL_INTERVAL,
+                          timeout: Optional[float] = None) -> Dict[str, object]:
+        """
+        Wait for the interpreter to report INTERP_IDLE
+        :param interval: Seconds between polls
+        :param timeout: Seconds before asyncio.TimeoutError, wait forever if None
+        :return: Snapshot of interp_state and actual_position once idle
+        """
+        import linuxcnc  # pylint: disable=import-outside-toplevel
+
+        async def _wait_for_idle():
+            while True:
+                snap = await self.stat.poll(["interp_state", "actual_position"])
+                if snap["interp_state"] == linuxcnc.INTERP_IDLE:
+                    return snap
+                await asyncio.sleep(interval)
+
+        return await asyncio.wait_for(_wait_for_idle(), timeout)
+
+    async def mdi_async(self, code: str, interval: float = POLL_INTERVAL,
+                        timeout: Optional[float] = None) -> Dict[str, object]:
+        """
+        Send an MDI command and wait until the interpreter is idle again
+        The machine must already be in MODE_MDI
+        :param code: G-code line to execute
+        :param interval: Seconds between polls
+        :param timeout: Seconds before asyncio.TimeoutError, wait forever if None
+        :return: Snapshot of interp_state and actual_position once idle
+        """
+        await self._call(self.command.mdi, code)
+        await self.wait_complete_async()
+        return await self.interp_idle(interval, timeout)
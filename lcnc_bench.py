@@ -0,0 +1,223 @@
+"""
+  lcnc_bench.py - G-code program throughput benchmark
+
+  Runs synthetic programs of many short segments, arcs or canned cycles
+  while sampling the planner queue and line fields, then reports segments
+  per second, queue starvation and interpreter read-ahead.
+
+  linuxcnc is imported where programs are sampled, so reports can be
+  computed from any recorded samples.
+
+"""
+
+import os
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from lcnc_motion import run_program, write_program
+from lcnc_timing import PeriodicSampler, now
+
+QUEUE_FIELDS = ("queue", "queue_full", "active_queue", "read_line", "current_line", "motion_line")
+
+# Unit of each throughput_report value and whether a larger value is better, for the results database
+REPORT_UNITS = {"segments": ("", True), "run_time": ("s", False), "segments_per_second": ("1/s", True),
+                "queue_mean": ("", True), "queue_max": ("", True), "queue_full_fraction": ("", False),
+                "active_queue_max": ("", True), "read_ahead_mean": ("", True), "read_ahead_max": ("", True),
+                "starvations": ("", False), "starved_time": ("s", False)}
+
+# Axes each benchmark program moves, arcs in the G17 plane and canned cycles drill along Z
+PROGRAM_AXES = {"segments": "X", "arcs": "XY", "canned cycles": "XYZ"}
+
+
+def missing_axes(required: str, axes: str) -> str:
+    """
+    :param required: Axis letters a program moves
+    :param axes: Axis letters of the machine, [TRAJ]COORDINATES
+    :return: Required letters the machine does not have, empty if none
+    """
+    return "".join(axis for axis in required if axis not in axes.upper())
+
+
+def _start(axes: str, feed: float) -> List[str]:
+    return ["G0 " + " ".join(f"{axis}0" for axis in axes), f"F{feed}"]
+
+
+def segment_program(count: int, axes: str = "XY", step: float = 0.001, feed: float = 100.0) -> str:
+    """
+    Zig-zag of short G1 segments, like dense CAM output, straight steps along X on a one axis machine
+    :param count: Number of segments
+    :param axes: Axis letters of the machine, X and the next one are moved
+    :param step: Length of each segment
+    :param feed: Feed rate
+    :return: Program text
+    """
+    if missing_axes("X", axes):
+        raise ValueError(f"Segment program needs an X axis, the machine has {axes}")
+    second = next((axis for axis in axes.upper() if axis != "X"), None)
+    lines = ["G90 G64"] + _start(axes, feed)
+    for idx in range(1, count + 1):
+        line = f"G1 X{idx * step:.4f}"
+        if second is not None:
+            line += f" {second}{(idx % 2) * step:.4f}"
+        lines.append(line)
+    lines.append("M2")
+    return "\n".join(lines) + "\n"
+
+
+def arc_program(count: int, axes: str = "XY", radius: float = 0.01, feed: float = 100.0) -> str:
+    """
+    Half circle arcs alternating G2/G3 along X, in the G17 XY plane
+    :param count: Number of arcs
+    :param axes: Axis letters of the machine, must include X and Y
+    :param radius: Arc radius
+    :param feed: Feed rate
+    :return: Program text
+    """
+    missing = missing_axes(PROGRAM_AXES["arcs"], axes)
+    if missing:
+        raise ValueError(f"Arc program needs axes {missing} for the XY plane, the machine has {axes}")
+    lines = ["G90 G64 G17"] + _start(axes, feed)
+    for idx in range(1, count + 1):
+        lines.append(f"G{2 + idx % 2} X{idx * 2 * radius:.4f} Y0 I{radius:.4f} J0")
+    lines.append("M2")
+    return "\n".join(lines) + "\n"
+
+
+def canned_cycle_program(count: int, axes: str = "XYZ", pitch: float = 0.01, feed: float = 100.0) -> str:
+    """
+    Row of G81 drilling cycles along X, drilling in Z
+    :param count: Number of holes
+    :param axes: Axis letters of the machine, must include X, Y and Z
+    :param pitch: Distance between holes
+    :param feed: Feed rate
+    :return: Program text
+    """
+    missing = missing_axes(PROGRAM_AXES["canned cycles"], axes)
+    if missing:
+        raise ValueError(f"Canned cycle program needs axes {missing}, the machine has {axes}")
+    lines = ["G90 G64 G17 G98"] + _start(axes, feed) + ["G0 Z0.1", "G81 X0 Y0 Z-0.05 R0.01"]
+    for idx in range(1, count):
+        lines.append(f"X{idx * pitch:.4f}")
+    lines += ["G80", "M2"]
+    return "\n".join(lines) + "\n"
+
+
+# Benchmark programs: generator and motion segments per generated item
+PROGRAMS = {"segments": (segment_program, 1), "arcs": (arc_program, 1), "canned cycles": (canned_cycle_program, 3)}
+
+
+class StatusSampler:
+    """Samples numeric status fields from a PeriodicSampler into a growing buffer"""
+
+    def __init__(self, fields: Sequence[str] = QUEUE_FIELDS, stat=None, capacity: int = 65536):
+        """
+        :param fields: Numeric stat attributes to record, one column each
+        :param stat: linuxcnc.stat object owned by the sampler, a new one is created if None
+        :param capacity: Initial number of samples to allocate
+        """
+        if stat is None:
+            import linuxcnc  # pylint: disable=import-outside-toplevel
+            stat = linuxcnc.stat()
+        self.fields = list(fields)
+        self.stat = stat
+        self._times = np.empty(capacity)
+        self._values = np.empty((capacity, len(self.fields)))
+        self._count = 0
+        self._sampler = PeriodicSampler(self._sample)
+
+    def _sample(self):
+        self.stat.poll()
+        if self._count == len(self._times):
+            self._times = np.resize(self._times, len(self._times) * 2)
+            self._values = np.resize(self._values, (len(self._values) * 2, len(self.fields)))
+        self._times[self._count] = now()
+        self._values[self._count] = [getattr(self.stat, field) for field in self.fields]
+        self._count += 1
+
+    def __enter__(self):
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._sampler.stop()
+
+    @property
+    def times(self) -> np.ndarray:
+        """Monotonic timestamp of each sample"""
+        return self._times[:self._count]
+
+    def column(self, field: str) -> np.ndarray:
+        """
+        :param field: One of the recorded fields
+        :return: Recorded values of that field
+        """
+        return self._values[:self._count, self.fields.index(field)]
+
+
+def starvation_intervals(times: np.ndarray, queue: np.ndarray) -> List[Tuple[float, float]]:
+    """
+    Find the periods where the planner queue ran empty between its first and last use
+    :param times: Sample timestamps
+    :param queue: Queue depth of each sample
+    :return: (start, end) times of each empty period
+    """
+    busy = np.flatnonzero(queue > 0)
+    if len(busy) == 0:
+        return []
+    empty = np.zeros(len(queue) + 2, dtype=np.int8)
+    empty[busy[0] + 1:busy[-1] + 1] = queue[busy[0]:busy[-1]] == 0
+    edges = np.diff(empty)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return [(float(times[start]), float(times[end])) for start, end in zip(starts, ends)]
+
+
+def throughput_report(sampler: StatusSampler, segments: int) -> Dict[str, float]:
+    """
+    Summarise a recorded program run
+    :param sampler: StatusSampler that recorded at least QUEUE_FIELDS
+    :param segments: Number of motion segments in the program
+    :return: Dictionary of report values
+    """
+    times = sampler.times
+    queue = sampler.column("queue")
+    read_ahead = sampler.column("read_line") - sampler.column("motion_line")
+    moving = np.flatnonzero(queue > 0)
+    run_time = float(times[moving[-1]] - times[moving[0]]) if len(moving) else 0.0
+    starved = starvation_intervals(times, queue)
+    return {
+        "segments": float(segments),
+        "run_time": run_time,
+        "segments_per_second": segments / run_time if run_time else 0.0,
+        "queue_mean": float(queue[moving].mean()) if len(moving) else 0.0,
+        "queue_max": float(queue.max()),
+        "queue_full_fraction": float(sampler.column("queue_full").mean()),
+        "active_queue_max": float(sampler.column("active_queue").max()),
+        "read_ahead_mean": float(read_ahead[moving].mean()) if len(moving) else 0.0,
+        "read_ahead_max": float(read_ahead.max()),
+        "starvations": float(len(starved)),
+        "starved_time": float(sum(end - start for start, end in starved)),
+    }
+
+
+def run_benchmark(com, stat, program: str, segments: int, timeout: float = 300.0) -> Dict[str, float]:
+    """
+    Run one program while sampling the queue fields
+    The machine must be homed and on
+    :param com: linuxcnc.command object
+    :param stat: linuxcnc.stat object
+    :param program: Program text
+    :param segments: Number of motion segments in the program
+    :param timeout: Seconds to wait for the program to finish
+    :return: throughput_report of the run
+    """
+    path = write_program(program)
+    try:
+        with StatusSampler() as sampler:
+            finished = run_program(com, stat, path, timeout)
+    finally:
+        os.remove(path)
+    if not finished:
+        raise TimeoutError(f"Program did not finish within {timeout}s")
+    return throughput_report(sampler, segments)
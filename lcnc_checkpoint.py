@@ -0,0 +1,251 @@
+"""
+  lcnc_checkpoint.py - Capture and restore the machine state motion tests start from
+
+  The expensive setup (estop reset, machine on, homing) runs once, then a
+  Checkpoint of the state is captured. Before each test restore() puts the
+  controller back with a few cheap commands, and homes again only when
+  the homed flags were lost, e.g. after a LinuxCNC restart.
+
+  linuxcnc is imported where commands are sent, so checkpoints can be
+  compared and saved without a running controller.
+
+"""
+
+import json
+from typing import List, NamedTuple, Optional, Tuple
+
+from lcnc_ini import AXIS_LETTERS, load_ini, machine_axes
+from lcnc_timing import BREAKDOWN, now, wait_for
+
+# Seconds to wait for every joint to home
+HOME_TIMEOUT = 30.0
+
+# Seconds to wait for a state change or an MDI command
+COMMAND_TIMEOUT = 5.0
+
+# Offsets and positions closer than this are treated as equal
+CHECKPOINT_EPS = 1e-6
+
+# stat.linear_units of an inch machine, machine units per mm
+INCH_UNITS = 1 / 25.4
+
+# stat.program_units to the G code selecting them, centimetres have none and are left alone
+PROGRAM_UNIT_CODES = {1: "G20", 2: "G21"}
+
+# g5x_index to the G code selecting that coordinate system
+COORDINATE_SYSTEMS = {1: "G54", 2: "G55", 3: "G56", 4: "G57", 5: "G58", 6: "G59",
+                      7: "G59.1", 8: "G59.2", 9: "G59.3"}
+
+
+class Checkpoint(NamedTuple):
+    """Controller state a motion test expects to start from, positions and offsets in machine units"""
+    ini_filename: str
+    task_state: int
+    task_mode: int
+    homed: Tuple[int, ...]
+    position: Tuple[float, ...]
+    g5x_index: int
+    g5x_offset: Tuple[float, ...]
+    g92_offset: Tuple[float, ...]
+    tool_in_spindle: int
+    tool_offset: Tuple[float, ...]
+
+
+class RestoreReport(NamedTuple):
+    """What restore() had to do"""
+    rehomed: bool
+    commands: List[str]
+    elapsed: float
+
+
+def capture(stat) -> Checkpoint:
+    """
+    :param stat: linuxcnc.stat object, polled here
+    :return: Checkpoint of the current state
+    """
+    stat.poll()
+    return Checkpoint(
+        ini_filename=stat.ini_filename,
+        task_state=stat.task_state,
+        task_mode=stat.task_mode,
+        homed=tuple(stat.homed[:stat.joints]),
+        position=tuple(stat.actual_position),
+        g5x_index=stat.g5x_index,
+        g5x_offset=tuple(stat.g5x_offset),
+        g92_offset=tuple(stat.g92_offset),
+        tool_in_spindle=stat.tool_in_spindle,
+        tool_offset=tuple(stat.tool_offset))
+
+
+def _differs(first, second) -> bool:
+    return any(abs(a - b) > CHECKPOINT_EPS for a, b in zip(first, second))
+
+
+def _words(values, axes: str, scale: float) -> str:
+    return " ".join(f"{letter}{values[AXIS_LETTERS.index(letter)] * scale:.6f}" for letter in axes)
+
+
+def unit_code(linear_units: float) -> Tuple[str, float]:
+    """
+    :param linear_units: stat.linear_units, machine units per mm
+    :return: (G20 or G21, factor from machine units to the units it selects), G21 for anything not in inch
+    """
+    if abs(linear_units - INCH_UNITS) < CHECKPOINT_EPS:
+        return "G20", 1.0
+    return "G21", 1.0 / linear_units
+
+
+def restore_commands(checkpoint: Checkpoint, stat, axes: str) -> List[str]:
+    """
+    MDI commands that bring offsets, tool and position back to the checkpoint
+    stat reports offsets and positions in machine units, while MDI words are read in the program units,
+    so the commands select the machine's units first and the program units in effect again last
+    :param checkpoint: State to restore
+    :param stat: linuxcnc.stat object, already polled
+    :param axes: Axis letters of the machine
+    :return: Commands, empty if nothing changed
+    """
+    code, scale = unit_code(stat.linear_units)
+    commands = []
+    if stat.tool_in_spindle != checkpoint.tool_in_spindle:
+        commands.append(f"M61 Q{checkpoint.tool_in_spindle}")
+    if _differs(stat.tool_offset, checkpoint.tool_offset) or commands:
+        commands.append("G43" if any(checkpoint.tool_offset) else "G49")
+    if _differs(stat.g5x_offset, checkpoint.g5x_offset):
+        commands.append(f"G10 L2 P{checkpoint.g5x_index} {_words(checkpoint.g5x_offset, axes, scale)}")
+    if stat.g5x_index != checkpoint.g5x_index:
+        commands.append(COORDINATE_SYSTEMS[checkpoint.g5x_index])
+    if _differs(stat.g92_offset, checkpoint.g92_offset):
+        # G52 writes the offset G92 uses directly, without reference to the current position
+        commands.append("G92.1")
+        if any(checkpoint.g92_offset):
+            commands.append(f"G52 {_words(checkpoint.g92_offset, axes, scale)}")
+    if _differs(stat.actual_position, checkpoint.position):
+        commands.append(f"G53 G0 {_words(checkpoint.position, axes, scale)}")
+    if not commands:
+        return commands
+    program_code = PROGRAM_UNIT_CODES.get(stat.program_units, code)
+    return [code] + commands + ([program_code] if program_code != code else [])
+
+
+def needs_homing(checkpoint: Checkpoint, stat) -> bool:
+    """
+    :param checkpoint: State to restore
+    :param stat: linuxcnc.stat object, already polled
+    :return: True if a joint homed in the checkpoint is no longer homed
+    """
+    homed = tuple(stat.homed[:stat.joints])
+    return any(was and not now for was, now in zip(checkpoint.homed, homed)) or len(homed) != len(checkpoint.homed)
+
+
+def enable(com, stat, timeout: float = COMMAND_TIMEOUT) -> None:
+    """
+    Reset estop and turn the machine on, waiting for each state
+    :param com: linuxcnc.command object
+    :param stat: linuxcnc.stat object
+    :param timeout: Seconds to wait for each state
+    """
+    import linuxcnc  # pylint: disable=import-outside-toplevel
+    for state in (linuxcnc.STATE_ESTOP_RESET, linuxcnc.STATE_ON):
+        with BREAKDOWN.time("command"):
+            com.state(state)
+        if wait_for(stat, lambda s, state=state: s.task_state == state, timeout) is None:
+            raise TimeoutError(f"task_state did not become {state}")
+
+
+def home_all(com, stat, timeout: float = HOME_TIMEOUT) -> float:
+    """
+    Home every joint and wait until all report homed
+    :param com: linuxcnc.command object
+    :param stat: linuxcnc.stat object
+    :param timeout: Seconds to wait
+    :return: Seconds homing took
+    """
+    import linuxcnc  # pylint: disable=import-outside-toplevel
+    with BREAKDOWN.time("command"):
+        com.mode(linuxcnc.MODE_MANUAL)
+        com.wait_complete()
+        com.home(-1)
+    elapsed = wait_for(stat, lambda s: all(s.homed[:s.joints]), timeout)
+    if elapsed is None:
+        raise TimeoutError("Joints did not home")
+    return elapsed
+
+
+def setup(com, stat) -> Checkpoint:
+    """
+    The expensive setup, once: enable, home and capture
+    :param com: linuxcnc.command object
+    :param stat: linuxcnc.stat object
+    :return: Checkpoint of the homed machine
+    """
+    enable(com, stat)
+    home_all(com, stat)
+    return capture(stat)
+
+
+def restore(com, stat, checkpoint: Checkpoint, axes: Optional[str] = None,
+            timeout: float = COMMAND_TIMEOUT) -> RestoreReport:
+    """
+    Bring the controller back to a checkpoint, homing only if the homed flags were lost
+    :param com: linuxcnc.command object
+    :param stat: linuxcnc.stat object
+    :param checkpoint: State to restore
+    :param axes: Axis letters of the machine, [TRAJ]COORDINATES if None
+    :param timeout: Seconds to wait for each command
+    :return: RestoreReport
+    """
+    import linuxcnc  # pylint: disable=import-outside-toplevel
+    start = now()
+    stat.poll()
+    if stat.ini_filename != checkpoint.ini_filename:
+        raise ValueError(f"Checkpoint is for {checkpoint.ini_filename}, LinuxCNC runs {stat.ini_filename}")
+    if axes is None:
+        axes = machine_axes(load_ini(stat.ini_filename))
+
+    if stat.task_state != linuxcnc.STATE_ON:
+        enable(com, stat, timeout)
+    rehomed = needs_homing(checkpoint, stat)
+    if rehomed:
+        home_all(com, stat)
+
+    stat.poll()
+    commands = restore_commands(checkpoint, stat, axes)
+    if commands:
+        with BREAKDOWN.time("command"):
+            com.mode(linuxcnc.MODE_MDI)
+            com.wait_complete()
+        for command in commands:
+            with BREAKDOWN.time("command"):
+                com.mdi(command)
+                if com.wait_complete(timeout) == -1:
+                    raise TimeoutError(f"MDI {command} did not complete")
+
+    stat.poll()
+    if stat.task_mode != checkpoint.task_mode:
+        with BREAKDOWN.time("command"):
+            com.mode(checkpoint.task_mode)
+            com.wait_complete()
+    return RestoreReport(rehomed, commands, now() - start)
+
+
+def save(checkpoint: Checkpoint, path: str) -> None:
+    """
+    Keep a checkpoint between sessions
+    :param checkpoint: Checkpoint to save
+    :param path: JSON file
+    """
+    with open(path, "w", encoding="utf8") as output:
+        json.dump(checkpoint._asdict(), output, indent=1)
+
+
+def load(path: str) -> Checkpoint:
+    """
+    :param path: File written by save
+    :return: Saved checkpoint
+    """
+    with open(path, encoding="utf8") as saved:
+        values = json.load(saved)
+    # Fields of older checkpoints, e.g. position_file, are ignored
+    return Checkpoint(**{key: tuple(value) if isinstance(value, list) else value for key, value in values.items()
+                         if key in Checkpoint._fields})
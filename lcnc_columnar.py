@@ -0,0 +1,472 @@
+"""
+  lcnc_columnar.py - Column wise compressed status recordings
+
+  Samples are buffered per field and written in chunks, each field of a
+  chunk as its own zlib block. A JSON footer indexes every chunk by time
+  and every column by file offset, so a query reads only the columns and
+  chunks it needs, whatever the length of the recording. Every chunk also
+  starts with a header giving its times and block sizes, so the index of
+  a recording that was never closed, e.g. after a crash, is rebuilt by
+  scanning the headers of the chunks written before it stopped.
+
+  Exports stream one chunk at a time, to CSV and to .npz alike, so they
+  need no more memory than a chunk whatever the length of the range.
+
+  python3 lcnc_columnar.py fields run.lcol
+  python3 lcnc_columnar.py slice run.lcol --fields gcodes,current_vel --start 10 --end 20
+  python3 lcnc_columnar.py export run.lcol out.csv --fields current_vel
+  python3 lcnc_columnar.py export run.lcol out.npz --start 3600
+
+"""
+
+import argparse
+import csv
+import json
+import struct
+import sys
+import zipfile
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from lcnc_shm import field_format
+from lcnc_status import stat_fields, take_snapshot
+from lcnc_timing import PeriodicSampler, timestamp
+
+MAGIC = b"LCNCCOL1"
+TRAILER = struct.Struct("<Q8s")
+
+# Marker and JSON length in front of every chunk
+CHUNK_MARKER = b"CHNK"
+CHUNK_HEADER = struct.Struct("<4sI")
+
+# Samples per chunk, the unit of reading and of memory use
+CHUNK_ROWS = 4096
+
+# struct kind from field_format to numpy dtype
+DTYPES = {"?": "bool", "q": "int64", "d": "float64"}
+
+# Seconds between samples of ColumnarRecorder
+RECORD_INTERVAL = 0.01
+
+
+def column_type(value) -> Dict[str, object]:
+    """
+    Storage for a field, from its first value
+    :param value: Field value
+    :return: {"dtype": ..., "shape": [...]} for fixed size numeric fields, {"dtype": "json"} otherwise
+    """
+    fmt = field_format(value)
+    if fmt is None:
+        return {"dtype": "json", "shape": []}
+    count = fmt[:-1]
+    return {"dtype": DTYPES[fmt[-1]], "shape": [int(count)] if count else []}
+
+
+def chunk_index(header: Dict[str, object], offset: int) -> Dict[str, object]:
+    """
+    :param header: Chunk header, block sizes in the order the blocks follow it
+    :param offset: File offset of the first block
+    :return: Footer entry of the chunk, with the offset and length of the time block and each column block
+    """
+    locations = {}
+    for name, length in header["blocks"].items():
+        locations[name] = [offset, length]
+        offset += length
+    return {"start": header["start"], "end": header["end"], "rows": header["rows"], "time": locations.pop("time"),
+            "columns": locations}
+
+
+class ColumnarWriter:
+    """Appends snapshots to a columnar file, use as a context manager or call close()"""
+
+    def __init__(self, path: str, chunk_rows: int = CHUNK_ROWS, level: int = 6):
+        """
+        :param path: Output file, overwritten
+        :param chunk_rows: Samples per chunk
+        :param level: zlib compression level
+        """
+        self.file = open(path, "wb")  # pylint: disable=consider-using-with
+        self.file.write(MAGIC)
+        self.chunk_rows = chunk_rows
+        self.level = level
+        self.columns: Dict[str, Dict[str, object]] = {}
+        self.chunks: List[Dict[str, object]] = []
+        self.times: List[float] = []
+        self.pending: Dict[str, list] = {}
+        self.rows = 0
+
+    def append(self, timestamp: float, snapshot: Dict[str, object]) -> None:
+        """
+        Add one sample, the fields of the first sample are the columns of the file
+        :param timestamp: Sample time in seconds, increasing
+        :param snapshot: Dictionary of field to value, as from take_snapshot
+        """
+        if not self.columns:
+            self.columns = {field: column_type(value) for field, value in snapshot.items()}
+            self.pending = {field: [] for field in self.columns}
+        self.times.append(timestamp)
+        for field, values in self.pending.items():
+            values.append(snapshot[field])
+        self.rows += 1
+        if len(self.times) >= self.chunk_rows:
+            self.flush()
+
+    def _compress(self, field: str, values: list) -> bytes:
+        dtype = self.columns[field]["dtype"]
+        if dtype == "json":
+            data = json.dumps(values, default=repr).encode("utf8")
+        else:
+            data = np.asarray(values, dtype=dtype).tobytes()
+        return zlib.compress(data, self.level)
+
+    def flush(self) -> None:
+        """Write the buffered samples as one chunk, its header first, and push it to the file"""
+        if not self.times:
+            return
+        blocks = {"time": zlib.compress(np.asarray(self.times, dtype="float64").tobytes(), self.level)}
+        for field, values in self.pending.items():
+            blocks[field] = self._compress(field, values)
+            values.clear()
+        header = {"start": self.times[0], "end": self.times[-1], "rows": len(self.times),
+                  "blocks": {name: len(block) for name, block in blocks.items()}}
+        if not self.chunks:
+            header["columns"] = self.columns
+        text = json.dumps(header).encode("utf8")
+        self.file.write(CHUNK_HEADER.pack(CHUNK_MARKER, len(text)) + text)
+        self.chunks.append(chunk_index(header, self.file.tell()))
+        for block in blocks.values():
+            self.file.write(block)
+        self.file.flush()
+        self.times = []
+
+    def close(self) -> None:
+        """Write the last chunk and the index"""
+        if self.file.closed:
+            return
+        self.flush()
+        footer_offset = self.file.tell()
+        self.file.write(json.dumps({"columns": self.columns, "chunks": self.chunks}).encode("utf8"))
+        self.file.write(TRAILER.pack(footer_offset, MAGIC))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ColumnarReader:
+    """Reads columns and time ranges of a columnar file without loading the rest"""
+
+    def __init__(self, path: str):
+        """
+        :param path: File written by ColumnarWriter
+        """
+        self.file = open(path, "rb")  # pylint: disable=consider-using-with
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a columnar status recording")
+        size = self.file.seek(0, 2)
+        magic = None
+        if size >= len(MAGIC) + TRAILER.size:
+            self.file.seek(-TRAILER.size, 2)
+            footer_offset, magic = TRAILER.unpack(self.file.read(TRAILER.size))
+        # False for a recording that was not closed, its index was rebuilt from the chunk headers
+        self.complete = magic == MAGIC
+        if self.complete:
+            self.file.seek(footer_offset)
+            footer = json.loads(self.file.read(size - TRAILER.size - footer_offset))
+            self.columns: Dict[str, Dict[str, object]] = footer["columns"]
+            self.chunks: List[Dict[str, object]] = footer["chunks"]
+        else:
+            self.columns, self.chunks = self._scan(size)
+
+    def _scan(self, size: int):
+        """Index the complete chunks from their headers, a chunk cut off by the end of the file is left out"""
+        columns, chunks = {}, []
+        offset = len(MAGIC)
+        while offset + CHUNK_HEADER.size <= size:
+            self.file.seek(offset)
+            marker, length = CHUNK_HEADER.unpack(self.file.read(CHUNK_HEADER.size))
+            if marker != CHUNK_MARKER:
+                break
+            try:
+                header = json.loads(self.file.read(length))
+            except ValueError:
+                break
+            offset += CHUNK_HEADER.size + length
+            chunk = chunk_index(header, offset)
+            offset += sum(header["blocks"].values())
+            if offset > size:
+                break
+            columns = columns or header.get("columns", {})
+            chunks.append(chunk)
+        return columns, chunks
+
+    @property
+    def rows(self) -> int:
+        """Samples in the file"""
+        return sum(chunk["rows"] for chunk in self.chunks)
+
+    @property
+    def start(self) -> Optional[float]:
+        """Time of the first sample"""
+        return self.chunks[0]["start"] if self.chunks else None
+
+    @property
+    def end(self) -> Optional[float]:
+        """Time of the last sample"""
+        return self.chunks[-1]["end"] if self.chunks else None
+
+    def _read_block(self, location: List[int]) -> bytes:
+        offset, length = location
+        self.file.seek(offset)
+        return zlib.decompress(self.file.read(length))
+
+    def _read_column(self, chunk: Dict[str, object], field: str) -> np.ndarray:
+        column = self.columns[field]
+        data = self._read_block(chunk["columns"][field])
+        if column["dtype"] == "json":
+            values = np.empty(chunk["rows"], dtype=object)
+            values[:] = json.loads(data)
+            return values
+        return np.frombuffer(data, dtype=column["dtype"]).reshape([chunk["rows"]] + column["shape"])
+
+    def iter_chunks(self, fields: Optional[Iterable[str]] = None, start: Optional[float] = None,
+                    end: Optional[float] = None) -> Iterator[Dict[str, np.ndarray]]:
+        """
+        Read a time range one chunk at a time, chunks outside the range are never read
+        :param fields: Columns to read, all of them if None
+        :param start: First time to include, from the beginning if None
+        :param end: Last time to include, to the end if None
+        :return: Iterator of dictionaries of "time" and each field to its values in one chunk
+        """
+        fields = list(self.columns) if fields is None else list(fields)
+        for field in fields:
+            if field not in self.columns:
+                raise KeyError(f"No column {field}, the recording has {', '.join(self.columns)}")
+        for chunk in self.chunks:
+            if (start is not None and chunk["end"] < start) or (end is not None and chunk["start"] > end):
+                continue
+            times = np.frombuffer(self._read_block(chunk["time"]), dtype="float64")
+            keep = np.ones(len(times), dtype=bool)
+            if start is not None:
+                keep &= times >= start
+            if end is not None:
+                keep &= times <= end
+            result = {"time": times[keep]}
+            for field in fields:
+                result[field] = self._read_column(chunk, field)[keep]
+            yield result
+
+    def query(self, fields: Optional[Iterable[str]] = None, start: Optional[float] = None,
+              end: Optional[float] = None) -> Dict[str, np.ndarray]:
+        """
+        Read a time range of some columns
+        :param fields: Columns to read, all of them if None
+        :param start: First time to include, from the beginning if None
+        :param end: Last time to include, to the end if None
+        :return: Dictionary of "time" and each field to an array with one row per sample
+        """
+        fields = list(self.columns) if fields is None else list(fields)
+        parts = list(self.iter_chunks(fields, start, end))
+        result = {}
+        for name in ["time"] + fields:
+            if parts:
+                result[name] = np.concatenate([part[name] for part in parts])
+            else:
+                column = self.columns.get(name, {"dtype": "float64", "shape": []})
+                dtype = object if column["dtype"] == "json" else column["dtype"]
+                result[name] = np.empty([0] + column["shape"], dtype=dtype)
+        return result
+
+    def close(self) -> None:
+        """Close the file"""
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ColumnarRecorder:
+    """
+    Polls stat from a PeriodicSampler into a ColumnarWriter
+    Use as a context manager around the run to record
+    """
+
+    def __init__(self, path: str, fields: Optional[Iterable[str]] = None, stat=None,
+                 interval: float = RECORD_INTERVAL, chunk_rows: int = CHUNK_ROWS, indexer=None):
+        """
+        :param path: Output file
+        :param fields: Fields to record, all of them if None
+        :param stat: linuxcnc.stat object owned by the recorder, a new one is created if None
+        :param interval: Seconds to sleep between samples
+        :param chunk_rows: Samples per chunk
+        :param indexer: lcnc_events.EventIndexer fed every sample, to index transitions while recording
+        """
+        if stat is None:
+            import linuxcnc  # pylint: disable=import-outside-toplevel
+            stat = linuxcnc.stat()
+        self.stat = stat
+        self.fields = None if fields is None else list(fields)
+        self.interval = interval
+        self.writer = ColumnarWriter(path, chunk_rows)
+        self.indexer = indexer
+        self._sampler = PeriodicSampler(self._sample, interval)
+
+    def _sample(self):
+        self.stat.poll()
+        if self.fields is None:
+            self.fields = stat_fields(self.stat)
+        now = timestamp()
+        snapshot = take_snapshot(self.stat, self.fields)
+        self.writer.append(now, snapshot)
+        if self.indexer is not None:
+            self.indexer.observe(now, snapshot)
+
+    def start(self):
+        """Start sampling"""
+        self._sampler.start()
+
+    def stop(self):
+        """Stop sampling, wait for the thread and close the file"""
+        self._sampler.stop()
+        self.writer.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def csv_header(reader: ColumnarReader, fields: List[str]) -> List[str]:
+    """
+    :param reader: Open recording
+    :param fields: Exported fields
+    :return: Column names, arrays are split into field[index] columns
+    """
+    header = ["time"]
+    for field in fields:
+        shape = reader.columns[field]["shape"]
+        header.extend([f"{field}[{index}]" for index in range(shape[0])] if shape else [field])
+    return header
+
+
+def write_csv(reader: ColumnarReader, output, fields: List[str], start: Optional[float] = None,
+              end: Optional[float] = None) -> int:
+    """
+    Stream a time range as CSV, one chunk in memory at a time
+    :param reader: Open recording
+    :param output: Text file
+    :param fields: Fields to export
+    :param start: First time to include
+    :param end: Last time to include
+    :return: Rows written
+    """
+    writer = csv.writer(output)
+    writer.writerow(csv_header(reader, fields))
+    rows = 0
+    for part in reader.iter_chunks(fields, start, end):
+        for row in range(len(part["time"])):
+            line = [repr(float(part["time"][row]))]
+            for field in fields:
+                value = part[field][row]
+                if reader.columns[field]["dtype"] == "json":
+                    line.append(json.dumps(value, default=repr))
+                elif reader.columns[field]["shape"]:
+                    line.extend(value.tolist())
+                else:
+                    line.append(value.item())
+            writer.writerow(line)
+            rows += 1
+    return rows
+
+
+def write_npz(reader: ColumnarReader, path: str, fields: List[str], start: Optional[float] = None,
+              end: Optional[float] = None) -> int:
+    """
+    Stream a time range into an .npz file, one chunk in memory at a time
+    Each array is written header first and then chunk by chunk, np.savez would need them all in memory,
+    JSON fields become strings as wide as their longest value
+    :param reader: Open recording
+    :param path: Output .npz file
+    :param fields: Fields to export
+    :param start: First time to include
+    :param end: Last time to include
+    :return: Rows written
+    """
+    rows = sum(len(part["time"]) for part in reader.iter_chunks([], start, end))
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name in ["time"] + fields:
+            column = reader.columns.get(name, {"dtype": "float64", "shape": []})
+            parts = [] if name == "time" else [name]
+            if column["dtype"] == "json":
+                width = max((len(json.dumps(value, default=repr))
+                             for part in reader.iter_chunks(parts, start, end) for value in part[name]), default=1)
+                dtype = np.dtype(f"<U{width}")
+            else:
+                dtype = np.dtype(column["dtype"])
+            with archive.open(name + ".npy", "w", force_zip64=True) as member:
+                np.lib.format.write_array_header_1_0(member, {"descr": np.lib.format.dtype_to_descr(dtype),
+                                                              "fortran_order": False,
+                                                              "shape": tuple([rows] + column["shape"])})
+                for part in reader.iter_chunks(parts, start, end):
+                    values = part[name]
+                    if column["dtype"] == "json":
+                        values = [json.dumps(value, default=repr) for value in values]
+                    member.write(np.asarray(values, dtype=dtype).tobytes())
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command line interface, --start and --end are seconds from the first sample
+    :param argv: Arguments, sys.argv[1:] if None
+    :return: Exit code
+    """
+    parser = argparse.ArgumentParser(description="Query columnar LinuxCNC status recordings")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("fields", help="List the recorded fields").add_argument("file")
+    for name, text in [("slice", "Print a time range as CSV"), ("export", "Write a time range to .csv or .npz")]:
+        command = commands.add_parser(name, help=text)
+        command.add_argument("file")
+        if name == "export":
+            command.add_argument("output")
+        command.add_argument("--fields", help="Comma separated fields, all if omitted")
+        command.add_argument("--start", type=float, help="Seconds from the first sample")
+        command.add_argument("--end", type=float, help="Seconds from the first sample")
+    args = parser.parse_args(argv)
+
+    with ColumnarReader(args.file) as reader:
+        if args.command == "fields":
+            duration = reader.end - reader.start if reader.chunks else 0.0
+            print(f"{reader.rows} samples in {len(reader.chunks)} chunks over {duration:.1f} s")
+            for field, column in reader.columns.items():
+                shape = "".join(f"[{size}]" for size in column["shape"])
+                print(f"  {field}: {column['dtype']}{shape}")
+            return 0
+
+        fields = args.fields.split(",") if args.fields else list(reader.columns)
+        start = None if args.start is None or reader.start is None else reader.start + args.start
+        end = None if args.end is None or reader.start is None else reader.start + args.end
+        if args.command == "slice":
+            write_csv(reader, sys.stdout, fields, start, end)
+        elif args.output.endswith(".npz"):
+            rows = write_npz(reader, args.output, fields, start, end)
+            print(f"{rows} rows written to {args.output}")
+        else:
+            with open(args.output, "w", newline="", encoding="utf8") as output:
+                rows = write_csv(reader, output, fields, start, end)
+            print(f"{rows} rows written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""
+  lcnc_errors.py - Background drain of the LinuxCNC error channel
+
+  ErrorDrain polls linuxcnc.error_channel on a PeriodicSampler, so errors
+  are read as they arrive instead of whenever someone thinks to poll, and
+  keeps them in a bounded queue as timestamped ErrorEvents. The last
+  commands sent through track() are remembered, an error is credited to
+  the newest one sent at most ERROR_ATTRIBUTION seconds before it was
+  read, with the seconds in between. Errors with no command that recent,
+  e.g. a limit hit long after the move started, have command and latency
+  None.
+
+  The error channel hands each message to one reader only, so a process
+  should run one drain: the monitor window's is optional for that reason.
+
+  drain = ErrorDrain(linuxcnc.error_channel()); drain.start()
+  com = track(linuxcnc.command(), drain); com.mdi("G0 X1000")
+  error = drain.wait_error(lambda e: "limit" in e.text, timeout=1.0)
+
+"""
+
+import threading
+from collections import deque
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from lcnc_timing import PeriodicSampler, now, sleep, timestamp
+
+# error_channel kinds, same values as the linuxcnc module, which the monitor window imports late
+NML_ERROR, NML_TEXT, NML_DISPLAY = 1, 2, 3
+OPERATOR_ERROR, OPERATOR_TEXT, OPERATOR_DISPLAY = 11, 12, 13
+KIND_NAMES = {NML_ERROR: "NML_ERROR", NML_TEXT: "NML_TEXT", NML_DISPLAY: "NML_DISPLAY",
+              OPERATOR_ERROR: "OPERATOR_ERROR", OPERATOR_TEXT: "OPERATOR_TEXT", OPERATOR_DISPLAY: "OPERATOR_DISPLAY"}
+
+# Seconds between error channel polls
+ERROR_INTERVAL = 0.01
+
+# Errors kept, the oldest are dropped and counted once the queue is full
+ERROR_QUEUE_SIZE = 1000
+
+# Seconds after sending a command that an error is still credited to it
+ERROR_ATTRIBUTION = 1.0
+
+# Commands remembered for attribution
+COMMAND_HISTORY = 32
+
+
+class ErrorEvent(NamedTuple):
+    """
+    One error channel message
+    command is the newest tracked command sent at most ERROR_ATTRIBUTION seconds before the message was read,
+    latency the seconds in between, both None without one
+    """
+    time: float
+    monotonic: float
+    kind: int
+    text: str
+    command: Optional[str]
+    latency: Optional[float]
+
+    @property
+    def kind_name(self) -> str:
+        """Constant name of the kind, e.g. OPERATOR_ERROR"""
+        return KIND_NAMES.get(self.kind, str(self.kind))
+
+    @property
+    def is_error(self) -> bool:
+        """True for NML_ERROR and OPERATOR_ERROR, False for text and display messages"""
+        return self.kind in (NML_ERROR, OPERATOR_ERROR)
+
+
+class ErrorDrain:
+    """Reads an error channel in the background into a bounded queue"""
+
+    def __init__(self, channel, interval: float = ERROR_INTERVAL, size: int = ERROR_QUEUE_SIZE, indexer=None,
+                 attribution: float = ERROR_ATTRIBUTION):
+        """
+        :param channel: linuxcnc.error_channel object
+        :param interval: Seconds between polls
+        :param size: Errors kept
+        :param indexer: lcnc_events.EventIndexer to add every error to, optional
+        :param attribution: Seconds after sending a command that an error is still credited to it
+        """
+        self.channel = channel
+        self.indexer = indexer
+        self.attribution = attribution
+        self.events = deque(maxlen=size)
+        # Errors read since start and errors pushed out of the full queue
+        self.received = 0
+        self.dropped = 0
+        self.last: Optional[ErrorEvent] = None
+        # (command, monotonic time sent) of the last COMMAND_HISTORY tracked commands, oldest first
+        self.commands = deque(maxlen=COMMAND_HISTORY)
+        self._lock = threading.Lock()
+        self._sampler = PeriodicSampler(self.drain, interval)
+
+    def start(self) -> None:
+        """Start draining"""
+        self._sampler.start()
+
+    def stop(self) -> None:
+        """Stop draining, errors already read stay queued"""
+        self._sampler.stop()
+
+    def command_sent(self, command: str) -> None:
+        """
+        Remember a command, errors read within the attribution window after it are credited to it
+        :param command: Description, e.g. mdi G0 X1
+        """
+        with self._lock:
+            self.commands.append((command, now()))
+
+    def _attribute(self, arrived: float) -> Tuple[Optional[str], Optional[float]]:
+        for command, sent in reversed(self.commands):
+            if sent <= arrived:
+                latency = arrived - sent
+                return (command, latency) if latency <= self.attribution else (None, None)
+        return None, None
+
+    def drain(self) -> List[ErrorEvent]:
+        """
+        Read every waiting message, called by the sampler
+        :return: Events read
+        """
+        read = []
+        while True:
+            error = self.channel.poll()
+            if not error:
+                return read
+            arrived = now()
+            with self._lock:
+                event = ErrorEvent(timestamp(), arrived, error[0], error[1], *self._attribute(arrived))
+                if len(self.events) == self.events.maxlen:
+                    self.dropped += 1
+                self.events.append(event)
+                self.received += 1
+                self.last = event
+            if self.indexer is not None:
+                self.indexer.observe_error(event.time, error)
+            read.append(event)
+
+    def take(self) -> List[ErrorEvent]:
+        """
+        :return: Every queued event, oldest first, the queue is emptied
+        """
+        with self._lock:
+            events = list(self.events)
+            self.events.clear()
+        return events
+
+    def clear(self) -> None:
+        """Forget queued events and the remembered commands"""
+        with self._lock:
+            self.events.clear()
+            self.commands.clear()
+
+    def _pop(self, condition: Optional[Callable[[ErrorEvent], bool]]) -> Optional[ErrorEvent]:
+        with self._lock:
+            for event in self.events:
+                if condition is None or condition(event):
+                    self.events.remove(event)
+                    return event
+        return None
+
+    def wait_error(self, condition: Optional[Callable[[ErrorEvent], bool]] = None, timeout: float = 1.0,
+                   interval: float = ERROR_INTERVAL) -> Optional[ErrorEvent]:
+        """
+        Wait for a queued event, removing it from the queue
+        :param condition: Called with each event, None takes the oldest
+        :param timeout: Seconds to wait
+        :param interval: Seconds between looks at the queue
+        :return: First matching event, None on timeout
+        """
+        start = now()
+        while True:
+            event = self._pop(condition)
+            if event is not None or now() - start > timeout:
+                return event
+            sleep(interval)
+
+
+class TrackedCommand:
+    """linuxcnc.command wrapper telling an ErrorDrain about every command sent"""
+
+    def __init__(self, command, drain: ErrorDrain):
+        """
+        :param command: linuxcnc.command object
+        :param drain: ErrorDrain attributing errors to the commands
+        """
+        self._command = command
+        self._drain = drain
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._command, name)
+        if not callable(attribute) or name.startswith("wait"):
+            return attribute
+
+        def send(*args):
+            self._drain.command_sent(" ".join([name, *map(str, args)]))
+            return attribute(*args)
+        return send
+
+
+def track(command, drain: ErrorDrain) -> TrackedCommand:
+    """
+    :param command: linuxcnc.command object
+    :param drain: ErrorDrain to tell about commands
+    :return: Command object sending through command and noting each command in drain
+    """
+    return TrackedCommand(command, drain)
+
+
+def format_error(event: ErrorEvent) -> str:
+    """
+    :param event: Error to show
+    :return: One line for the status bar, with the command and latency when known
+    """
+    text = f"{event.kind_name}: {event.text}"
+    if event.command is not None:
+        text += f" ({event.latency * 1000:.0f} ms after {event.command})"
+    return text
@@ -0,0 +1,322 @@
+"""
+  lcnc_events.py - Sorted index of status transitions
+
+  Every change of the watched fields becomes an Event. Events are kept in
+  time order per field and overall, so "every estop edge" or "the modal
+  state at t" is a bisect instead of a scan of the recording. The index is
+  built live with EventIndexer.observe, or in one pass over a columnar
+  recording that reads only the watched columns, and saved next to it.
+
+  gcodes and mcodes are indexed per modal group, under the group's name
+  (e.g. "motion" for gcodes[1], "coolant_flood" for mcodes[5]), so every
+  modal group change is a lookup of MODAL_GROUPS.
+
+  python3 lcnc_events.py build run.lcol
+  python3 lcnc_events.py list run.lcol --field estop --field motion --start 10 --end 20
+  python3 lcnc_events.py list run.lcol --modal
+
+"""
+
+import argparse
+import bisect
+import json
+import os
+import sys
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+import numpy as np
+
+from lcnc_columnar import ColumnarReader
+from lcnc_status import parse_field
+
+# Whole fields indexed on every change
+EVENT_FIELDS = ["task_state", "task_mode", "estop", "interp_state"]
+
+# Modal group of each gcodes and mcodes slot, in the order the interpreter fills them
+# Slot 0 is the line number and gcodes[12] is unused, neither is indexed
+MODAL_SLOTS = {
+    "gcodes": {1: "motion", 2: "non_modal", 3: "plane", 4: "cutter_compensation", 5: "units",
+               6: "distance_mode", 7: "feed_rate_mode", 8: "coordinate_system", 9: "tool_length_offset",
+               10: "canned_cycle_return", 11: "path_control", 13: "spindle_speed_mode", 14: "arc_distance_mode",
+               15: "lathe_diameter_mode", 16: "g92_offset"},
+    "mcodes": {1: "stopping", 2: "spindle", 3: "tool_change", 4: "coolant_mist", 5: "coolant_flood",
+               6: "overrides", 7: "adaptive_feed", 8: "feed_hold"},
+}
+
+# Fields indexed per modal group
+MODAL_FIELDS = list(MODAL_SLOTS)
+
+# Field and slot of each modal group name
+MODAL_PATHS = {group: (field, slot) for field, slots in MODAL_SLOTS.items() for slot, group in slots.items()}
+
+# Every modal group name, the fields to ask an index for every modal group change
+MODAL_GROUPS = list(MODAL_PATHS)
+
+# Field name of error channel events, new is [kind, text]
+ERROR_FIELD = "error"
+
+
+class Event(NamedTuple):
+    """One transition, old is None for the first value seen"""
+    time: float
+    field: str
+    old: object
+    new: object
+
+
+def _plain(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class EventIndex:
+    """Events sorted by time, overall and per field"""
+
+    def __init__(self, events: Iterable[Event] = ()):
+        """
+        :param events: Initial events, in time order
+        """
+        self.events: List[Event] = []
+        self.times: List[float] = []
+        self.by_field: Dict[str, List[Event]] = {}
+        self.field_times: Dict[str, List[float]] = {}
+        for event in events:
+            self.add(event)
+
+    def add(self, event: Event) -> None:
+        """
+        Append an event, kept sorted if it is older than the last one
+        :param event: Event to add
+        """
+        for events, times in [(self.events, self.times),
+                              (self.by_field.setdefault(event.field, []),
+                               self.field_times.setdefault(event.field, []))]:
+            if times and event.time < times[-1]:
+                position = bisect.bisect_right(times, event.time)
+                events.insert(position, event)
+                times.insert(position, event.time)
+            else:
+                events.append(event)
+                times.append(event.time)
+
+    @property
+    def fields(self) -> List[str]:
+        """Fields with at least one event"""
+        return sorted(self.by_field)
+
+    def between(self, start: Optional[float] = None, end: Optional[float] = None,
+                fields: Optional[Iterable[str]] = None) -> List[Event]:
+        """
+        :param start: First time to include, from the beginning if None
+        :param end: Last time to include, to the end if None
+        :param fields: Fields to include, all of them if None
+        :return: Events in the range, in time order
+        """
+        if fields is None:
+            return self._slice(self.events, self.times, start, end)
+        selected = []
+        for field in fields:
+            selected.extend(self._slice(self.by_field.get(field, []), self.field_times.get(field, []), start, end))
+        return sorted(selected, key=lambda event: event.time)
+
+    @staticmethod
+    def _slice(events: List[Event], times: List[float], start: Optional[float], end: Optional[float]) -> List[Event]:
+        first = 0 if start is None else bisect.bisect_left(times, start)
+        last = len(times) if end is None else bisect.bisect_right(times, end)
+        return events[first:last]
+
+    def previous(self, field: str, time: float) -> Optional[Event]:
+        """
+        :return: Last event of field at or before time, None if there is none
+        """
+        position = bisect.bisect_right(self.field_times.get(field, []), time)
+        return self.by_field[field][position - 1] if position else None
+
+    def next(self, field: str, time: float) -> Optional[Event]:
+        """
+        :return: First event of field after time, None if there is none
+        """
+        times = self.field_times.get(field, [])
+        position = bisect.bisect_right(times, time)
+        return self.by_field[field][position] if position < len(times) else None
+
+    def value_at(self, field: str, time: float):
+        """
+        :return: Value of field in effect at time, None before its first event
+        """
+        event = self.previous(field, time)
+        return None if event is None else event.new
+
+    def save(self, path: str) -> None:
+        """
+        Write the events as JSON Lines
+        :param path: Output file
+        """
+        with open(path, "w", encoding="utf8") as output:
+            for event in self.events:
+                output.write(json.dumps(list(event), default=repr) + "\n")
+
+    @classmethod
+    def load(cls, path: str) -> "EventIndex":
+        """
+        :param path: File written by save
+        :return: Index of the saved events
+        """
+        with open(path, encoding="utf8") as events:
+            return cls(Event(*json.loads(line)) for line in events)
+
+
+def event_paths(snapshot: Dict[str, object]) -> List[str]:
+    """
+    :param snapshot: A snapshot with the fields to index
+    :return: EVENT_FIELDS and the name of every modal group whose slot is present
+    """
+    paths = [field for field in EVENT_FIELDS if field in snapshot]
+    for field in MODAL_FIELDS:
+        if field in snapshot:
+            paths.extend(group for slot, group in MODAL_SLOTS[field].items() if slot < len(snapshot[field]))
+    return paths
+
+
+class EventIndexer:
+    """Builds an EventIndex from snapshots as they are recorded"""
+
+    def __init__(self, index: Optional[EventIndex] = None, paths: Optional[List[str]] = None):
+        """
+        :param index: Index to add to, a new one if None
+        :param paths: Field paths or modal group names to watch, from event_paths of the first snapshot if None
+        """
+        self.index = index if index is not None else EventIndex()
+        self.paths = paths
+        self.fields: Dict[str, tuple] = {}
+        self.last: Dict[str, object] = {}
+
+    def observe(self, time: float, snapshot: Dict[str, object]) -> List[Event]:
+        """
+        Add an event for every watched field that changed
+        :param time: Sample time
+        :param snapshot: Dictionary of field to value, as from take_snapshot
+        :return: Events added
+        """
+        if self.paths is None:
+            self.paths = event_paths(snapshot)
+        added = []
+        for path in self.paths:
+            if path not in self.fields:
+                self.fields[path] = MODAL_PATHS.get(path) or parse_field(path)
+            name, index = self.fields[path]
+            value = snapshot[name] if index is None else snapshot[name][index]
+            value = _plain(value)
+            if path not in self.last or self.last[path] != value:
+                event = Event(time, path, self.last.get(path), value)
+                self.index.add(event)
+                added.append(event)
+                self.last[path] = value
+        return added
+
+    def observe_error(self, time: float, error) -> Optional[Event]:
+        """
+        Add an error channel message
+        :param time: Time the message was read
+        :param error: Result of linuxcnc.error_channel().poll(), (kind, text) or None
+        :return: Event added, None if there was no message
+        """
+        if not error:
+            return None
+        event = Event(time, ERROR_FIELD, None, [error[0], error[1]])
+        self.index.add(event)
+        return event
+
+
+def index_recording(reader: ColumnarReader) -> EventIndex:
+    """
+    One pass over a columnar recording, reading only the watched columns
+    Changes are found with NumPy per chunk, rows without changes are never visited
+    :param reader: Open recording
+    :return: Index of every transition
+    """
+    index = EventIndex()
+    fields = [field for field in EVENT_FIELDS + MODAL_FIELDS if field in reader.columns]
+    last: Dict[str, object] = {}
+    for part in reader.iter_chunks(fields):
+        times = part["time"]
+        changes = []
+        for field in fields:
+            values = part[field]
+            columns = [(field, values)] if values.ndim == 1 else \
+                [(group, values[:, slot]) for slot, group in MODAL_SLOTS[field].items() if slot < values.shape[1]]
+            for path, column in columns:
+                previous = last.get(path)
+                changed = np.flatnonzero(column[1:] != column[:-1]) + 1
+                if previous is None or previous != column[0]:
+                    changed = np.concatenate([[0], changed])
+                for row in changed:
+                    new = _plain(column[row])
+                    old = previous if row == 0 else _plain(column[row - 1])
+                    changes.append(Event(float(times[row]), path, old, new))
+                if len(column):
+                    last[path] = _plain(column[-1])
+        for event in sorted(changes, key=lambda event: event.time):
+            index.add(event)
+    return index
+
+
+def index_path(recording: str) -> str:
+    """
+    :param recording: Columnar recording
+    :return: Event index file saved next to it
+    """
+    return recording + ".events"
+
+
+def load_or_build(recording: str) -> EventIndex:
+    """
+    :param recording: Columnar recording
+    :return: Its saved index, built and saved first if missing or older than the recording
+    """
+    path = index_path(recording)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(recording):
+        return EventIndex.load(path)
+    with ColumnarReader(recording) as reader:
+        index = index_recording(reader)
+    index.save(path)
+    return index
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command line interface, --start and --end are seconds from the first sample, as for lcnc_columnar
+    :param argv: Arguments, sys.argv[1:] if None
+    :return: Exit code
+    """
+    parser = argparse.ArgumentParser(description="Index status transitions of columnar recordings")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("build", help="Build the event index of a recording").add_argument("file")
+    listing = commands.add_parser("list", help="List events, building the index if needed")
+    listing.add_argument("file")
+    listing.add_argument("--field", action="append",
+                         help="Field or modal group to list, repeatable, all if omitted")
+    listing.add_argument("--modal", action="store_true", help="List every modal group change")
+    listing.add_argument("--start", type=float, help="Seconds from the first sample")
+    listing.add_argument("--end", type=float, help="Seconds from the first sample")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        with ColumnarReader(args.file) as reader:
+            index = index_recording(reader)
+        index.save(index_path(args.file))
+        print(f"{len(index.events)} events in {len(index.fields)} fields written to {index_path(args.file)}")
+        return 0
+
+    with ColumnarReader(args.file) as reader:
+        origin = reader.start if reader.start is not None else 0.0
+    index = load_or_build(args.file)
+    start = None if args.start is None else origin + args.start
+    end = None if args.end is None else origin + args.end
+    fields = (args.field or []) + MODAL_GROUPS if args.modal else args.field
+    for event in index.between(start, end, fields):
+        print(f"{event.time - origin:12.3f}  {event.field:16} {event.old!r} -> {event.new!r}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
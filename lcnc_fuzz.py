@@ -0,0 +1,350 @@
+"""
+  lcnc_fuzz.py - Stateful command sequence fuzzer
+
+  Random sequences of state(), mode(), home(), mdi() and abort() are sent
+  to the controller while MachineModel predicts task_state, estop,
+  task_mode, the homed flags and an idle interpreter after each one. Every
+  step waits event driven until the stat matches the prediction, or times
+  out, and is checked against that one poll. A failing sequence is shrunk
+  by replaying it with chunks removed until no step can be dropped.
+
+  connect() returns a linuxcnc like module in its starting state, a fresh
+  lcnc_sim controller or reset() of the running LinuxCNC. Steps name the
+  state and mode constants, whose values and the model's are taken from
+  that module. Homed flags survive reset() on a real machine, so shrinking
+  is only exact against the simulator.
+
+  Not every transition of the model was checked against LinuxCNC, e.g.
+  what STATE_ESTOP_RESET does to a machine that is on. verified_only
+  skips the steps MachineModel.verified() rejects, for live runs.
+
+"""
+
+import random
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from lcnc_checkpoint import COMMAND_TIMEOUT, HOME_TIMEOUT
+from lcnc_ini import load_ini
+from lcnc_timing import now, wait_for
+from lcnc_trace import TRACE
+
+# Relative weight of each command in generated sequences
+COMMAND_WEIGHTS = {"state": 35, "mode": 25, "home": 10, "mdi": 20, "abort": 10}
+
+# MDI moves stay within this distance of machine zero, and inside the axis limits
+MDI_RANGE = 1.0
+
+# Replays allowed while shrinking a failing sequence
+MAX_SHRINK_RUNS = 500
+
+# Constant names generated as arguments of state() and mode()
+STATES = ("STATE_ESTOP", "STATE_ESTOP_RESET", "STATE_OFF", "STATE_ON")
+MODES = ("MODE_MANUAL", "MODE_AUTO", "MODE_MDI")
+
+
+class Step(NamedTuple):
+    """
+    One command, argument None for abort
+    The argument of state and mode is the constant's name, e.g. STATE_ON, looked up in the module when sent
+    """
+    command: str
+    argument: object
+
+    def __str__(self) -> str:
+        if self.argument is None:
+            return f"{self.command}()"
+        if self.command in ("state", "mode"):
+            return f"{self.command}({self.argument})"
+        return f"{self.command}({self.argument!r})"
+
+
+class Mismatch(NamedTuple):
+    """First field that did not become what the model predicted"""
+    index: int
+    step: Step
+    field: str
+    expected: object
+    actual: object
+
+
+class FuzzResult(NamedTuple):
+    """
+    Outcome of fuzz()
+    sequence is the shrunk failing sequence, empty if every step matched
+    """
+    seed: int
+    steps_run: int
+    elapsed: float
+    failure: Optional[Mismatch]
+    sequence: List[Step]
+    original_length: int
+
+
+class MachineModel:
+    """In memory model of the task state machine, updated with each accepted step"""
+
+    def __init__(self, module, task_state: int, task_mode: int, homed: bool):
+        """
+        :param module: linuxcnc module the steps are sent to, for its constants
+        :param task_state: Starting stat.task_state
+        :param task_mode: Starting stat.task_mode
+        :param homed: True if every joint starts homed
+        """
+        self.linuxcnc = module
+        self.task_state = task_state
+        self.task_mode = task_mode
+        self.homed = homed
+
+    @classmethod
+    def from_stat(cls, module, stat) -> "MachineModel":
+        """
+        :param module: linuxcnc module the steps are sent to
+        :param stat: linuxcnc.stat object, already polled
+        :return: Model in the machine's current state
+        """
+        return cls(module, stat.task_state, stat.task_mode, all(stat.homed[:stat.joints]))
+
+    def argument(self, step: Step) -> object:
+        """
+        :param step: Step to send
+        :return: Its argument as the module takes it, the constant's value for state and mode
+        """
+        return getattr(self.linuxcnc, step.argument) if step.command in ("state", "mode") else step.argument
+
+    def verified(self, step: Step) -> bool:
+        """
+        :param step: Step about to be sent in the current state
+        :return: False for a transition the model was not checked on against LinuxCNC
+        """
+        # The simulator turns a machine that is on off on STATE_ESTOP_RESET, LinuxCNC may leave it on
+        return not (step == Step("state", "STATE_ESTOP_RESET") and self.task_state == self.linuxcnc.STATE_ON)
+
+    def apply(self, step: Step) -> None:
+        """
+        Predict the effect of one step
+        :param step: Step sent to the controller
+        """
+        if step.argument is None:
+            getattr(self, step.command)()
+        else:
+            getattr(self, step.command)(self.argument(step))
+
+    def state(self, state: int) -> None:
+        """command.state, turning the machine off reports STATE_ESTOP_RESET"""
+        lcnc = self.linuxcnc
+        if state in (lcnc.STATE_ESTOP, lcnc.STATE_ESTOP_RESET):
+            self.task_state = state
+        elif state == lcnc.STATE_ON and self.task_state != lcnc.STATE_ESTOP:
+            self.task_state = lcnc.STATE_ON
+        elif state == lcnc.STATE_OFF and self.task_state != lcnc.STATE_ESTOP:
+            self.task_state = lcnc.STATE_ESTOP_RESET
+
+    def mode(self, mode: int) -> None:
+        """command.mode, every step ends with the interpreter idle so it is always accepted"""
+        self.task_mode = mode
+
+    def home(self, joint: int) -> None:
+        """command.home(-1), rejected unless the machine is on and in manual mode"""
+        if joint == -1 and self.task_state == self.linuxcnc.STATE_ON and self.task_mode == self.linuxcnc.MODE_MANUAL:
+            self.homed = True
+
+    def mdi(self, text: str) -> None:
+        """command.mdi only moves the machine, which the model does not follow"""
+
+    def abort(self) -> None:
+        """command.abort leaves state and mode alone"""
+
+    def expected(self) -> Dict[str, object]:
+        """
+        :return: Predicted value of each checked field
+        """
+        return {"task_state": self.task_state, "estop": int(self.task_state == self.linuxcnc.STATE_ESTOP),
+                "task_mode": self.task_mode, "homed": self.homed, "interp_state": self.linuxcnc.INTERP_IDLE}
+
+
+def observe(stat) -> Dict[str, object]:
+    """
+    :param stat: linuxcnc.stat object, already polled
+    :return: The fields MachineModel.expected predicts
+    """
+    return {"task_state": stat.task_state, "estop": stat.estop, "task_mode": stat.task_mode,
+            "homed": all(stat.homed[:stat.joints]), "interp_state": stat.interp_state}
+
+
+def mdi_commands(config) -> List[Tuple[str, float, float]]:
+    """
+    :param config: Output of lcnc_ini.load_ini
+    :return: (axis letter, low, high) machine coordinate range for the G53 G0 moves of each axis
+    """
+    ranges = []
+    for letter, axis in config.axes.items():
+        low = -MDI_RANGE if axis.min_limit is None else max(axis.min_limit, -MDI_RANGE)
+        high = MDI_RANGE if axis.max_limit is None else min(axis.max_limit, MDI_RANGE)
+        if low < high:
+            ranges.append((letter, low, high))
+    return ranges
+
+
+def generate(rng: random.Random, count: int, config) -> List[Step]:
+    """
+    Random command sequence, valid or not in whatever state the machine is in
+    :param rng: Source of randomness
+    :param count: Number of steps
+    :param config: Output of lcnc_ini.load_ini, for the MDI move ranges
+    :return: Steps
+    """
+    ranges = mdi_commands(config)
+    commands, weights = list(COMMAND_WEIGHTS), list(COMMAND_WEIGHTS.values())
+    steps = []
+    for command in rng.choices(commands, weights, k=count):
+        if command == "state":
+            argument = rng.choice(STATES)
+        elif command == "mode":
+            argument = rng.choice(MODES)
+        elif command == "home":
+            argument = -1
+        elif command == "mdi" and ranges:
+            letter, low, high = rng.choice(ranges)
+            argument = f"G53 G0 {letter}{rng.uniform(low, high):.3f}"
+        elif command == "mdi":
+            argument = "G4 P0.01"
+        else:
+            argument = None
+        steps.append(Step(command, argument))
+    return steps
+
+
+def run_step(com, stat, errors, model: MachineModel, index: int, step: Step,
+             timeout: float = COMMAND_TIMEOUT) -> Optional[Mismatch]:
+    """
+    Send one step and check the stat against the model
+    :param com: linuxcnc.command object
+    :param stat: linuxcnc.stat object
+    :param errors: linuxcnc.error_channel object, drained so rejections do not pile up
+    :param model: Model, updated with the step
+    :param index: Position of the step in its sequence
+    :param step: Step to send
+    :param timeout: Seconds to wait for the command and the predicted state, HOME_TIMEOUT for home
+    :return: First field that does not match, None if all do
+    """
+    TRACE.command(str(step))
+    if step.argument is None:
+        getattr(com, step.command)()
+    else:
+        getattr(com, step.command)(model.argument(step))
+    com.wait_complete(timeout)
+    model.apply(step)
+    expected = model.expected()
+    wait_for(stat, lambda s: observe(s) == expected, HOME_TIMEOUT if step.command == "home" else timeout)
+    while errors.poll():
+        pass
+    actual = observe(stat)
+    for field, value in expected.items():
+        if actual[field] != value:
+            return Mismatch(index, step, field, value, actual[field])
+    return None
+
+
+def run_sequence(connect: Callable[[], object], steps: List[Step], model: type = MachineModel,
+                 timeout: float = COMMAND_TIMEOUT, verified_only: bool = False) -> Tuple[int, Optional[Mismatch]]:
+    """
+    Run steps from the starting state until the first mismatch
+    :param connect: Returns a linuxcnc like module in its starting state
+    :param steps: Steps to run
+    :param model: MachineModel or a subclass
+    :param timeout: Seconds to wait for each step
+    :param verified_only: Skip the steps the model was not verified on, see MachineModel.verified
+    :return: Number of steps run and the mismatch that stopped them, None if all matched
+    """
+    module = connect()
+    com, stat, errors = module.command(), module.stat(), module.error_channel()
+    stat.poll()
+    state = model.from_stat(module, stat)
+    for index, step in enumerate(steps):
+        if verified_only and not state.verified(step):
+            TRACE.command(f"{step} skipped, not verified against LinuxCNC")
+            continue
+        mismatch = run_step(com, stat, errors, state, index, step, timeout)
+        if mismatch is not None:
+            return index + 1, mismatch
+    return len(steps), None
+
+
+def shrink(steps: List[Step], replay: Callable[[List[Step]], Optional[Mismatch]],
+           max_runs: int = MAX_SHRINK_RUNS) -> Tuple[List[Step], Mismatch]:
+    """
+    Drop chunks of a failing sequence, halving the chunk size, while it still fails
+    :param steps: Failing sequence, ending with the step that failed
+    :param replay: Runs a sequence from the starting state, returning its mismatch or None
+    :param max_runs: Replays allowed
+    :return: Shortest failing sequence found and its mismatch
+    """
+    mismatch = replay(steps)
+    if mismatch is None:
+        raise ValueError("Sequence does not fail when replayed")
+    steps = steps[:mismatch.index + 1]
+    runs = 1
+    chunk = max(1, len(steps) // 2)
+    while runs < max_runs:
+        removed = False
+        start = 0
+        while start < len(steps) and runs < max_runs:
+            candidate = steps[:start] + steps[start + chunk:]
+            result = replay(candidate) if candidate else None
+            runs += 1
+            if result is None:
+                start += chunk
+            else:
+                steps, mismatch, removed = candidate[:result.index + 1], result, True
+        if chunk == 1 and not removed:
+            break
+        chunk = max(1, chunk // 2)
+    return steps, mismatch
+
+
+def reset(module):
+    """
+    Put a running controller in estop and manual mode, the starting state connect() gives for live runs
+    :param module: linuxcnc module
+    :return: module
+    """
+    com = module.command()
+    com.abort()
+    com.wait_complete()
+    com.state(module.STATE_ESTOP)
+    com.wait_complete()
+    com.mode(module.MODE_MANUAL)
+    com.wait_complete()
+    return module
+
+
+def fuzz(connect: Callable[[], object], count: int = 1000, seed: Optional[int] = None,
+         model: type = MachineModel, timeout: float = COMMAND_TIMEOUT, shrink_failures: bool = True,
+         verified_only: bool = False) -> FuzzResult:
+    """
+    Run one random sequence and shrink it if a step does not match the model
+    :param connect: Returns a linuxcnc like module in its starting state, called again for every replay
+    :param count: Steps to generate
+    :param seed: Random seed, a random one if None, reported in the result to replay it
+    :param model: MachineModel or a subclass
+    :param timeout: Seconds to wait for each step
+    :param shrink_failures: False to report the failing sequence unshrunk
+    :param verified_only: Skip the steps the model was not verified on, for live runs
+    :return: FuzzResult
+    """
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    stat = connect().stat()
+    stat.poll()
+    steps = generate(random.Random(seed), count, load_ini(stat.ini_filename))
+
+    start = now()
+    steps_run, mismatch = run_sequence(connect, steps, model, timeout, verified_only)
+    elapsed = now() - start
+    if mismatch is None:
+        return FuzzResult(seed, steps_run, elapsed, None, [], count)
+    sequence = steps[:steps_run]
+    if shrink_failures:
+        sequence, mismatch = shrink(sequence, lambda candidate: run_sequence(connect, candidate, model, timeout,
+                                                                             verified_only)[1])
+    return FuzzResult(seed, steps_run, elapsed, mismatch, sequence, count)
@@ -0,0 +1,194 @@
+"""
+  lcnc_hal.py - HAL pin reads, batched writes and status cross-validation
+
+  All pins are read or written with a single halcmd call and compared against
+  one stat snapshot, instead of one halcmd launch per pin.
+
+"""
+
+from subprocess import run
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from lcnc_arrays import EPS
+
+PIN_TYPES = {"bit", "float", "s32", "u32", "s64", "u64", "port"}
+PIN_DIRS = {"IN", "OUT", "I/O"}
+
+
+def parse_value(pin_type: str, text: str):
+    """
+    Convert a value printed by halcmd
+    :param pin_type: HAL type, e.g. bit or float
+    :param text: Value column
+    :return: bool for bit pins, int for integer pins, float otherwise
+    """
+    if pin_type == "bit":
+        return text == "TRUE"
+    if pin_type in ("s32", "u32", "s64", "u64"):
+        return int(text, 0)
+    return float(text)
+
+
+def parse_show_pin(output: str) -> Dict[str, object]:
+    """
+    Parse the output of "halcmd -s show pin"
+    :param output: halcmd stdout, lines of owner, type, direction, value and name
+    :return: Dictionary of pin name to value
+    """
+    pins = {}
+    for line in output.splitlines():
+        words = line.split()
+        if len(words) < 5 or words[1] not in PIN_TYPES or words[2] not in PIN_DIRS:
+            continue
+        pins[words[4]] = parse_value(words[1], words[3])
+    return pins
+
+
+def read_pins(pattern: str = "") -> Dict[str, object]:
+    """
+    Read every pin matching a prefix with one halcmd call
+    :param pattern: Pin name prefix, all pins if empty
+    :return: Dictionary of pin name to value
+    """
+    command = ["halcmd", "-s", "show", "pin"]
+    if pattern:
+        command.append(pattern)
+    result = run(command, capture_output=True, encoding="utf8", check=True)
+    return parse_show_pin(result.stdout)
+
+
+def format_value(value) -> str:
+    """
+    Format a value for setp
+    :param value: bool, int or float
+    :return: Text halcmd accepts for the pin type
+    """
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return repr(value)
+
+
+def setp_script(values: Dict[str, object]) -> str:
+    """
+    Build a halcmd script setting many pins
+    :param values: Dictionary of pin name to value
+    :return: One setp line per pin
+    """
+    return "".join(f"setp {pin} {format_value(value)}\n" for pin, value in values.items())
+
+
+def write_pins(values: Dict[str, object]) -> None:
+    """
+    Set many input pins with one halcmd call, the commands are fed on stdin
+    :param values: Dictionary of pin name to value
+    """
+    run(["halcmd", "-f"], input=setp_script(values), encoding="utf8", check=True)
+
+
+class PinMap(NamedTuple):
+    """
+    Relation between a stat field and a HAL pin
+    Indexed fields use "{index}" in field and pin, e.g. ain[{index}] and motion.analog-in-{index:02d}
+    """
+    field: str
+    pin: str
+    to_stat: Callable[[object], object] = lambda value: value
+
+
+# Pins each stat field mirrors, converted to the value stat reports
+HAL_MAP = [
+    PinMap("estop", "iocontrol.0.user-enable-out", lambda value: int(not value)),
+    PinMap("enabled", "motion.motion-enabled", bool),
+    PinMap("flood", "iocontrol.0.coolant-flood", int),
+    PinMap("mist", "iocontrol.0.coolant-mist", int),
+    PinMap("lube", "iocontrol.0.lube", int),
+    PinMap("spindle[0][enabled]", "spindle.0.on", int),
+    PinMap("joint_actual_position[{index}]", "joint.{index}.pos-fb"),
+    PinMap("din[{index}]", "motion.digital-in-{index:02d}", int),
+    PinMap("dout[{index}]", "motion.digital-out-{index:02d}", int),
+    PinMap("ain[{index}]", "motion.analog-in-{index:02d}"),
+    PinMap("aout[{index}]", "motion.analog-out-{index:02d}"),
+]
+
+# Highest index tried for indexed pins
+MAX_INDEX = 64
+
+
+class Mismatch(NamedTuple):
+    """A stat field that disagrees with its HAL pin"""
+    field: str
+    pin: str
+    stat_value: object
+    pin_value: object
+
+
+def field_value(stat, path: str):
+    """
+    Read a field path such as "spindle[0][enabled]" or "ain[3]" from a stat object
+    :param stat: linuxcnc.stat object, or a snapshot dict
+    :param path: Attribute followed by optional [index] or [key] parts
+    :return: Field value
+    """
+    name, _, rest = path.partition("[")
+    value = stat[name] if isinstance(stat, dict) else getattr(stat, name)
+    for part in rest.rstrip("]").split("][") if rest else []:
+        value = value[int(part)] if part.isdigit() else value[part]
+    return value
+
+
+def expand_map(pins: Dict[str, object], mapping: Optional[List[PinMap]] = None) -> List[PinMap]:
+    """
+    Expand indexed entries for every index whose pin exists
+    :param pins: Output of read_pins
+    :param mapping: Entries to expand, HAL_MAP if None
+    :return: Entries with concrete fields and pins
+    """
+    expanded = []
+    for entry in HAL_MAP if mapping is None else mapping:
+        if "{index" not in entry.pin:
+            if entry.pin in pins:
+                expanded.append(entry)
+            continue
+        for index in range(MAX_INDEX):
+            pin = entry.pin.format(index=index)
+            if pin not in pins:
+                break
+            expanded.append(PinMap(entry.field.format(index=index), pin, entry.to_stat))
+    return expanded
+
+
+def cross_validate(stat, pins: Dict[str, object], mapping: Optional[List[PinMap]] = None,
+                   eps: float = EPS) -> List[Mismatch]:
+    """
+    Compare one stat snapshot against one batch of pin values
+    Pins missing from the batch are skipped
+    :param stat: linuxcnc.stat object, already polled
+    :param pins: Output of read_pins
+    :param mapping: Entries to check, HAL_MAP if None
+    :param eps: Tolerance for float values
+    :return: Every field that disagrees with its pin
+    """
+    mismatches = []
+    for entry in expand_map(pins, mapping):
+        expected = entry.to_stat(pins[entry.pin])
+        actual = field_value(stat, entry.field)
+        if isinstance(expected, float):
+            same = abs(actual - expected) <= eps
+        else:
+            same = actual == expected
+        if not same:
+            mismatches.append(Mismatch(entry.field, entry.pin, actual, expected))
+    return mismatches
+
+
+def validate_status(stat, mapping: Optional[List[PinMap]] = None, eps: float = EPS) -> List[Mismatch]:
+    """
+    Poll stat, read all pins in one call and cross validate them
+    :param stat: linuxcnc.stat object
+    :param mapping: Entries to check, HAL_MAP if None
+    :param eps: Tolerance for float values
+    :return: Every field that disagrees with its pin
+    """
+    pins = read_pins()
+    stat.poll()
+    return cross_validate(stat, pins, mapping, eps)
@@ -0,0 +1,316 @@
+"""
+  lcnc_ini.py - Typed, cached model of the LinuxCNC ini file
+
+  The ini and the HAL files it names are parsed once per path and turned
+  into typed sections. expected_status() derives the stat values the
+  configuration implies, so every config reflection check runs against a
+  single poll.
+
+"""
+
+import functools
+import math
+import os
+import re
+from typing import Dict, List, NamedTuple, Optional
+
+from lcnc_arrays import EPS
+from lcnc_hal import field_value
+
+# Machine units per mm and per degree, as stat.linear_units and stat.angular_units report them
+LINEAR_UNITS = {"mm": 1.0, "metric": 1.0, "cm": 0.1, "inch": 1 / 25.4, "imperial": 1 / 25.4, "in": 1 / 25.4}
+ANGULAR_UNITS = {"deg": 1.0, "degree": 1.0, "rad": math.pi / 180, "radian": math.pi / 180,
+                 "grad": 400 / 360, "gon": 400 / 360}
+
+AXIS_LETTERS = "XYZABCUVW"
+
+# stat.joint jointType values
+JOINT_TYPES = {"LINEAR": 1, "ANGULAR": 2}
+
+# [SECTION]KEY substitutions in HAL files
+HAL_REFERENCE = re.compile(r"\[(\w+)\](\w+)")
+
+
+def parse_ini(text: str) -> Dict[str, Dict[str, List[str]]]:
+    """
+    Parse ini text the way LinuxCNC reads it: keys may repeat, # and ; start comment lines
+    :param text: ini file contents
+    :return: Dictionary of section to key to every value given, in order
+    """
+    sections: Dict[str, Dict[str, List[str]]] = {}
+    section = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line[0] in "#;":
+            continue
+        if line.startswith("[") and line.endswith("]"):
+            section = sections.setdefault(line[1:-1].strip(), {})
+        elif section is not None and "=" in line:
+            key, value = line.split("=", 1)
+            section.setdefault(key.strip(), []).append(value.strip())
+    return sections
+
+
+def _float(value: Optional[str]) -> Optional[float]:
+    return None if value is None else float(value)
+
+
+class TrajConfig(NamedTuple):
+    """[TRAJ]"""
+    coordinates: str
+    spindles: int
+    linear_units: str
+    angular_units: str
+    max_velocity: Optional[float]
+    default_acceleration: Optional[float]
+    max_acceleration: Optional[float]
+
+
+class KinsConfig(NamedTuple):
+    """[KINS]"""
+    kinematics: str
+    joints: int
+
+
+class JointConfig(NamedTuple):
+    """[JOINT_n]"""
+    index: int
+    type: str
+    max_velocity: Optional[float]
+    max_acceleration: Optional[float]
+    min_limit: Optional[float]
+    max_limit: Optional[float]
+    backlash: Optional[float]
+    ferror: Optional[float]
+    min_ferror: Optional[float]
+    home_sequence: Optional[int]
+
+
+class AxisConfig(NamedTuple):
+    """[AXIS_L]"""
+    letter: str
+    max_velocity: Optional[float]
+    max_acceleration: Optional[float]
+    min_limit: Optional[float]
+    max_limit: Optional[float]
+
+
+class DisplayConfig(NamedTuple):
+    """[DISPLAY]"""
+    display: Optional[str]
+    cycle_time: Optional[float]
+
+
+class TaskConfig(NamedTuple):
+    """[TASK]"""
+    task: Optional[str]
+    cycle_time: Optional[float]
+
+
+class IniConfig(NamedTuple):
+    """Typed view of an ini file and the HAL files it loads"""
+    path: str
+    sections: Dict[str, Dict[str, List[str]]]
+    traj: TrajConfig
+    kins: KinsConfig
+    joints: List[JointConfig]
+    axes: Dict[str, AxisConfig]
+    display: DisplayConfig
+    task: TaskConfig
+    servo_period: Optional[float]
+    tool_table: Optional[str]
+    hal_files: List[str]
+    hal_references: Dict[str, Optional[str]]
+
+    def find(self, section: str, key: str) -> Optional[str]:
+        """
+        Same as linuxcnc.ini.find, the first value of a key
+        :return: Value, None if the section or key is missing
+        """
+        values = self.sections.get(section, {}).get(key)
+        return values[0] if values else None
+
+
+def machine_axes(config: IniConfig) -> str:
+    """
+    :param config: Output of load_ini
+    :return: Axis letters of [TRAJ]COORDINATES, once each in order, e.g. XYZ
+    """
+    return "".join(dict.fromkeys(config.traj.coordinates.upper()))
+
+
+def _hal_references(hal_files: List[str], sections: Dict[str, Dict[str, List[str]]]) -> Dict[str, Optional[str]]:
+    references = {}
+    for hal_file in hal_files:
+        if not os.path.exists(hal_file):
+            continue
+        with open(hal_file, encoding="utf8") as hal:
+            for section, key in HAL_REFERENCE.findall(hal.read()):
+                values = sections.get(section, {}).get(key)
+                references[f"[{section}]{key}"] = values[0] if values else None
+    return references
+
+
+@functools.lru_cache(maxsize=None)
+def load_ini(path: str) -> IniConfig:
+    """
+    Parse an ini file and its HAL files, once per path
+    :param path: ini file, stat.ini_filename for the running configuration
+    :return: Typed configuration
+    """
+    with open(path, encoding="utf8") as ini:
+        sections = parse_ini(ini.read())
+
+    def find(section: str, key: str, default: Optional[str] = None) -> Optional[str]:
+        values = sections.get(section, {}).get(key)
+        return values[0] if values else default
+
+    traj = TrajConfig(
+        coordinates=find("TRAJ", "COORDINATES", "").replace(" ", ""),
+        spindles=int(find("TRAJ", "SPINDLES", "1")),
+        linear_units=find("TRAJ", "LINEAR_UNITS", "mm"),
+        angular_units=find("TRAJ", "ANGULAR_UNITS", "degree"),
+        max_velocity=_float(find("TRAJ", "MAX_LINEAR_VELOCITY", find("TRAJ", "MAX_VELOCITY"))),
+        default_acceleration=_float(find("TRAJ", "DEFAULT_LINEAR_ACCELERATION",
+                                         find("TRAJ", "DEFAULT_ACCELERATION"))),
+        max_acceleration=_float(find("TRAJ", "MAX_LINEAR_ACCELERATION", find("TRAJ", "MAX_ACCELERATION"))))
+    kins = KinsConfig(kinematics=find("KINS", "KINEMATICS", ""), joints=int(find("KINS", "JOINTS", "0")))
+    joints = []
+    for index in range(kins.joints):
+        section = f"JOINT_{index}"
+        home_sequence = find(section, "HOME_SEQUENCE")
+        joints.append(JointConfig(
+            index=index,
+            type=find(section, "TYPE", "LINEAR"),
+            max_velocity=_float(find(section, "MAX_VELOCITY")),
+            max_acceleration=_float(find(section, "MAX_ACCELERATION")),
+            min_limit=_float(find(section, "MIN_LIMIT")),
+            max_limit=_float(find(section, "MAX_LIMIT")),
+            backlash=_float(find(section, "BACKLASH")),
+            ferror=_float(find(section, "FERROR")),
+            min_ferror=_float(find(section, "MIN_FERROR")),
+            home_sequence=None if home_sequence is None else int(home_sequence)))
+    axes = {}
+    for letter in AXIS_LETTERS:
+        section = f"AXIS_{letter}"
+        if section in sections or letter in traj.coordinates:
+            axes[letter] = AxisConfig(letter,
+                                      _float(find(section, "MAX_VELOCITY")),
+                                      _float(find(section, "MAX_ACCELERATION")),
+                                      _float(find(section, "MIN_LIMIT")),
+                                      _float(find(section, "MAX_LIMIT")))
+    servo_period = find("EMCMOT", "SERVO_PERIOD")
+
+    directory = os.path.dirname(os.path.abspath(path))
+    hal_files = [os.path.join(directory, name)
+                 for key in ("HALFILE", "POSTGUI_HALFILE")
+                 for name in sections.get("HAL", {}).get(key, [])]
+    tool_table = find("EMCIO", "TOOL_TABLE")
+
+    return IniConfig(
+        path=path,
+        sections=sections,
+        traj=traj,
+        kins=kins,
+        joints=joints,
+        axes=axes,
+        display=DisplayConfig(find("DISPLAY", "DISPLAY"), _float(find("DISPLAY", "CYCLE_TIME"))),
+        task=TaskConfig(find("TASK", "TASK"), _float(find("TASK", "CYCLE_TIME"))),
+        servo_period=None if servo_period is None else float(servo_period) / 1e9,
+        tool_table=None if tool_table is None else os.path.join(directory, tool_table),
+        hal_files=hal_files,
+        hal_references=_hal_references(hal_files, sections))
+
+
+class Expectation(NamedTuple):
+    """A stat field and the value the ini implies for it"""
+    field: str
+    source: str
+    value: object
+
+
+class IniMismatch(NamedTuple):
+    """A stat field that does not reflect the ini"""
+    field: str
+    source: str
+    stat_value: object
+    ini_value: object
+
+
+def expected_status(config: IniConfig) -> List[Expectation]:
+    """
+    Stat values implied by the configuration, entries the ini leaves unset are skipped
+    :param config: Output of load_ini
+    :return: One Expectation per field path, e.g. joint[0][max_position_limit]
+    """
+    traj = config.traj
+    expected = [
+        Expectation("linear_units", "[TRAJ]LINEAR_UNITS", LINEAR_UNITS[traj.linear_units.lower()]),
+        Expectation("angular_units", "[TRAJ]ANGULAR_UNITS", ANGULAR_UNITS[traj.angular_units.lower()]),
+        Expectation("axis_mask", "[TRAJ]COORDINATES",
+                    sum(1 << AXIS_LETTERS.index(letter) for letter in set(traj.coordinates.upper()))),
+        Expectation("joints", "[KINS]JOINTS", config.kins.joints),
+        Expectation("spindles", "[TRAJ]SPINDLES", traj.spindles),
+    ]
+    if config.servo_period is not None:
+        expected.append(Expectation("cycle_time", "[EMCMOT]SERVO_PERIOD", config.servo_period))
+    if traj.max_velocity is not None:
+        expected.append(Expectation("max_velocity", "[TRAJ]MAX_LINEAR_VELOCITY", traj.max_velocity))
+    if traj.default_acceleration is not None:
+        expected.append(Expectation("acceleration", "[TRAJ]DEFAULT_LINEAR_ACCELERATION", traj.default_acceleration))
+    if traj.max_acceleration is not None:
+        expected.append(Expectation("max_acceleration", "[TRAJ]MAX_LINEAR_ACCELERATION", traj.max_acceleration))
+
+    for joint in config.joints:
+        section = f"[JOINT_{joint.index}]"
+        expected.append(Expectation(f"joint[{joint.index}][jointType]", section + "TYPE",
+                                    JOINT_TYPES[joint.type.upper()]))
+        for key, field, value in (("MIN_LIMIT", "min_position_limit", joint.min_limit),
+                                  ("MAX_LIMIT", "max_position_limit", joint.max_limit),
+                                  ("BACKLASH", "backlash", joint.backlash),
+                                  ("FERROR", "max_ferror", joint.ferror),
+                                  ("MIN_FERROR", "min_ferror", joint.min_ferror)):
+            if value is not None:
+                expected.append(Expectation(f"joint[{joint.index}][{field}]", section + key, value))
+
+    for letter, axis in config.axes.items():
+        index = AXIS_LETTERS.index(letter)
+        for key, field, value in (("MIN_LIMIT", "min_position_limit", axis.min_limit),
+                                  ("MAX_LIMIT", "max_position_limit", axis.max_limit)):
+            if value is not None:
+                expected.append(Expectation(f"axis[{index}][{field}]", f"[AXIS_{letter}]{key}", value))
+    return expected
+
+
+def check_status(stat, expected: List[Expectation], eps: float = EPS) -> List[IniMismatch]:
+    """
+    Compare one polled stat, or snapshot dict, against the expectations
+    :param stat: linuxcnc.stat object, already polled
+    :param expected: Output of expected_status
+    :param eps: Tolerance for float values
+    :return: Every field that does not reflect the ini
+    """
+    mismatches = []
+    for expectation in expected:
+        actual = field_value(stat, expectation.field)
+        if isinstance(expectation.value, float):
+            same = abs(actual - expectation.value) <= eps
+        else:
+            same = actual == expectation.value
+        if not same:
+            mismatches.append(IniMismatch(expectation.field, expectation.source, actual, expectation.value))
+    return mismatches
+
+
+def validate_ini(stat, config: Optional[IniConfig] = None, eps: float = EPS) -> List[IniMismatch]:
+    """
+    Poll once and check every config reflection
+    :param stat: linuxcnc.stat object
+    :param config: Configuration, load_ini(stat.ini_filename) if None
+    :param eps: Tolerance for float values
+    :return: Every field that does not reflect the ini
+    """
+    stat.poll()
+    if config is None:
+        config = load_ini(stat.ini_filename)
+    return check_status(stat, expected_status(config), eps)
@@ -0,0 +1,131 @@
+"""
+  lcnc_io.py - Digital and analog input sweeps
+
+  Each pattern sets every motion.digital-in and motion.analog-in pin in one
+  batched HAL write, waits once for status to follow and checks all of
+  din/ain in one vectorized comparison.
+
+"""
+
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from lcnc_arrays import EPS
+from lcnc_hal import read_pins, write_pins
+from lcnc_timing import wait_for
+
+DIN_PIN = "motion.digital-in-{index:02d}"
+AIN_PIN = "motion.analog-in-{index:02d}"
+
+# Analog pattern values are drawn from this range
+AIN_RANGE = (-10.0, 10.0)
+
+
+class IoPattern(NamedTuple):
+    """Values for the first len(din) digital and len(ain) analog inputs"""
+    din: np.ndarray
+    ain: np.ndarray
+
+
+class SweepResult(NamedTuple):
+    """
+    Outcome of one pattern
+    din and ain are the values status showed on the poll the pattern was checked on
+    """
+    pattern: IoPattern
+    latency: Optional[float]
+    din_errors: np.ndarray
+    ain_errors: np.ndarray
+    din: np.ndarray
+    ain: np.ndarray
+
+
+def random_patterns(count: int, din_pins: int, ain_pins: int, seed: Optional[int] = None,
+                    decimals: int = 4) -> List[IoPattern]:
+    """
+    Generate random input patterns
+    The first two patterns are all on/all high and all off/zero
+    :param count: Number of patterns
+    :param din_pins: Number of digital inputs
+    :param ain_pins: Number of analog inputs
+    :param seed: Random seed, for repeatable sweeps
+    :param decimals: Rounding of analog values
+    :return: List of IoPattern
+    """
+    rng = np.random.default_rng(seed)
+    patterns = [IoPattern(np.ones(din_pins, dtype=np.int8), np.full(ain_pins, AIN_RANGE[1])),
+                IoPattern(np.zeros(din_pins, dtype=np.int8), np.zeros(ain_pins))]
+    for _ in range(count - 2):
+        patterns.append(IoPattern(rng.integers(0, 2, din_pins, dtype=np.int8),
+                                  np.round(rng.uniform(*AIN_RANGE, ain_pins), decimals)))
+    return patterns[:count]
+
+
+def pattern_pins(pattern: IoPattern) -> Dict[str, object]:
+    """
+    :param pattern: IoPattern to apply
+    :return: Dictionary of pin name to value for write_pins
+    """
+    values: Dict[str, object] = {DIN_PIN.format(index=i): bool(value) for i, value in enumerate(pattern.din)}
+    values.update({AIN_PIN.format(index=i): float(value) for i, value in enumerate(pattern.ain)})
+    return values
+
+
+def observed_inputs(stat, pattern: IoPattern) -> IoPattern:
+    """
+    :param stat: linuxcnc.stat object, already polled
+    :param pattern: Pattern giving the number of inputs
+    :return: The first len(pattern.din) din and len(pattern.ain) ain of status
+    """
+    return IoPattern(np.asarray(stat.din[:len(pattern.din)], dtype=np.int8),
+                     np.asarray(stat.ain[:len(pattern.ain)], dtype=np.float64))
+
+
+def pattern_errors(stat, pattern: IoPattern, eps: float = EPS):
+    """
+    Compare status against a pattern
+    :param stat: linuxcnc.stat object, already polled
+    :param pattern: Expected values
+    :param eps: Tolerance for analog values
+    :return: (indexes of wrong din, indexes of wrong ain)
+    """
+    din, ain = observed_inputs(stat, pattern)
+    return (np.flatnonzero(din != pattern.din),
+            np.flatnonzero(~np.isclose(ain, pattern.ain, rtol=0, atol=eps)))
+
+
+def io_sweep(stat, patterns: List[IoPattern], timeout: float = 1.0, eps: float = EPS) -> List[SweepResult]:
+    """
+    Apply each pattern and wait for status to reflect it
+    :param stat: linuxcnc.stat object
+    :param patterns: Patterns from random_patterns
+    :param timeout: Seconds to wait for each pattern
+    :param eps: Tolerance for analog values
+    :return: One SweepResult per pattern, errors are empty when status matched
+    """
+    results = []
+    for pattern in patterns:
+        write_pins(pattern_pins(pattern))
+        latency = wait_for(stat, lambda s, p=pattern: not any(len(e) for e in pattern_errors(s, p, eps)), timeout)
+        din_errors, ain_errors = pattern_errors(stat, pattern, eps)
+        results.append(SweepResult(pattern, latency, din_errors, ain_errors, *observed_inputs(stat, pattern)))
+    return results
+
+
+def input_pin_counts() -> Dict[str, int]:
+    """
+    :return: Number of digital and analog motion input pins in HAL, keys "din" and "ain"
+    """
+    pins = read_pins("motion.")
+    return {"din": sum(name.startswith("motion.digital-in-") for name in pins),
+            "ain": sum(name.startswith("motion.analog-in-") for name in pins)}
+
+
+def reset_inputs(din_pins: int, ain_pins: int) -> None:
+    """
+    Set every digital and analog input back to zero with one HAL write
+    :param din_pins: Number of digital inputs
+    :param ain_pins: Number of analog inputs
+    """
+    write_pins(pattern_pins(IoPattern(np.zeros(din_pins, dtype=np.int8), np.zeros(ain_pins))))
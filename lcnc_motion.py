@@ -0,0 +1,325 @@
+"""
+  lcnc_motion.py - Generated motion programs and trajectory recording
+
+  Instead of one MDI move per wait, a whole program of moves is run in
+  AUTO mode while a background thread samples the trajectory. Waypoints
+  and velocity/acceleration limits are checked against the recording afterwards.
+
+  linuxcnc is imported where programs are run and recorded, so programs
+  and recordings can be built and analysed without a running controller.
+
+"""
+
+import os
+import tempfile
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from lcnc_arrays import EPS
+from lcnc_ini import load_ini
+from lcnc_timing import PeriodicSampler, now, sleep
+
+AXES = "XYZABCUVW"
+
+# Seconds the program dwells on each waypoint so the recorder sees it
+WAYPOINT_DWELL = 0.01
+
+# Resampling period for profiles, stat only updates once per task cycle
+PROFILE_PERIOD = 0.01
+
+# Allowed overshoot of an ini limit before it counts as a violation
+LIMIT_TOLERANCE = 1.05
+
+# Axes whose combined motion [TRAJ]MAX_LINEAR_VELOCITY and MAX_LINEAR_ACCELERATION cap
+LINEAR_AXES = "XYZUVW"
+
+# Key of the [TRAJ] caps in axis_limits, and the axis of violations of the combined linear motion
+TRAJ_LIMITS = "TRAJ"
+
+
+def random_waypoints(count: int, axes: str = "XYZ", low=0.0, high=1.0,
+                     seed: Optional[int] = None, decimals: int = 3) -> np.ndarray:
+    """
+    Generate random target positions
+    :param count: Number of waypoints
+    :param axes: Axis letters, one column per letter
+    :param low: Lower bound, scalar or one value per axis
+    :param high: Upper bound, scalar or one value per axis
+    :param seed: Random seed, for repeatable programs
+    :param decimals: Rounding applied so the G-code text is exact
+    :return: Array of shape (count, len(axes))
+    """
+    rng = np.random.default_rng(seed)
+    points = rng.uniform(low, high, size=(count, len(axes)))
+    return np.round(points, decimals)
+
+
+def waypoint_program(waypoints: np.ndarray, axes: str = "XYZ", dwell: float = WAYPOINT_DWELL) -> str:
+    """
+    Build a G-code program visiting each waypoint in exact stop mode
+    :param waypoints: Array of shape (count, len(axes))
+    :param axes: Axis letters matching the waypoint columns
+    :param dwell: Seconds to dwell at each waypoint, 0 for none
+    :return: Program text
+    """
+    lines = ["G90 G61"]
+    for point in waypoints:
+        lines.append("G0 " + " ".join(f"{axis}{value:.4f}" for axis, value in zip(axes, point)))
+        if dwell > 0:
+            lines.append(f"G4 P{dwell}")
+    lines.append("M2")
+    return "\n".join(lines) + "\n"
+
+
+def write_program(text: str, directory: Optional[str] = None) -> str:
+    """
+    Write a program to a temporary .ngc file
+    :param text: Program text
+    :param directory: Directory for the file, the system temp dir if None
+    :return: Path of the written file
+    """
+    handle, path = tempfile.mkstemp(suffix=".ngc", dir=directory)
+    with os.fdopen(handle, "w") as program:
+        program.write(text)
+    return path
+
+
+def run_program(com, stat, path: str, timeout: float = 60.0, interval: float = 0.01) -> bool:
+    """
+    Open and run a program in AUTO mode, blocking until the interpreter is idle
+    :param com: linuxcnc.command object
+    :param stat: linuxcnc.stat object
+    :param path: Program file
+    :param timeout: Seconds to wait for the program to finish
+    :param interval: Seconds between polls
+    :return: True if the program finished within the timeout
+    """
+    import linuxcnc  # pylint: disable=import-outside-toplevel
+    com.mode(linuxcnc.MODE_AUTO)
+    com.wait_complete()
+    com.program_open(path)
+    com.wait_complete()
+    com.auto(linuxcnc.AUTO_RUN, 0)
+    com.wait_complete()
+
+    deadline = now() + timeout
+    while now() < deadline:
+        stat.poll()
+        if stat.interp_state == linuxcnc.INTERP_IDLE:
+            return True
+        sleep(interval)
+    return False
+
+
+class TrajectoryRecorder:
+    """
+    Samples actual_position and current_vel from a PeriodicSampler into a growing buffer
+    Use as a context manager around the motion to record
+    """
+
+    def __init__(self, stat=None, interval: float = 0.0, capacity: int = 65536):
+        """
+        :param stat: linuxcnc.stat object owned by the recorder, a new one is created if None
+        :param interval: Seconds to sleep between samples, 0 to poll as fast as possible
+        :param capacity: Initial number of samples to allocate
+        """
+        if stat is None:
+            import linuxcnc  # pylint: disable=import-outside-toplevel
+            stat = linuxcnc.stat()
+        self.stat = stat
+        self.interval = interval
+        self._times = np.empty(capacity)
+        self._positions = np.empty((capacity, len(AXES)))
+        self._velocities = np.empty(capacity)
+        self._count = 0
+        self._sampler = PeriodicSampler(self._sample, interval)
+
+    def _grow(self):
+        self._times = np.resize(self._times, len(self._times) * 2)
+        self._positions = np.resize(self._positions, (len(self._positions) * 2, len(AXES)))
+        self._velocities = np.resize(self._velocities, len(self._velocities) * 2)
+
+    def _sample(self):
+        self.stat.poll()
+        if self._count == len(self._times):
+            self._grow()
+        self._times[self._count] = now()
+        self._positions[self._count] = self.stat.actual_position
+        self._velocities[self._count] = self.stat.current_vel
+        self._count += 1
+
+    def start(self):
+        """Start sampling"""
+        self._sampler.start()
+
+    def stop(self):
+        """Stop sampling and wait for the thread"""
+        self._sampler.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def times(self) -> np.ndarray:
+        """Monotonic timestamp of each sample"""
+        return self._times[:self._count]
+
+    @property
+    def positions(self) -> np.ndarray:
+        """actual_position of each sample, shape (samples, 9)"""
+        return self._positions[:self._count]
+
+    @property
+    def velocities(self) -> np.ndarray:
+        """current_vel of each sample"""
+        return self._velocities[:self._count]
+
+
+def verify_waypoints(positions: np.ndarray, waypoints: Sequence, eps: float = EPS) -> List[int]:
+    """
+    Check that the recording passes through every waypoint, in order
+    :param positions: Recorded positions, one column per waypoint axis
+    :param waypoints: Expected positions, shape (count, axes)
+    :param eps: Absolute tolerance on each axis
+    :return: Indexes of the waypoints that were never reached
+    """
+    positions = np.asarray(positions)
+    missed = []
+    start = 0
+    for idx, point in enumerate(np.asarray(waypoints)):
+        hits = np.flatnonzero(np.all(np.abs(positions[start:] - point) <= eps, axis=1))
+        if len(hits) == 0:
+            missed.append(idx)
+        else:
+            start += hits[0]
+    return missed
+
+
+class MotionProfile(NamedTuple):
+    """Derivatives of a resampled trajectory, one row per sample and one column per axis"""
+    times: np.ndarray
+    positions: np.ndarray
+    velocity: np.ndarray
+    acceleration: np.ndarray
+    jerk: np.ndarray
+
+
+class Violation(NamedTuple):
+    """A sample where the trajectory went over an ini limit, axis is TRAJ_LIMITS for the combined linear motion"""
+    time: float
+    axis: str
+    quantity: str
+    value: float
+    limit: float
+
+
+def resample(times: np.ndarray, values: np.ndarray, period: float = PROFILE_PERIOD) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Interpolate samples onto a uniform time grid
+    Polling is not synchronised with the servo thread, so raw differences are noisy
+    :param times: Sample timestamps
+    :param values: Samples, shape (samples,) or (samples, columns)
+    :param period: Grid spacing in seconds
+    :return: (grid times, resampled values)
+    """
+    grid = np.arange(times[0], times[-1], period)
+    if values.ndim == 1:
+        return grid, np.interp(grid, times, values)
+    return grid, np.column_stack([np.interp(grid, times, column) for column in values.T])
+
+
+def motion_profile(times: np.ndarray, positions: np.ndarray, period: float = PROFILE_PERIOD) -> MotionProfile:
+    """
+    Compute velocity, acceleration and jerk by differencing a resampled trajectory
+    :param times: Sample timestamps
+    :param positions: Positions, shape (samples, axes)
+    :param period: Resampling period in seconds
+    :return: MotionProfile, the derivatives are shorter by 1, 2 and 3 rows
+    """
+    grid, resampled = resample(times, positions, period)
+    velocity = np.diff(resampled, axis=0) / period
+    acceleration = np.diff(velocity, axis=0) / period
+    jerk = np.diff(acceleration, axis=0) / period
+    return MotionProfile(grid, resampled, velocity, acceleration, jerk)
+
+
+def _lowest(*limits: Optional[float]) -> Optional[float]:
+    known = [limit for limit in limits if limit is not None]
+    return min(known) if known else None
+
+
+def axis_limits(ini_filename: str, axes: str = "XYZ") -> Dict[str, Tuple[Optional[float], Optional[float]]]:
+    """
+    Read [AXIS_n]MAX_VELOCITY and MAX_ACCELERATION, for linear axes capped by [TRAJ]MAX_LINEAR_VELOCITY and
+    MAX_LINEAR_ACCELERATION, which also limit the combined motion
+    :param ini_filename: Path of the running ini, stat.ini_filename
+    :param axes: Axis letters to read
+    :return: Dictionary of axis letter, and TRAJ_LIMITS for the [TRAJ] caps, to (max velocity, max acceleration),
+             None where unset
+    """
+    config = load_ini(ini_filename)
+    traj = (config.traj.max_velocity, config.traj.max_acceleration)
+    limits = {TRAJ_LIMITS: traj}
+    for axis in axes:
+        entry = config.axes.get(axis)
+        own = (None, None) if entry is None else (entry.max_velocity, entry.max_acceleration)
+        limits[axis] = (_lowest(own[0], traj[0]), _lowest(own[1], traj[1])) if axis in LINEAR_AXES else own
+    return limits
+
+
+def _exceeding(profile: MotionProfile, axis: str, velocity: np.ndarray, acceleration: np.ndarray,
+               limits: Tuple[Optional[float], Optional[float]], tolerance: float) -> List[Violation]:
+    violations = []
+    for quantity, values, limit in (("velocity", velocity, limits[0]), ("acceleration", acceleration, limits[1])):
+        if limit is None:
+            continue
+        for idx in np.flatnonzero(np.abs(values) > limit * tolerance):
+            violations.append(Violation(float(profile.times[idx + 1]), axis, quantity, float(values[idx]), limit))
+    return violations
+
+
+def find_violations(profile: MotionProfile, limits: Dict[str, Tuple[Optional[float], Optional[float]]],
+                    axes: str = "XYZ", tolerance: float = LIMIT_TOLERANCE) -> List[Violation]:
+    """
+    Flag every sample where an axis, or the combined motion of the linear axes, exceeded its velocity or
+    acceleration limit
+    :param profile: MotionProfile with one column per letter in axes
+    :param limits: Output of axis_limits
+    :param axes: Axis letters matching the profile columns
+    :param tolerance: Factor applied to each limit before comparing
+    :return: Violations in axis then time order, the combined motion last
+    """
+    violations = []
+    for column, axis in enumerate(axes):
+        violations += _exceeding(profile, axis, profile.velocity[:, column], profile.acceleration[:, column],
+                                 limits.get(axis, (None, None)), tolerance)
+    linear = [column for column, axis in enumerate(axes) if axis in LINEAR_AXES]
+    if linear:
+        violations += _exceeding(profile, TRAJ_LIMITS, np.linalg.norm(profile.velocity[:, linear], axis=1),
+                                 np.linalg.norm(profile.acceleration[:, linear], axis=1),
+                                 limits.get(TRAJ_LIMITS, (None, None)), tolerance)
+    return violations
+
+
+def benchmark_sampler(duration: float = 1.0, stat=None) -> Dict[str, float]:
+    """
+    Measure how fast TrajectoryRecorder samples
+    :param duration: Seconds to record
+    :param stat: linuxcnc.stat object, a new one is created if None
+    :return: Dictionary with samples, rate in Hz, mean, p99 and max period in seconds
+    """
+    with TrajectoryRecorder(stat) as recorder:
+        sleep(duration)
+    periods = np.diff(recorder.times)
+    return {
+        "samples": float(len(recorder.times)),
+        "rate": len(periods) / float(recorder.times[-1] - recorder.times[0]),
+        "mean_period": float(periods.mean()),
+        "p99_period": float(np.percentile(periods, 99)),
+        "max_period": float(periods.max()),
+    }
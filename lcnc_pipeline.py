@@ -0,0 +1,182 @@
+"""
+  lcnc_pipeline.py - Pipelined command submission tracked by serial number
+
+  submit() queues a command and returns a Future at once. pump() polls
+  the stat once, resolves the Future of a command once
+  stat.echo_serial_number is its serial and stat.state is RCS_DONE or
+  RCS_ERROR, and sends the next queued command when fewer than depth are
+  unresolved. Each CommandResult carries that command's own status and
+  round trip, so batches are limited by the controller instead of by
+  fixed sleeps.
+
+  stat only shows the state of the command echoed last. With the default
+  depth 1 the next command is sent once the previous one completed, so
+  every command is seen with its own state. With a deeper pipeline a
+  command can be passed by a later echo before it was seen complete, it
+  is then resolved as superseded with status and latency None, its
+  errors are on the error channel (lcnc_errors).
+
+  pipe = CommandPipeline(linuxcnc.command(), linuxcnc.stat())
+  futures = [pipe.submit("mdi", f"G0 X{x}") for x in range(5)]
+  results = pipe.wait_all()
+
+"""
+
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from lcnc_timing import PeriodicSampler, now, sleep
+
+# stat.state values, same as the linuxcnc module
+RCS_DONE, RCS_EXEC, RCS_ERROR = 1, 2, 3
+
+# Commands sent but not yet seen complete
+PIPELINE_DEPTH = 1
+
+# Seconds between polls while commands are outstanding
+PIPELINE_INTERVAL = 0.001
+
+# Seconds from sending a command to it completing before its Future fails with TimeoutError
+COMMAND_TIMEOUT = 5.0
+
+
+class CommandResult(NamedTuple):
+    """
+    How one command completed
+    status is RCS_DONE or RCS_ERROR, None for a command superseded before it was seen complete
+    """
+    serial: int
+    command: str
+    status: Optional[int]
+    superseded: bool
+    sent: float
+    completed: float
+
+    @property
+    def latency(self) -> Optional[float]:
+        """Seconds from sending to the poll that saw the command complete, None if superseded"""
+        return None if self.superseded else self.completed - self.sent
+
+
+class _Pending(NamedTuple):
+    name: str
+    args: Tuple[object, ...]
+    future: Future
+
+
+class _Sent(NamedTuple):
+    serial: int
+    command: str
+    sent: float
+    future: Future
+
+
+class CommandPipeline:
+    """Sends commands without waiting on each, resolving a Future per command from stat.echo_serial_number"""
+
+    def __init__(self, command, stat, depth: int = PIPELINE_DEPTH, timeout: float = COMMAND_TIMEOUT,
+                 interval: float = PIPELINE_INTERVAL):
+        """
+        :param command: linuxcnc.command object, its serial attribute numbers each command sent
+        :param stat: linuxcnc.stat object, polled by pump()
+        :param depth: Commands sent and not yet seen complete, more than 1 can supersede commands
+        :param timeout: Seconds a sent command may take to complete
+        :param interval: Seconds between polls in wait_all() and the background pump
+        """
+        self.command = command
+        self.stat = stat
+        self.depth = depth
+        self.timeout = timeout
+        self.interval = interval
+        self.pending = deque()
+        self.sent: List[_Sent] = []
+        self.results: List[CommandResult] = []
+        self.failures: List[TimeoutError] = []
+        self._lock = threading.Lock()
+        self._sampler = PeriodicSampler(self.pump, interval)
+
+    def submit(self, name: str, *args) -> Future:
+        """
+        Queue a command, sent by this or a later pump()
+        :param name: linuxcnc.command method, e.g. mdi or state
+        :param args: Its arguments
+        :return: Future resolving to a CommandResult, or failing with TimeoutError
+        """
+        future = Future()
+        with self._lock:
+            self.pending.append(_Pending(name, args, future))
+        self.pump()
+        return future
+
+    def batch(self, commands: Iterable[Tuple]) -> List[Future]:
+        """
+        :param commands: (name, *args) tuples, e.g. ("mdi", "G0 X1")
+        :return: Futures in the same order
+        """
+        return [self.submit(*command) for command in commands]
+
+    def _send(self) -> None:
+        while self.pending and len(self.sent) < self.depth:
+            name, args, future = self.pending.popleft()
+            getattr(self.command, name)(*args)
+            self.sent.append(_Sent(self.command.serial, " ".join([name, *map(str, args)]), now(), future))
+
+    def _resolve(self, entry: _Sent, status: Optional[int], superseded: bool, completed: float) -> None:
+        result = CommandResult(entry.serial, entry.command, status, superseded, entry.sent, completed)
+        self.results.append(result)
+        entry.future.set_result(result)
+
+    def pump(self) -> int:
+        """
+        Poll once, resolve completed and superseded commands and send queued ones the depth allows
+        :return: Commands still queued or outstanding
+        """
+        with self._lock:
+            self.stat.poll()
+            polled = now()
+            echo, state = self.stat.echo_serial_number, self.stat.state
+            outstanding = []
+            for entry in self.sent:
+                if entry.serial < echo:
+                    self._resolve(entry, None, True, polled)
+                elif entry.serial == echo and state in (RCS_DONE, RCS_ERROR):
+                    self._resolve(entry, state, False, polled)
+                elif polled - entry.sent > self.timeout:
+                    failure = TimeoutError(f"{entry.command} (serial {entry.serial}) did not complete in "
+                                           f"{self.timeout} s")
+                    self.failures.append(failure)
+                    entry.future.set_exception(failure)
+                else:
+                    outstanding.append(entry)
+            self.sent = outstanding
+            self._send()
+            return len(self.pending) + len(self.sent)
+
+    def start(self) -> None:
+        """Pump in the background, so Futures resolve without anyone waiting on them"""
+        self._sampler.start()
+
+    def stop(self) -> None:
+        """Stop the background pump"""
+        self._sampler.stop()
+
+    def wait_all(self, timeout: Optional[float] = None) -> List[CommandResult]:
+        """
+        Pump until every submitted command completed
+        :param timeout: Seconds to wait, None for as long as the per command timeouts allow
+        :return: Results in completion order, since the last wait_all
+        :raises TimeoutError: A command timed out since the last wait_all, or timeout passed first
+        """
+        start = now()
+        while self.pump():
+            if timeout is not None and now() - start > timeout:
+                raise TimeoutError(f"{len(self.pending) + len(self.sent)} commands outstanding after {timeout} s")
+            sleep(self.interval)
+        with self._lock:
+            results, self.results = self.results, []
+            failures, self.failures = self.failures, []
+        if failures:
+            raise failures[0]
+        return results
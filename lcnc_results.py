@@ -0,0 +1,330 @@
+"""
+  lcnc_results.py - pytest plugin and CLI keeping test timings in SQLite
+
+  Every run stores per-test durations, the time each test spent waiting,
+  polling and commanding, and any benchmark values it recorded. The CLI
+  lists runs and compares two of them to spot regressions.
+
+  python3 lcnc_results.py runs
+  python3 lcnc_results.py compare [OLD_RUN NEW_RUN] [--threshold 0.2]
+
+"""
+
+import argparse
+import functools
+import os
+import socket
+import sqlite3
+import sys
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import pytest
+
+from lcnc_timing import BREAKDOWN
+
+DEFAULT_DB = "results.sqlite"
+
+# Relative slowdown reported as a regression by compare
+REGRESSION_THRESHOLD = 0.2
+
+# Benchmark units where a larger value is better, rates, when record_benchmark is not told either way
+HIGHER_IS_BETTER_UNITS = ("1/s", "Hz")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL,
+    finished REAL,
+    host TEXT,
+    linuxcnc_version TEXT,
+    label TEXT
+);
+CREATE TABLE IF NOT EXISTS tests (
+    run_id INTEGER REFERENCES runs(id),
+    nodeid TEXT,
+    outcome TEXT,
+    duration REAL,
+    wait_time REAL,
+    poll_time REAL,
+    command_time REAL
+);
+CREATE TABLE IF NOT EXISTS benchmarks (
+    run_id INTEGER REFERENCES runs(id),
+    nodeid TEXT,
+    name TEXT,
+    value REAL,
+    unit TEXT,
+    higher_is_better INTEGER
+);
+"""
+
+
+class Change(NamedTuple):
+    """
+    A duration or benchmark that changed past the threshold between two runs
+    regression is True for a slower test, or a benchmark that moved in its worse direction
+    """
+    kind: str
+    name: str
+    old: float
+    new: float
+    change: float
+    regression: bool
+
+
+def higher_is_better(unit: str) -> bool:
+    """
+    :param unit: Benchmark unit
+    :return: Default direction of a benchmark, True for rates in HIGHER_IS_BETTER_UNITS
+    """
+    return unit in HIGHER_IS_BETTER_UNITS
+
+class ResultsDb:
+    """SQLite store of runs, test results and benchmarks"""
+
+    def __init__(self, path: str = DEFAULT_DB):
+        """
+        :param path: Database file, created if missing
+        """
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        # Databases written before benchmarks had a direction
+        if "higher_is_better" not in [row[1] for row in self.connection.execute("PRAGMA table_info(benchmarks)")]:
+            self.connection.execute("ALTER TABLE benchmarks ADD COLUMN higher_is_better INTEGER")
+
+    def start_run(self, label: str = "", linuxcnc_version: str = "") -> int:
+        """
+        :param label: Free text, e.g. a LinuxCNC build
+        :param linuxcnc_version: Version reported by the linuxcnc module
+        :return: New run id
+        """
+        cursor = self.connection.execute(
+            "INSERT INTO runs (started, host, linuxcnc_version, label) VALUES (?, ?, ?, ?)",
+            (time.time(), socket.gethostname(), linuxcnc_version, label))
+        self.connection.commit()
+        return cursor.lastrowid
+
+    def finish_run(self, run_id: int) -> None:
+        """
+        :param run_id: Run to close
+        """
+        self.connection.execute("UPDATE runs SET finished = ? WHERE id = ?", (time.time(), run_id))
+        self.connection.commit()
+
+    def add_test(self, run_id: int, nodeid: str, outcome: str, duration: float,
+                 breakdown: Dict[str, float]) -> None:
+        """
+        :param run_id: Current run
+        :param nodeid: pytest node id
+        :param outcome: passed, failed or skipped
+        :param duration: Seconds spent in the test body
+        :param breakdown: Seconds per category, see Breakdown
+        """
+        self.connection.execute(
+            "INSERT INTO tests VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (run_id, nodeid, outcome, duration, breakdown["wait"], breakdown["poll"], breakdown["command"]))
+        self.connection.commit()
+
+    def add_benchmark(self, run_id: int, nodeid: str, name: str, value: float, unit: str = "",
+                      better: Optional[bool] = None) -> None:
+        """
+        :param run_id: Current run
+        :param nodeid: pytest node id of the test that measured it
+        :param name: Benchmark name
+        :param value: Measured value
+        :param unit: Unit of value, e.g. "s" or "Hz"
+        :param better: True if a higher value is better, None to go by the unit, see higher_is_better
+        """
+        better = higher_is_better(unit) if better is None else better
+        self.connection.execute("INSERT INTO benchmarks VALUES (?, ?, ?, ?, ?, ?)",
+                                (run_id, nodeid, name, value, unit, int(better)))
+        self.connection.commit()
+
+    def runs(self) -> List[Tuple]:
+        """
+        :return: (id, started, finished, host, linuxcnc_version, label, tests) for every run
+        """
+        return self.connection.execute(
+            "SELECT runs.*, COUNT(tests.nodeid) FROM runs LEFT JOIN tests ON tests.run_id = runs.id "
+            "GROUP BY runs.id ORDER BY runs.id").fetchall()
+
+    def durations(self, run_id: int) -> Dict[str, float]:
+        """
+        :return: Dictionary of node id to duration for one run
+        """
+        return dict(self.connection.execute("SELECT nodeid, duration FROM tests WHERE run_id = ?", (run_id,)))
+
+    def benchmarks(self, run_id: int) -> Dict[str, Tuple[float, str, bool]]:
+        """
+        :return: Dictionary of "nodeid name" to (value, unit, higher is better) for one run
+        """
+        rows = self.connection.execute(
+            "SELECT nodeid, name, value, unit, higher_is_better FROM benchmarks WHERE run_id = ?", (run_id,))
+        return {f"{nodeid} {name}": (value, unit, higher_is_better(unit) if better is None else bool(better))
+                for nodeid, name, value, unit, better in rows}
+
+    def compare(self, old_run: int, new_run: int, threshold: float = REGRESSION_THRESHOLD) -> List[Change]:
+        """
+        Compare the durations and benchmarks of two runs
+        :param old_run: Baseline run id
+        :param new_run: Run to check
+        :param threshold: Relative change to report
+        :return: Every change above threshold, durations first
+        """
+        changes = []
+        old_durations, new_durations = self.durations(old_run), self.durations(new_run)
+        for name in sorted(old_durations.keys() & new_durations.keys()):
+            old, new = old_durations[name], new_durations[name]
+            if old and abs(new - old) / abs(old) > threshold:
+                changes.append(Change("duration", name, old, new, (new - old) / abs(old), new > old))
+        old_benchmarks, new_benchmarks = self.benchmarks(old_run), self.benchmarks(new_run)
+        for name in sorted(old_benchmarks.keys() & new_benchmarks.keys()):
+            (old, _, _), (new, _, better) = old_benchmarks[name], new_benchmarks[name]
+            if old and abs(new - old) / abs(old) > threshold:
+                changes.append(Change("benchmark", name, old, new, (new - old) / abs(old),
+                                      new < old if better else new > old))
+        return changes
+
+    def close(self) -> None:
+        """Close the database"""
+        self.connection.close()
+
+
+def pytest_addoption(parser):
+    """Results database options"""
+    parser.addoption("--results-db", default=DEFAULT_DB,
+                     help="SQLite file for test timings, empty to disable")
+    parser.addoption("--results-label", default="",
+                     help="Label stored with this run, e.g. the LinuxCNC build")
+
+
+class ResultsRecorder:
+    """Plugin object writing one run to a ResultsDb"""
+
+    def __init__(self, database: ResultsDb, run_id: int):
+        self.database = database
+        self.run_id = run_id
+
+    def pytest_runtest_logreport(self, report):
+        """Store the test body duration and breakdown"""
+        if report.when == "call":
+            self.database.add_test(self.run_id, report.nodeid, report.outcome, report.duration, BREAKDOWN.totals)
+
+    def add_benchmark(self, nodeid: str, name: str, value: float, unit: str = "",
+                      better: Optional[bool] = None) -> None:
+        """
+        Store a benchmark value in the current run
+        :param nodeid: pytest node id, or "session" for values about the whole run
+        :param name: Benchmark name
+        :param value: Measured value
+        :param unit: Unit of value
+        :param better: True if a higher value is better, None to go by the unit
+        """
+        self.database.add_benchmark(self.run_id, nodeid, name, float(value), unit, better)
+
+    def pytest_unconfigure(self, config):  # pylint: disable=unused-argument
+        """Close the run"""
+        self.database.finish_run(self.run_id)
+        self.database.close()
+
+
+def pytest_configure(config):
+    """Open the database and start a run"""
+    path = config.getoption("--results-db")
+    if path:
+        database = ResultsDb(path)
+        version = getattr(sys.modules.get("linuxcnc"), "version", "")
+        run_id = database.start_run(config.getoption("--results-label"), version)
+        config.pluginmanager.register(ResultsRecorder(database, run_id), "lcnc_results_recorder")
+
+
+def results_recorder(config) -> Optional[ResultsRecorder]:
+    """
+    :param config: pytest config
+    :return: The ResultsRecorder of this session, None when --results-db is empty
+    """
+    return config.pluginmanager.get_plugin("lcnc_results_recorder")
+
+
+@pytest.fixture(autouse=True)
+def results_breakdown(request):
+    """Reset the breakdown for each test and count qtbot.wait as waiting"""
+    BREAKDOWN.reset()
+    if "qtbot" in request.fixturenames:
+        qtbot = request.getfixturevalue("qtbot")
+        wait = qtbot.wait
+
+        @functools.wraps(wait)
+        def timed_wait(*args, **kwargs):
+            with BREAKDOWN.time("wait"):
+                return wait(*args, **kwargs)
+
+        qtbot.wait = timed_wait
+    return BREAKDOWN
+
+
+@pytest.fixture
+def record_benchmark(request):
+    """
+    Store a benchmark value for the current test
+    Call as record_benchmark(name, value, unit), or record_benchmark(name, value, unit, better=True)
+    for a value that regresses when it drops and is not a rate
+    """
+    recorder = results_recorder(request.config)
+
+    def record(name: str, value: float, unit: str = "", better: Optional[bool] = None) -> None:
+        if recorder is not None:
+            recorder.add_benchmark(request.node.nodeid, name, value, unit, better)
+
+    return record
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command line interface
+    :param argv: Arguments, sys.argv[1:] if None
+    :return: Exit code, 1 if compare found a slower test or a benchmark that got worse
+    """
+    parser = argparse.ArgumentParser(description="Compare LinuxCNC status test runs")
+    parser.add_argument("--db", default=DEFAULT_DB, help="SQLite file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("runs", help="List stored runs")
+    compare = commands.add_parser("compare", help="Compare two runs, the last two by default")
+    compare.add_argument("runs", nargs="*", type=int, help="OLD_RUN NEW_RUN")
+    compare.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                         help="Relative change to report")
+    args = parser.parse_args(argv)
+    if args.command == "compare" and len(args.runs) not in (0, 2):
+        parser.error("compare takes OLD_RUN NEW_RUN or no runs")
+
+    if not os.path.exists(args.db):
+        print(f"{args.db} does not exist")
+        return 2
+    database = ResultsDb(args.db)
+    runs = database.runs()
+
+    if args.command == "runs":
+        for run_id, started, finished, host, version, label, tests in runs:
+            elapsed = f"{finished - started:.1f}s" if finished else "unfinished"
+            print(f"{run_id:5} {time.strftime('%Y-%m-%d %H:%M', time.localtime(started))} "
+                  f"{elapsed:>10} {tests:5} tests  {host} {version} {label}")
+        return 0
+
+    if len(args.runs) == 2:
+        old_run, new_run = args.runs
+    elif len(runs) >= 2:
+        old_run, new_run = runs[-2][0], runs[-1][0]
+    else:
+        print("Need two runs to compare")
+        return 2
+    changes = database.compare(old_run, new_run, args.threshold)
+    for kind, name, old, new, change, regression in changes:
+        print(f"{change:+7.1%} {old:12.4f} -> {new:12.4f}  {kind:9} {name}{'  REGRESSION' if regression else ''}")
+    regressions = sum(change.regression for change in changes)
+    print(f"run {old_run} -> {new_run}: {len(changes)} changes over {args.threshold:.0%}, {regressions} regressions")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,315 @@
+"""
+  lcnc_server.py - Status broadcast server, one poller shared by many viewers
+
+  The server polls linuxcnc.stat once per interval and pushes JSON Lines to
+  every subscriber: the full snapshot when a client connects, then only the
+  fields that changed. StatusClient applies the stream and looks like a
+  polled linuxcnc.stat, so LcncWindow and the status helpers work unchanged.
+
+  python3 lcnc_server.py --listen unix:/tmp/lcnc-status.sock
+  python3 lcnc_server.py --listen localhost:5007 --interval 0.05
+  python3 lcnc_server.py --shm lcnc-status
+
+"""
+
+import argparse
+import errno
+import json
+import os
+import select
+import socket
+import threading
+import time
+from stat import S_ISSOCK
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from lcnc_shm import ShmWriter
+from lcnc_status import diff_snapshots, take_snapshot
+from lcnc_watchdog import ConnectionWatchdog
+
+DEFAULT_ADDRESS = "unix:/tmp/lcnc-status.sock"
+
+# Seconds between polls
+SERVER_INTERVAL = 0.05
+
+# Seconds between messages when nothing changed, so clients can tell a quiet controller from a dead server
+HEARTBEAT = 1.0
+
+# Seconds a client may block a send before it is dropped
+SEND_TIMEOUT = 0.5
+
+# Seconds from connecting to the first snapshot before StatusClient.poll gives up
+CONNECT_TIMEOUT = 5.0
+
+
+def parse_address(address: str) -> Tuple[int, object]:
+    """
+    :param address: "unix:/path/to/socket" or "host:port"
+    :return: (socket family, address for bind/connect)
+    """
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "localhost", int(port))
+
+
+def encode(message: Dict[str, object]) -> bytes:
+    """
+    :param message: Message dictionary, tuples are sent as lists
+    :return: One JSON line
+    """
+    return (json.dumps(message, default=repr) + "\n").encode("utf8")
+
+
+def to_stat_value(value):
+    """
+    Turn JSON lists back into the tuples linuxcnc.stat returns
+    :param value: Decoded JSON value
+    :return: Same value with every list replaced by a tuple
+    """
+    if isinstance(value, list):
+        return tuple(to_stat_value(item) for item in value)
+    if isinstance(value, dict):
+        return {key: to_stat_value(item) for key, item in value.items()}
+    return value
+
+
+def remove_stale_socket(path: str) -> None:
+    """
+    Remove a unix socket left behind by a server that did not close(), other files are left for bind() to refuse
+    :param path: Socket path
+    :raises OSError: EADDRINUSE, a server still answers on the socket
+    """
+    if not S_ISSOCK(os.stat(path).st_mode):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(errno.EADDRINUSE, f"A server is already listening on {path}")
+
+
+def default_factory():
+    """
+    :return: New (stat, command) channels, see ConnectionWatchdog
+    """
+    import linuxcnc  # pylint: disable=import-outside-toplevel
+    return linuxcnc.stat(), linuxcnc.command()
+
+
+class StatusServer:
+    """Polls once per interval and broadcasts snapshot deltas to every client"""
+
+    def __init__(self, address: str = DEFAULT_ADDRESS,
+                 factory: Callable[[], Tuple[object, object]] = default_factory,
+                 fields: Optional[Iterable[str]] = None, interval: float = SERVER_INTERVAL,
+                 shm: Optional[str] = None):
+        """
+        :param address: "unix:/path" or "host:port" to listen on
+        :param factory: Returns new (stat, command) objects, linuxcnc by default
+        :param fields: Fields to broadcast, all of them if None
+        :param interval: Seconds between polls
+        :param shm: Also publish every poll to this shared memory segment, see lcnc_shm
+        """
+        self.address = address
+        self.fields = None if fields is None else list(fields)
+        self.interval = interval
+        self.watchdog = ConnectionWatchdog(factory)
+        self.snapshot: Dict[str, object] = {}
+        self.sequence = 0
+        self.polls = 0
+        self.clients: List[socket.socket] = []
+        self.shm = shm
+        self.shm_writer: Optional[ShmWriter] = None
+        self.last_sent = 0.0
+        self._stop = threading.Event()
+
+        family, bind_address = parse_address(address)
+        if family == socket.AF_UNIX and os.path.exists(bind_address):
+            remove_stale_socket(bind_address)
+        self.listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(bind_address)
+        self.listener.listen()
+        self.listener.setblocking(False)
+
+    def accept(self) -> None:
+        """Take new clients and send them the current snapshot"""
+        while True:
+            try:
+                client, _ = self.listener.accept()
+            except BlockingIOError:
+                return
+            client.settimeout(SEND_TIMEOUT)
+            if self.snapshot and not self.send(client, {"seq": self.sequence, "state": self.watchdog.state,
+                                                        "full": self.snapshot}):
+                continue
+            self.clients.append(client)
+
+    def send(self, client: socket.socket, message: Dict[str, object]) -> bool:
+        """
+        :param client: Subscriber socket
+        :param message: Message to send
+        :return: False if the client was too slow or went away, it is closed
+        """
+        try:
+            client.sendall(encode(message))
+            return True
+        except OSError:
+            client.close()
+            return False
+
+    def broadcast(self, message: Dict[str, object]) -> None:
+        """
+        Send a message to every client, dropping the ones that fail
+        :param message: Message to send
+        """
+        self.clients = [client for client in self.clients if self.send(client, message)]
+        self.last_sent = time.monotonic()
+
+    def step(self) -> None:
+        """Poll once, accept clients and send the changes"""
+        state = self.watchdog.state
+        polled = self.watchdog.tick()
+        if polled:
+            self.polls += 1
+            if self.shm_writer is not None:
+                self.shm_writer.publish(self.watchdog.status)
+            elif self.shm is not None:
+                self.shm_writer = ShmWriter(self.shm, self.watchdog.status, self.fields)
+            snapshot = take_snapshot(self.watchdog.status, self.fields)
+            delta = {key: new for key, (_, new) in diff_snapshots(self.snapshot, snapshot).items()}
+            delta.update({key: value for key, value in snapshot.items() if key not in self.snapshot})
+            first = not self.snapshot
+            self.snapshot = snapshot
+            if first:
+                message = {"seq": self.sequence, "state": self.watchdog.state, "full": snapshot}
+                self.clients = [client for client in self.clients if self.send(client, message)]
+            elif delta:
+                self.sequence += 1
+                self.broadcast({"seq": self.sequence, "delta": delta})
+        if self.watchdog.state != state:
+            self.broadcast({"seq": self.sequence, "state": self.watchdog.state})
+        elif time.monotonic() - self.last_sent > HEARTBEAT:
+            self.broadcast({"seq": self.sequence})
+        self.accept()
+
+    def serve_forever(self) -> None:
+        """Run step() every interval until stop() is called"""
+        while not self._stop.is_set():
+            start = time.monotonic()
+            self.step()
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - start)))
+
+    def stop(self) -> None:
+        """Make serve_forever return after the current step"""
+        self._stop.set()
+
+    def close(self) -> None:
+        """Close the listener and every client"""
+        for client in self.clients:
+            client.close()
+        self.clients = []
+        if self.shm_writer is not None:
+            self.shm_writer.close()
+            self.shm_writer = None
+        self.listener.close()
+        family, bind_address = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(bind_address):
+            os.unlink(bind_address)
+
+
+class StatusClient:
+    """Stat like view of a StatusServer stream, poll() applies the messages received so far without waiting"""
+
+    def __init__(self, address: str = DEFAULT_ADDRESS, timeout: float = CONNECT_TIMEOUT):
+        """
+        :param address: "unix:/path" or "host:port" of the server
+        :param timeout: Seconds from connecting to the first snapshot, poll() raises TimeoutError after
+        """
+        family, connect_address = parse_address(address)
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.connect(connect_address)
+        self.socket.setblocking(False)
+        self.timeout = timeout
+        self.connected_at = time.monotonic()
+        self.buffer = b""
+        self.snapshot: Dict[str, object] = {}
+        self.sequence = -1
+        # State of the server's own connection to LinuxCNC, see lcnc_watchdog, None before its first message
+        self.state: Optional[str] = None
+        self.deltas = 0
+
+    def _receive(self) -> bool:
+        if not select.select([self.socket], [], [], 0.0)[0]:
+            return False
+        data = self.socket.recv(65536)
+        if not data:
+            raise ConnectionError("Status server closed the connection")
+        *lines, self.buffer = (self.buffer + data).split(b"\n")
+        for line in lines:
+            self._apply(json.loads(line))
+        return True
+
+    def _apply(self, message: Dict[str, object]) -> None:
+        if "full" in message:
+            self.snapshot = {key: to_stat_value(value) for key, value in message["full"].items()}
+        if "delta" in message:
+            self.snapshot.update({key: to_stat_value(value) for key, value in message["delta"].items()})
+            self.deltas += 1
+        self.state = message.get("state", self.state)
+        self.sequence = message["seq"]
+
+    def poll(self) -> None:
+        """
+        Apply every message received so far, the snapshot stays empty until the server sent it
+        :raises TimeoutError: Still no snapshot timeout seconds after connecting
+        :raises ConnectionError: The server closed the connection
+        """
+        while self._receive():
+            pass
+        if not self.snapshot and time.monotonic() - self.connected_at > self.timeout:
+            raise TimeoutError(f"No snapshot from status server after {self.timeout} s")
+
+    def close(self) -> None:
+        """Disconnect from the server"""
+        self.socket.close()
+
+    def __getattr__(self, name: str):
+        snapshot = self.__dict__.get("snapshot", {})
+        if name in snapshot:
+            return snapshot[name]
+        raise AttributeError(name)
+
+    def __dir__(self) -> List[str]:
+        return list(self.snapshot) + ["poll"]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Command line interface
+    :param argv: Arguments, sys.argv[1:] if None
+    """
+    parser = argparse.ArgumentParser(description="Broadcast LinuxCNC status to many viewers")
+    parser.add_argument("--listen", default=DEFAULT_ADDRESS, help="unix:/path or host:port")
+    parser.add_argument("--interval", type=float, default=SERVER_INTERVAL, help="Seconds between polls")
+    parser.add_argument("--shm", metavar="NAME", help="Also mirror the status into this shared memory segment")
+    args = parser.parse_args(argv)
+
+    server = StatusServer(args.listen, interval=args.interval, shm=args.shm)
+    print(f"Serving LinuxCNC status on {args.listen}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
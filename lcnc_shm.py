@@ -0,0 +1,211 @@
+"""
+  lcnc_shm.py - Shared memory status mirror protected by a seqlock
+
+  One poller publishes the numeric stat fields into a fixed layout shared
+  memory segment, readers in other processes unpack fields straight from
+  the mapping. The segment starts with a sequence counter that is odd while
+  the writer is busy, readers retry when it changed under them.
+
+  Segment layout: sequence (u64), layout length (u32), layout JSON padded to
+  8 bytes, then the fields at the offsets the layout gives.
+
+"""
+
+import json
+import mmap
+import os
+import struct
+import time
+from multiprocessing import shared_memory
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from lcnc_status import stat_fields
+
+HEADER = struct.Struct("=QI")
+
+# Seconds a read keeps retrying before giving up on a writer that never finishes
+READ_TIMEOUT = 1.0
+
+# Where POSIX shared memory segments appear on Linux
+SHM_DIR = "/dev/shm"
+
+
+def field_format(value) -> Optional[str]:
+    """
+    struct format for a stat value, fields without a fixed size have none
+    :param value: Field value
+    :return: e.g. "q", "d" or "9d", None for strings, dicts and nested tuples
+    """
+    if isinstance(value, bool):
+        return "?"
+    if isinstance(value, int):
+        return "q"
+    if isinstance(value, float):
+        return "d"
+    if isinstance(value, tuple) and value and all(isinstance(item, (int, float)) for item in value):
+        kind = "q" if all(isinstance(item, int) and not isinstance(item, bool) for item in value) else "d"
+        return f"{len(value)}{kind}"
+    return None
+
+
+def make_layout(stat, fields: Optional[Iterable[str]] = None) -> List[Tuple[str, str, int]]:
+    """
+    Fixed layout for the fields of a polled stat object
+    :param stat: linuxcnc.stat object, already polled, sets the array sizes
+    :param fields: Fields to mirror, every field with a fixed size if None
+    :return: (field, struct format, offset from the start of the data) entries
+    """
+    layout = []
+    offset = 0
+    for field in stat_fields(stat) if fields is None else fields:
+        fmt = field_format(getattr(stat, field))
+        if fmt is None:
+            continue
+        layout.append((field, fmt, offset))
+        offset += struct.calcsize("=" + fmt)
+    return layout
+
+
+def _data_start(layout_text: bytes) -> int:
+    return (HEADER.size + len(layout_text) + 7) // 8 * 8
+
+
+class ShmWriter:
+    """Creates the segment and publishes polled stat objects into it"""
+
+    def __init__(self, name: str, stat, fields: Optional[Iterable[str]] = None):
+        """
+        :param name: Shared memory name, readers open it with ShmReader(name)
+        :param stat: linuxcnc.stat object, already polled, sets the layout
+        :param fields: Fields to mirror, every field with a fixed size if None
+        """
+        self.layout = make_layout(stat, fields)
+        layout_text = json.dumps(self.layout).encode("utf8")
+        self.start = _data_start(layout_text)
+        size = self.start + sum(struct.calcsize("=" + fmt) for _, fmt, _ in self.layout)
+        self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        self.buffer = self.shm.buf
+        HEADER.pack_into(self.buffer, 0, 0, len(layout_text))
+        self.buffer[HEADER.size:HEADER.size + len(layout_text)] = layout_text
+        self.packers = [(field, struct.Struct("=" + fmt), self.start + offset, fmt[0].isdigit())
+                        for field, fmt, offset in self.layout]
+        self.sequence = 0
+        self.publish(stat)
+
+    def publish(self, stat) -> None:
+        """
+        Copy the mirrored fields of a polled stat object into the segment
+        :param stat: linuxcnc.stat object, already polled
+        """
+        values = [(packer, offset, is_array, getattr(stat, field))
+                  for field, packer, offset, is_array in self.packers]
+        self.sequence += 1
+        struct.pack_into("=Q", self.buffer, 0, self.sequence)
+        for packer, offset, is_array, value in values:
+            if is_array:
+                packer.pack_into(self.buffer, offset, *value)
+            else:
+                packer.pack_into(self.buffer, offset, value)
+        self.sequence += 1
+        struct.pack_into("=Q", self.buffer, 0, self.sequence)
+
+    def close(self) -> None:
+        """Close and remove the segment"""
+        self.buffer = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+class ShmReader:
+    """
+    Stat like view of a ShmWriter segment, poll() takes a consistent copy
+    The segment is mapped read only, without SharedMemory, so a reader never removes it at exit
+    """
+
+    def __init__(self, name: str):
+        """
+        :param name: Shared memory name given to ShmWriter
+        """
+        with open(os.path.join(SHM_DIR, name), "rb") as segment:
+            self.mapping = mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = self.mapping
+        _, length = HEADER.unpack_from(self.buffer, 0)
+        layout_text = bytes(self.buffer[HEADER.size:HEADER.size + length])
+        self.layout = [tuple(entry) for entry in json.loads(layout_text)]
+        start = _data_start(layout_text)
+        self.unpackers = {field: (struct.Struct("=" + fmt), start + offset, fmt[0].isdigit())
+                          for field, fmt, offset in self.layout}
+        self.snapshot: Dict[str, object] = {}
+        self.retries = 0
+
+    def read(self, fields: Optional[Iterable[str]] = None) -> Dict[str, object]:
+        """
+        Read fields from one publish, retrying while the writer is busy
+        :param fields: Fields to read, all of them if None
+        :return: Dictionary of field name to value, arrays as tuples
+        """
+        unpackers = self.unpackers if fields is None else {field: self.unpackers[field] for field in fields}
+        buffer = self.buffer
+        deadline = None
+        while True:
+            sequence = struct.unpack_from("=Q", buffer, 0)[0]
+            if not sequence % 2:
+                values = {field: unpacker.unpack_from(buffer, offset) if is_array
+                          else unpacker.unpack_from(buffer, offset)[0]
+                          for field, (unpacker, offset, is_array) in unpackers.items()}
+                if struct.unpack_from("=Q", buffer, 0)[0] == sequence:
+                    return values
+            self.retries += 1
+            if deadline is None:
+                deadline = time.perf_counter() + READ_TIMEOUT
+            elif time.perf_counter() > deadline:
+                raise TimeoutError("Shared memory writer did not finish a publish")
+
+    @property
+    def sequence(self) -> int:
+        """Publishes so far, times two"""
+        return struct.unpack_from("=Q", self.buffer, 0)[0]
+
+    def poll(self) -> None:
+        """Take a consistent copy of every field"""
+        self.snapshot = self.read()
+
+    def close(self) -> None:
+        """Detach from the segment, the writer removes it"""
+        self.buffer = None
+        self.unpackers = {}
+        self.mapping.close()
+
+    def __getattr__(self, name: str):
+        snapshot = self.__dict__.get("snapshot", {})
+        if name in snapshot:
+            return snapshot[name]
+        raise AttributeError(name)
+
+    def __dir__(self) -> List[str]:
+        return [field for field, _, _ in self.layout] + ["poll"]
+
+
+def reader_throughput(name: str, duration: float = 1.0,
+                      fields: Optional[Iterable[str]] = None) -> Dict[str, float]:
+    """
+    Benchmark consistent reads of a segment
+    :param name: Shared memory name
+    :param duration: Seconds to read for
+    :param fields: Fields per read, all of them if None
+    :return: reads, reads_per_second, retries and mean_read in seconds
+    """
+    reader = ShmReader(name)
+    fields = None if fields is None else list(fields)
+    reads = 0
+    start = time.perf_counter()
+    end = start + duration
+    while time.perf_counter() < end:
+        for _ in range(100):
+            reader.read(fields)
+        reads += 100
+    elapsed = time.perf_counter() - start
+    retries = reader.retries
+    reader.close()
+    return {"reads": reads, "reads_per_second": reads / elapsed,
+            "retries": retries, "mean_read": elapsed / reads}
@@ -0,0 +1,837 @@
+"""
+  lcnc_sim.py - Simulated controller standing in for the linuxcnc module
+
+  SimController keeps task state, homing, MDI and program moves, offsets,
+  the tool table and the I/O pins, and advances them on a clock. Commands
+  are scheduled events, moves are timed segments, so a VirtualClock shared
+  with the wait helpers makes homing, moves and timeouts finish at once
+  while they still happen in the same order on every run.
+
+  install() registers a linuxcnc like module, so code doing import linuxcnc
+  talks to the simulator:
+
+  clock = VirtualClock(); set_clock(clock); install("configs/basic.ini", clock)
+
+  HAL is not simulated, halcmd reads and writes still need LinuxCNC.
+
+"""
+
+import heapq
+import itertools
+import math
+import os
+import re
+import sys
+import threading
+import types
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from lcnc_ini import AXIS_LETTERS, JOINT_TYPES, LINEAR_UNITS, ANGULAR_UNITS, load_ini
+from lcnc_timing import RealClock, VirtualClock
+from lcnc_tooltable import iter_tool_table
+
+# linuxcnc module constants, same values as the real module
+STATE_ESTOP, STATE_ESTOP_RESET, STATE_OFF, STATE_ON = 1, 2, 3, 4
+MODE_MANUAL, MODE_AUTO, MODE_MDI = 1, 2, 3
+INTERP_IDLE, INTERP_READING, INTERP_PAUSED, INTERP_WAITING = 1, 2, 3, 4
+RCS_DONE, RCS_EXEC, RCS_ERROR = 1, 2, 3
+EXEC_ERROR, EXEC_DONE, EXEC_WAITING_FOR_MOTION = 1, 2, 3
+AUTO_RUN, AUTO_PAUSE, AUTO_RESUME, AUTO_STEP = 0, 1, 2, 3
+TRAJ_MODE_FREE, TRAJ_MODE_COORD, TRAJ_MODE_TELEOP = 1, 2, 3
+NML_ERROR, NML_TEXT, NML_DISPLAY = 1, 2, 3
+OPERATOR_ERROR, OPERATOR_TEXT, OPERATOR_DISPLAY = 11, 12, 13
+
+CONSTANTS = {name: value for name, value in globals().items()
+             if name.isupper() and name.split("_")[0] in ("STATE", "MODE", "INTERP", "RCS", "EXEC", "AUTO", "TRAJ",
+                                                          "NML", "OPERATOR")}
+
+# Seconds from a command being sent to the controller acting on it
+COMMAND_DELAY = 0.002
+
+# Seconds each home sequence takes
+HOME_TIME = 1.0
+
+# Virtual seconds a poll takes, so busy polling loops still see time pass
+POLL_TIME = 0.0001
+
+# Velocity in units per second when the ini gives none
+DEFAULT_VELOCITY = 25.0
+
+# Acceleration in units per second squared when the ini gives none
+DEFAULT_ACCELERATION = 100.0
+
+# Sizes of the array fields of linuxcnc.stat
+MAX_JOINTS = 16
+MAX_SPINDLES = 8
+MAX_IO = 64
+
+# Block words, comments in parentheses and after ; are removed first
+WORD = re.compile(r"([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))")
+COMMENT = re.compile(r"\([^)]*\)|;.*")
+
+# Motion G codes times 10, G80 cancels; arcs and canned cycles are simulated as one straight feed move
+MOTION_CODES = {0: "G0", 10: "G1", 20: "G2", 30: "G3", 800: "G80",
+                **{code: f"G{code // 10}" for code in range(810, 900, 10)}}
+
+# G code word of each coordinate system, g5x_index 1 to 9
+COORDINATE_CODES = {540: 1, 550: 2, 560: 3, 570: 4, 580: 5, 590: 6, 591: 7, 592: 8, 593: 9}
+
+
+class SimTool(NamedTuple):
+    """stat.tool_table entry"""
+    id: int
+    xoffset: float
+    yoffset: float
+    zoffset: float
+    aoffset: float
+    boffset: float
+    coffset: float
+    uoffset: float
+    voffset: float
+    woffset: float
+    diameter: float
+    frontangle: float
+    backangle: float
+    orientation: int
+
+
+class Segment(NamedTuple):
+    """
+    A move with a trapezoidal velocity profile from and to a stop, or a dwell when start equals end
+    velocity is the peak velocity, lower than requested when the move is too short to reach it
+    """
+    start_time: float
+    end_time: float
+    start: Tuple[float, ...]
+    end: Tuple[float, ...]
+    velocity: float
+    acceleration: float
+    line: int
+
+    def travel(self, when: float) -> Tuple[float, float]:
+        """
+        :param when: Time within the segment
+        :return: Distance moved and velocity at that time
+        """
+        elapsed = when - self.start_time
+        if not self.velocity:
+            return 0.0, 0.0
+        ramp = self.velocity / self.acceleration
+        remaining = self.end_time - when
+        if elapsed < ramp:
+            return self.acceleration * elapsed ** 2 / 2, self.acceleration * elapsed
+        if remaining < ramp:
+            return math.dist(self.start, self.end) - self.acceleration * remaining ** 2 / 2, \
+                self.acceleration * remaining
+        return self.velocity * (elapsed - ramp / 2), self.velocity
+
+
+class SimError(Exception):
+    """A command the controller rejects, reported on the error channel"""
+
+
+class SimController:
+    """
+    State of the simulated machine, advanced to the clock's time on every poll and command
+    Scheduled events run in time order, events at the same time in the order they were scheduled
+    """
+
+    def __init__(self, ini_filename: str, clock=None):
+        """
+        :param ini_filename: Configuration to simulate, sets joints, axes, limits and velocities
+        :param clock: RealClock or VirtualClock, RealClock if None
+        """
+        self.clock = RealClock() if clock is None else clock
+        self.config = load_ini(ini_filename)
+        self.ini_filename = ini_filename
+        self.lock = threading.RLock()
+        self.events: List[Tuple[float, int, Callable[[], None]]] = []
+        self.order = itertools.count()
+        self.now = self.clock.monotonic()
+
+        config = self.config
+        self.coordinates = "".join(dict.fromkeys(config.traj.coordinates.upper()))
+        self.joint_axes = [AXIS_LETTERS.index(self.coordinates[min(joint, len(self.coordinates) - 1)])
+                           for joint in range(config.kins.joints)]
+        self.max_velocity = config.traj.max_velocity or DEFAULT_VELOCITY
+        self.max_acceleration = config.traj.max_acceleration or DEFAULT_ACCELERATION
+        self.limits = {AXIS_LETTERS.index(letter): (axis.min_limit, axis.max_limit)
+                       for letter, axis in config.axes.items()}
+        self.axis_velocity = {AXIS_LETTERS.index(letter): axis.max_velocity
+                              for letter, axis in config.axes.items() if axis.max_velocity}
+        self.axis_acceleration = {AXIS_LETTERS.index(letter): axis.max_acceleration
+                                  for letter, axis in config.axes.items() if axis.max_acceleration}
+
+        self.task_state = STATE_ESTOP
+        self.task_mode = MODE_MANUAL
+        self.interp_state = INTERP_IDLE
+        self.homed = [0] * config.kins.joints
+        self.position = (0.0,) * len(AXIS_LETTERS)
+        self.segments: List[Segment] = []
+        self.serial = 0
+        self.echo_serial_number = 0
+        self.done_serial = 0
+        self.rcs_state = RCS_DONE
+        self.busy_serial = 0
+        self.errors: List[Tuple[int, str]] = []
+
+        self.g5x_index = 1
+        self.coordinate_systems = {index: (0.0,) * len(AXIS_LETTERS) for index in range(1, 10)}
+        self.g92_offset = (0.0,) * len(AXIS_LETTERS)
+        self.tool_in_spindle = 0
+        self.tool_offset = (0.0,) * len(AXIS_LETTERS)
+        self.tool_table: Tuple[SimTool, ...] = ()
+        self.motion_code = 0
+        self.motion_mode = TRAJ_MODE_FREE
+        self.feed = 0.0
+        self.incremental = False
+        self.program: List[str] = []
+        self.file = ""
+        self.line = 0
+        self.din = [0] * MAX_IO
+        self.dout = [0] * MAX_IO
+        self.ain = [0.0] * MAX_IO
+        self.aout = [0.0] * MAX_IO
+        self.constant: Optional[Dict[str, object]] = None
+        self.unused_joints: Tuple[Dict[str, object], ...] = ()
+        self._read_tool_table()
+
+    # Scheduling
+
+    def schedule(self, delay: float, action: Callable[[], None]) -> None:
+        """
+        Run action delay seconds after the current simulation time
+        :param delay: Seconds
+        :param action: Called with the lock held and self.now at the event time
+        """
+        self.schedule_at(self.now + delay, action)
+
+    def schedule_at(self, when: float, action: Callable[[], None]) -> None:
+        """
+        Run action at a simulation time, e.g. exactly when a segment ends
+        :param when: Simulation time
+        :param action: Called with the lock held and self.now at the event time
+        """
+        heapq.heappush(self.events, (when, next(self.order), action))
+
+    def update(self) -> None:
+        """Run every event due by the clock's time, in order"""
+        with self.lock:
+            now = self.clock.monotonic()
+            while self.events and self.events[0][0] <= now:
+                when, _, action = heapq.heappop(self.events)
+                self.now = max(self.now, when)
+                self._retire()
+                action()
+            self.now = max(self.now, now)
+            self._retire()
+
+    def _retire(self) -> None:
+        """Drop finished segments, their end becomes the resting position"""
+        finished = 0
+        while finished < len(self.segments) and self.segments[finished].end_time <= self.now:
+            finished += 1
+        if finished:
+            self.position = self.segments[finished - 1].end
+            self.line = self.segments[finished - 1].line
+            del self.segments[:finished]
+
+    def next_event(self) -> Optional[float]:
+        """Time of the next scheduled event, None if nothing is scheduled"""
+        with self.lock:
+            return self.events[0][0] if self.events else None
+
+    def send(self, action: Callable[[int], None]) -> int:
+        """
+        Queue a command the way NML does, it takes effect after COMMAND_DELAY
+        A command is done once its action returns, unless the action made it busy_serial
+        :param action: Called with the serial number to carry the command out, raises SimError to reject it
+        :return: Serial number of the command
+        """
+        with self.lock:
+            self.update()
+            self.serial += 1
+            serial = self.serial
+
+            def receive():
+                self.echo_serial_number = serial
+                self.rcs_state = RCS_EXEC
+                try:
+                    action(serial)
+                except SimError as e:
+                    self.errors.append((OPERATOR_ERROR, str(e)))
+                    self.rcs_state = RCS_ERROR
+                    self.done_serial = serial
+                    return
+                if self.busy_serial != serial:
+                    self.rcs_state = RCS_DONE
+                    self.done_serial = serial
+
+            self.schedule(COMMAND_DELAY, receive)
+            return serial
+
+    def finish(self, serial: int) -> None:
+        """Mark a command that ran until now as done"""
+        if self.busy_serial == serial:
+            self.busy_serial = 0
+        self.done_serial = max(self.done_serial, serial)
+        # stat.state describes the command echoed last
+        if serial == self.echo_serial_number and self.rcs_state == RCS_EXEC:
+            self.rcs_state = RCS_DONE
+
+    def wait_complete(self, serial: int, timeout: float) -> int:
+        """
+        Sleep on the clock until a command is done, straight to the next event with a VirtualClock
+        :param serial: Command serial number
+        :param timeout: Seconds
+        :return: RCS_DONE or RCS_ERROR, -1 on timeout
+        """
+        deadline = self.clock.monotonic() + timeout
+        while True:
+            self.update()
+            with self.lock:
+                if self.done_serial >= serial:
+                    return self.rcs_state if self.rcs_state != RCS_EXEC else RCS_DONE
+            now = self.clock.monotonic()
+            if now >= deadline:
+                return -1
+            upcoming = self.next_event()
+            target = min(deadline, upcoming if upcoming is not None else deadline)
+            if isinstance(self.clock, VirtualClock):
+                self.clock.advance_to(target)
+            else:
+                self.clock.sleep(target - now)
+
+    # Machine state
+
+    def axis_position(self, when: float) -> Tuple[Tuple[float, ...], float, int]:
+        """
+        :param when: Simulation time
+        :return: Machine position, velocity and program line at that time
+        """
+        for segment in self.segments:
+            if when < segment.end_time:
+                if when <= segment.start_time:
+                    return segment.start, 0.0, segment.line
+                distance, velocity = segment.travel(when)
+                fraction = distance / math.dist(segment.start, segment.end) if velocity else 0.0
+                position = tuple(a + (b - a) * fraction for a, b in zip(segment.start, segment.end))
+                return position, velocity, segment.line
+        return self.position, 0.0, self.line
+
+    @property
+    def g5x_offset(self) -> Tuple[float, ...]:
+        """Offset of the active coordinate system"""
+        return self.coordinate_systems[self.g5x_index]
+
+    def _require(self, condition: bool, message: str) -> None:
+        if not condition:
+            raise SimError(message)
+
+    def abort(self) -> None:
+        """Carry out command.abort, stop motion where it is and end the program"""
+        if self.segments:
+            self.position = self.axis_position(self.now)[0]
+        self.segments = []
+        self.program = []
+        self.interp_state = INTERP_IDLE
+        if self.busy_serial:
+            self.finish(self.busy_serial)
+
+    def set_state(self, state: int) -> None:
+        """Carry out command.state"""
+        if state == STATE_ESTOP:
+            self.abort()
+            self.task_state = STATE_ESTOP
+        elif state == STATE_ESTOP_RESET:
+            # Also turns a machine that is on off, as in LinuxCNC
+            self.abort()
+            self.task_state = STATE_ESTOP_RESET
+        elif state == STATE_ON:
+            self._require(self.task_state != STATE_ESTOP, "Can't turn machine on while in estop")
+            self.task_state = STATE_ON
+            self.motion_mode = TRAJ_MODE_COORD
+        elif state == STATE_OFF:
+            # Like LinuxCNC, a machine turned off reports STATE_ESTOP_RESET
+            if self.task_state != STATE_ESTOP:
+                self.abort()
+                self.task_state = STATE_ESTOP_RESET
+        else:
+            raise SimError(f"Unknown state {state}")
+
+    def set_mode(self, mode: int) -> None:
+        """Carry out command.mode"""
+        self._require(mode in (MODE_MANUAL, MODE_AUTO, MODE_MDI), f"Unknown mode {mode}")
+        self._require(self.interp_state == INTERP_IDLE or mode == self.task_mode,
+                      "Can't change mode while the interpreter is running")
+        self.task_mode = mode
+
+    def home(self, joint: int) -> None:
+        """Carry out command.home, homed flags are set HOME_TIME later per home sequence"""
+        self._require(self.task_state == STATE_ON, "Can't home when the machine is not on")
+        self._require(self.task_mode == MODE_MANUAL, "Must be in manual mode to home")
+        self._require(-1 <= joint < len(self.homed), f"Joint {joint} does not exist")
+        joints = range(len(self.homed)) if joint == -1 else [joint]
+        groups = sorted({self.config.joints[index].home_sequence or 0 for index in joints})
+        for number, group in enumerate(groups, 1):
+            members = [index for index in joints if (self.config.joints[index].home_sequence or 0) == group]
+            self.schedule(HOME_TIME * number, lambda members=members: self._homed(members))
+
+    def _homed(self, joints: List[int]) -> None:
+        if self.task_state != STATE_ON:
+            return
+        position = list(self.position)
+        for joint in joints:
+            self.homed[joint] = 1
+            position[self.joint_axes[joint]] = 0.0
+        self.position = tuple(position)
+
+    def mdi(self, text: str, serial: int) -> None:
+        """
+        Carry out command.mdi, the command is done once its motion ends
+        Blocks sent while an MDI command runs are queued behind it, as in LinuxCNC
+        """
+        self._require(self.task_state == STATE_ON, "Can't issue MDI command when the machine is not on")
+        self._require(self.task_mode == MODE_MDI, "Must be in MDI mode to issue MDI command")
+        self._require(all(self.homed), "Can't issue MDI command when not homed")
+        self._require(self.interp_state == INTERP_IDLE or self.busy_serial != 0, "Interpreter is busy")
+        self.execute(text, 0)
+        self._run(serial)
+
+    def program_open(self, path: str) -> None:
+        """Carry out command.program_open"""
+        self._require(self.interp_state == INTERP_IDLE, "Can't open a program while running")
+        try:
+            with open(path, encoding="utf8") as program:
+                self.program = program.read().splitlines()
+        except OSError as e:
+            raise SimError(f"Unable to open file <{path}>") from e
+        self.file = path
+
+    def auto(self, action: int, line: int) -> None:
+        """Carry out command.auto, only AUTO_RUN is simulated"""
+        self._require(action == AUTO_RUN, f"Auto action {action} is not simulated")
+        self._require(self.task_state == STATE_ON, "Can't run a program when the machine is not on")
+        self._require(self.task_mode == MODE_AUTO, "Must be in auto mode to run a program")
+        self._require(all(self.homed), "Can't run a program when not homed")
+        self._require(self.file != "", "No program open")
+        for number, block in enumerate(self.program[line:], line + 1):
+            try:
+                if self.execute(block, number):
+                    break
+            except SimError as e:
+                # A program error stops the run, motion read ahead of the bad line included
+                self.abort()
+                raise SimError(f"Near line {number} of {self.file}: {e}") from e
+        self.interp_state = INTERP_READING
+        self._end_program()
+
+    def _run(self, serial: int) -> None:
+        if not self.segments:
+            return
+        self.busy_serial = serial
+        self.interp_state = INTERP_READING
+        self.schedule_at(self.segments[-1].end_time, lambda: self._motion_done(serial))
+
+    def _end_program(self) -> None:
+        self.schedule_at(self.segments[-1].end_time if self.segments else self.now, lambda: self._motion_done(0))
+
+    def _motion_done(self, serial: int) -> None:
+        if not self.segments:
+            self.interp_state = INTERP_IDLE
+        if serial:
+            self.finish(serial)
+
+    def execute(self, block: str, line: int) -> bool:
+        """
+        Interpret one block: G0/G1/G4 moves, G10 L2, G43/G49, G52, G53, G54-G59.3, G90/G91, G92/G92.1, M2/M30/M61
+        Other words that do not move, e.g. G17 or M3, are accepted and ignored
+        Words for axes outside [TRAJ]COORDINATES are rejected, as the interpreter does
+        :param block: G code line
+        :param line: Program line number, 0 for MDI
+        :return: True if the block ends the program
+        """
+        words = WORD.findall(COMMENT.sub("", block.upper()))
+        gcodes = [round(float(value) * 10) for letter, value in words if letter == "G"]
+        mcodes = [int(float(value)) for letter, value in words if letter == "M"]
+        values = {letter: float(value) for letter, value in words if letter not in "GM"}
+        axes = {AXIS_LETTERS.index(letter): value for letter, value in values.items() if letter in AXIS_LETTERS}
+        for letter in values:
+            self._require(letter in AXIS_LETTERS + "FHIJKLNPQRST", f"Unknown word {letter}")
+            self._require(letter not in AXIS_LETTERS or letter in self.coordinates,
+                          f"Cannot use axis {letter}, it is not in [TRAJ]COORDINATES {self.coordinates}")
+
+        if "F" in values:
+            self.feed = values["F"] / 60
+        if 61 in mcodes:
+            self._require("Q" in values, "M61 requires a Q word")
+            self.tool_in_spindle = int(values["Q"])
+        for code in gcodes:
+            if code in COORDINATE_CODES:
+                self.g5x_index = COORDINATE_CODES[code]
+            elif code in (900, 910):
+                self.incremental = code == 910
+            elif code in MOTION_CODES:
+                self.motion_code = code
+            elif code == 490:
+                self.tool_offset = (0.0,) * len(AXIS_LETTERS)
+            elif code == 430:
+                tool = int(values.get("H", self.tool_in_spindle))
+                entry = next((entry for entry in self.tool_table if entry.id == tool), None)
+                self.tool_offset = tuple(entry[1:10]) if entry else (0.0,) * len(AXIS_LETTERS)
+
+        position = self._planned_position()
+        if 100 in gcodes:
+            self._require(values.get("L") == 2, "Only G10 L2 is simulated")
+            index = int(values.get("P", 0)) or self.g5x_index
+            self._require(1 <= index <= 9, f"Coordinate system P{index} does not exist")
+            offset = list(self.coordinate_systems[index])
+            for axis, value in axes.items():
+                offset[axis] = value
+            self.coordinate_systems[index] = tuple(offset)
+        elif 921 in gcodes:
+            self.g92_offset = (0.0,) * len(AXIS_LETTERS)
+        elif 520 in gcodes or 920 in gcodes:
+            offset = list(self.g92_offset)
+            for axis, value in axes.items():
+                offset[axis] = value if 520 in gcodes else \
+                    position[axis] - self.g5x_offset[axis] - self.tool_offset[axis] - value
+            self.g92_offset = tuple(offset)
+        elif 40 in gcodes:
+            self._queue(position, position, values.get("P", 0.0), line)
+        elif axes and self.motion_code != 800:
+            target = list(position)
+            for axis, value in axes.items():
+                if 530 in gcodes:
+                    target[axis] = value
+                elif self.incremental:
+                    target[axis] = position[axis] + value
+                else:
+                    target[axis] = value + self.g5x_offset[axis] + self.g92_offset[axis] + self.tool_offset[axis]
+                low, high = self.limits.get(axis, (None, None))
+                if (low is not None and target[axis] < low) or (high is not None and target[axis] > high):
+                    raise SimError(f"Move on line {line} would exceed {AXIS_LETTERS[axis]}'s limit")
+            self._move(position, tuple(target), line)
+        return 2 in mcodes or 30 in mcodes
+
+    def _planned_position(self) -> Tuple[float, ...]:
+        return self.segments[-1].end if self.segments else self.axis_position(self.now)[0]
+
+    def _move(self, start: Tuple[float, ...], end: Tuple[float, ...], line: int) -> None:
+        distance = math.dist(start, end)
+        if not distance:
+            return
+        # The tightest limit of the moving axes, scaled by how much of the move each axis makes
+        velocity = self.max_velocity if self.motion_code == 0 or not self.feed else min(self.feed, self.max_velocity)
+        acceleration = self.max_acceleration
+        for axis, (a, b) in enumerate(zip(start, end)):
+            share = abs(b - a) / distance
+            if share:
+                velocity = min(velocity, self.axis_velocity.get(axis, math.inf) / share)
+                acceleration = min(acceleration, self.axis_acceleration.get(axis, math.inf) / share)
+        velocity = min(velocity, math.sqrt(distance * acceleration))
+        ramp = velocity / acceleration
+        self._queue(start, end, 2 * ramp + (distance - velocity * ramp) / velocity, line, velocity, acceleration)
+
+    def _queue(self, start: Tuple[float, ...], end: Tuple[float, ...], duration: float, line: int,
+               velocity: float = 0.0, acceleration: float = 0.0) -> None:
+        begin = self.segments[-1].end_time if self.segments else self.now
+        self.segments.append(Segment(begin, begin + duration, start, end, velocity, acceleration, line))
+
+    def load_tool_table(self) -> None:
+        """Carry out command.load_tool_table"""
+        self._require(self.interp_state == INTERP_IDLE, "Can't load the tool table while running")
+        try:
+            self._read_tool_table()
+        except (OSError, ValueError) as e:
+            raise SimError(f"Tool table: {e}") from e
+
+    def _read_tool_table(self) -> None:
+        path = self.config.tool_table
+        if not path or not os.path.exists(path):
+            self.tool_table = ()
+            return
+        self.tool_table = tuple(SimTool(entry.tool, *entry.offsets, entry.diameter, entry.frontangle,
+                                        entry.backangle, entry.orientation)
+                                for entry in iter_tool_table(path))
+
+    def _constant_fields(self) -> Dict[str, object]:
+        config = self.config
+        linear_units = LINEAR_UNITS[config.traj.linear_units.lower()]
+        return {
+            "ini_filename": self.ini_filename,
+            "joints": len(self.homed),
+            "axes": len(self.coordinates),
+            "axis_mask": sum(1 << AXIS_LETTERS.index(letter) for letter in self.coordinates),
+            "spindles": config.traj.spindles,
+            "linear_units": linear_units,
+            "angular_units": ANGULAR_UNITS[config.traj.angular_units.lower()],
+            "program_units": 2 if linear_units == 1 else 1,
+            "cycle_time": config.servo_period or 0.001,
+            "max_velocity": self.max_velocity,
+            "acceleration": config.traj.default_acceleration or 0.0,
+            "max_acceleration": config.traj.max_acceleration or 0.0,
+            "axis": tuple({"min_position_limit": self.limits.get(index, (None, None))[0] or 0.0,
+                           "max_position_limit": self.limits.get(index, (None, None))[1] or 0.0,
+                           "velocity": 0.0} for index in range(len(AXIS_LETTERS))),
+            "spindle": tuple({"speed": 0.0, "direction": 0, "enabled": 0, "brake": 1} for _ in range(MAX_SPINDLES)),
+            "paused": False,
+            "queue_full": False,
+            "adaptive_feed_enabled": False,
+            "block_delete": False,
+            "call_level": 0,
+            "command": "",
+            "debug": 0,
+            "delay_left": 0.0,
+            "feed_hold_enabled": True,
+            "feed_override_enabled": True,
+            "feedrate": 1.0,
+            "flood": 0,
+            "input_timeout": False,
+            "interpreter_errcode": 0,
+            "kinematics_type": 1,
+            "limit": (0,) * MAX_JOINTS,
+            "lube_level": 0,
+            "mist": 0,
+            "num_extrajoints": 0,
+            "optional_stop": False,
+            "pocket_prepped": -1,
+            "probe_tripped": False,
+            "probe_val": 0,
+            "probed_position": (0.0,) * len(AXIS_LETTERS),
+            "probing": False,
+            "rapidrate": 1.0,
+            "rotation_xy": 0.0,
+            "task_paused": 0,
+            "tool_from_pocket": 0,
+        }
+
+    def _joint(self, index: int, homed: int, position: float) -> Dict[str, object]:
+        if index >= len(self.config.joints):
+            return {"jointType": 0, "homed": 0, "input": 0.0, "output": 0.0, "min_position_limit": 0.0,
+                    "max_position_limit": 0.0, "backlash": 0.0, "max_ferror": 0.0, "min_ferror": 0.0}
+        joint = self.config.joints[index]
+        return {"jointType": JOINT_TYPES[joint.type.upper()], "homed": homed,
+                "input": position, "output": position,
+                "min_position_limit": joint.min_limit or 0.0, "max_position_limit": joint.max_limit or 0.0,
+                "backlash": joint.backlash or 0.0, "max_ferror": joint.ferror or 0.0,
+                "min_ferror": joint.min_ferror or 0.0}
+
+    def snapshot(self) -> Dict[str, object]:
+        """
+        Status fields at the current time, the same names as linuxcnc.stat
+        :return: Dictionary of field name to value
+        """
+        self.update()
+        with self.lock:
+            if self.constant is None:
+                self.constant = self._constant_fields()
+                self.unused_joints = tuple(self._joint(index, 0, 0.0) for index in range(len(self.homed), MAX_JOINTS))
+            position, velocity, line = self.axis_position(self.now)
+            moving = bool(self.segments) and self.segments[-1].end_time > self.now
+            joints = len(self.homed)
+            homed = tuple(self.homed) + (0,) * (MAX_JOINTS - joints)
+            joint_position = tuple(position[axis] for axis in self.joint_axes) + (0.0,) * (MAX_JOINTS - joints)
+            remaining = self.segments[-1].end if self.segments else position
+            # Slots in the interpreter's order: line, motion, non modal, plane, cutter compensation, units,
+            # distance mode, feed rate mode, coordinate system, tool length offset, canned cycle return,
+            # path control, unused, spindle speed mode, arc distance mode, lathe diameter mode, G92.3
+            gcodes = (line, self.motion_code, -1, 170, 400, 210 if self.constant["program_units"] == 2 else 200,
+                      910 if self.incremental else 900, 940,
+                      530 + 10 * self.g5x_index if self.g5x_index <= 6 else 584 + self.g5x_index,
+                      430 if any(self.tool_offset) else 490, 990, 640, -1, 970, 911, 80, -1)
+            snapshot = dict(self.constant)
+            snapshot.update({
+                "task_state": self.task_state,
+                "task_mode": self.task_mode,
+                "estop": int(self.task_state == STATE_ESTOP),
+                "enabled": self.task_state == STATE_ON,
+                "lube": int(self.task_state == STATE_ON),
+                "interp_state": self.interp_state,
+                "exec_state": EXEC_WAITING_FOR_MOTION if moving else EXEC_DONE,
+                "state": self.rcs_state,
+                "echo_serial_number": self.echo_serial_number,
+                "motion_mode": self.motion_mode,
+                "motion_type": (1 if self.motion_code == 0 else 2) if moving else 0,
+                "homed": homed,
+                "position": position,
+                "actual_position": position,
+                "joint_position": joint_position,
+                "joint_actual_position": joint_position,
+                "joint": tuple(self._joint(index, homed[index], joint_position[index]) for index in range(joints))
+                + self.unused_joints,
+                "current_vel": velocity,
+                "velocity": velocity,
+                "distance_to_go": math.dist(position, remaining),
+                "dtg": tuple(b - a for a, b in zip(position, remaining)),
+                "inpos": not moving,
+                "queue": len(self.segments) - (1 if moving and self.segments[0].start_time <= self.now else 0),
+                "active_queue": min(len(self.segments), 1),
+                "file": self.file,
+                "id": line,
+                "line": line,
+                "motion_line": line,
+                "current_line": line,
+                "read_line": self.segments[-1].line if self.segments else line,
+                "g5x_index": self.g5x_index,
+                "g5x_offset": self.g5x_offset,
+                "g92_offset": self.g92_offset,
+                "tool_in_spindle": self.tool_in_spindle,
+                "tool_offset": self.tool_offset,
+                "tool_table": self.tool_table,
+                "gcodes": gcodes,
+                "mcodes": (line, -1, 5, -1, 9, -1, 48, -1, -1, -1),
+                "settings": (float(line), self.feed * 60, 0.0),
+                "din": tuple(self.din),
+                "dout": tuple(self.dout),
+                "ain": tuple(self.ain),
+                "aout": tuple(self.aout),
+            })
+            return snapshot
+
+
+class SimStat:
+    """
+    linuxcnc.stat of a SimController, poll() copies the current status into attributes
+    There is no status before the first poll(), a test that forgets it fails here as it would on LinuxCNC
+    """
+
+    def __init__(self, controller: SimController):
+        """
+        :param controller: Simulated machine
+        """
+        self._controller = controller
+        self._fields: List[str] = []
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        raise AttributeError(f"stat.{name} is not set before the first poll()")
+
+    def poll(self) -> None:
+        """Copy the status, with a VirtualClock each poll also takes POLL_TIME"""
+        if isinstance(self._controller.clock, VirtualClock):
+            self._controller.clock.advance(POLL_TIME)
+        snapshot = self._controller.snapshot()
+        self._fields = list(snapshot)
+        self.__dict__.update(snapshot)
+
+    def __dir__(self) -> List[str]:
+        return self._fields + ["poll"]
+
+
+class SimCommand:
+    """linuxcnc.command of a SimController, every method returns at once like NML"""
+
+    def __init__(self, controller: SimController):
+        """
+        :param controller: Simulated machine
+        """
+        self._controller = controller
+        self.serial = 0
+
+    def _send(self, action: Callable[[int], None]) -> None:
+        self.serial = self._controller.send(action)
+
+    def state(self, state: int) -> None:
+        """Estop, estop reset, machine on or off"""
+        self._send(lambda serial: self._controller.set_state(state))
+
+    def mode(self, mode: int) -> None:
+        """Manual, auto or MDI mode"""
+        self._send(lambda serial: self._controller.set_mode(mode))
+
+    def home(self, joint: int) -> None:
+        """Home a joint, -1 for all"""
+        self._send(lambda serial: self._controller.home(joint))
+
+    def mdi(self, text: str) -> None:
+        """Run one MDI block"""
+        self._send(lambda serial: self._controller.mdi(text, serial))
+
+    def program_open(self, path: str) -> None:
+        """Open a G code program"""
+        self._send(lambda serial: self._controller.program_open(path))
+
+    def auto(self, action: int, line: int = 0) -> None:
+        """Run the open program from a line"""
+        self._send(lambda serial: self._controller.auto(action, line))
+
+    def abort(self) -> None:
+        """Stop motion and the interpreter"""
+        self._send(lambda serial: self._controller.abort())
+
+    def load_tool_table(self) -> None:
+        """Reread the tool table file"""
+        self._send(lambda serial: self._controller.load_tool_table())
+
+    def wait_complete(self, timeout: float = 5.0) -> int:
+        """
+        :param timeout: Seconds to wait for the last command
+        :return: RCS_DONE or RCS_ERROR, -1 on timeout
+        """
+        return self._controller.wait_complete(self.serial, timeout)
+
+
+class SimErrorChannel:
+    """linuxcnc.error_channel of a SimController"""
+
+    def __init__(self, controller: SimController):
+        """
+        :param controller: Simulated machine
+        """
+        self._controller = controller
+
+    def poll(self) -> Optional[Tuple[int, str]]:
+        """
+        :return: Oldest unread (kind, text), None if there is none
+        """
+        self._controller.update()
+        with self._controller.lock:
+            return self._controller.errors.pop(0) if self._controller.errors else None
+
+
+class SimIni:
+    """linuxcnc.ini backed by lcnc_ini"""
+
+    def __init__(self, path: str):
+        """
+        :param path: ini file
+        """
+        self.config = load_ini(path)
+
+    def find(self, section: str, key: str) -> Optional[str]:
+        """First value of a key, None if missing"""
+        return self.config.find(section, key)
+
+    def findall(self, section: str, key: str) -> List[str]:
+        """Every value of a key"""
+        return list(self.config.sections.get(section, {}).get(key, []))
+
+
+def sim_module(controller: SimController) -> types.ModuleType:
+    """
+    :param controller: Simulated machine every stat, command and error_channel talks to
+    :return: Module with the linuxcnc names used here, SIMULATED and controller set
+    """
+    module = types.ModuleType("linuxcnc", "Simulated linuxcnc module, see lcnc_sim.py")
+    module.__dict__.update(CONSTANTS)
+    module.stat = lambda: SimStat(controller)
+    module.command = lambda: SimCommand(controller)
+    module.error_channel = lambda: SimErrorChannel(controller)
+    module.ini = SimIni
+    module.SIMULATED = True
+    module.controller = controller
+    return module
+
+
+def install(ini_filename: str, clock=None) -> types.ModuleType:
+    """
+    Make import linuxcnc return a simulator, must run before the importing modules are loaded
+    :param ini_filename: Configuration to simulate
+    :param clock: Clock of the simulation, share it with lcnc_timing.set_clock for virtual time
+    :return: The installed module
+    """
+    module = sim_module(SimController(ini_filename, clock))
+    sys.modules["linuxcnc"] = module
+    return module
@@ -0,0 +1,202 @@
+"""
+  lcnc_status.py - Snapshot and diff helpers for linuxcnc.stat
+
+"""
+
+from collections.abc import Mapping
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+def stat_fields(stat) -> List[str]:
+    """
+    List the status attributes of a stat object
+    Skips dunder attributes and poll, the same way dict_compare does
+    :param stat: linuxcnc.stat object
+    :return: Attribute names
+    """
+    return [key for key in dir(stat) if "__" not in key and "poll" not in key]
+
+
+def take_snapshot(stat, fields: Optional[Iterable[str]] = None) -> Dict[str, object]:
+    """
+    Copy the current attributes of a polled stat object into a dict
+    :param stat: linuxcnc.stat object, already polled
+    :param fields: Attribute names to copy, all of them if None
+    :return: Dictionary of field name to value
+    """
+    if fields is None:
+        fields = stat_fields(stat)
+    return {key: getattr(stat, key) for key in fields}
+
+
+def diff_snapshots(old: Mapping, new: Mapping,
+                   fields: Optional[Iterable[str]] = None) -> Dict[str, Tuple[object, object]]:
+    """
+    Compare two snapshots field by field
+    :param old: Snapshot taken first
+    :param new: Snapshot taken after
+    :param fields: Fields to compare, every shared field if None
+    :return: Dictionary of field name to (old, new) for every changed field
+    """
+    keys = old.keys() & new.keys() if fields is None else fields
+    return {key: (old[key], new[key]) for key in keys if old[key] != new[key]}
+
+
+class LazySnapshot(Mapping):
+    """
+    Read only view of a polled stat object
+    Fields are decoded on first access and memoized, untouched fields cost nothing
+    """
+
+    def __init__(self, stat, is_stale: Optional[Callable[[], bool]] = None):
+        """
+        :param stat: linuxcnc.stat object, already polled and not polled again while in use
+        :param is_stale: Returns True once stat has been polled again, see SnapshotPoller
+        """
+        self._stat = stat
+        self._is_stale = is_stale
+        self._values: Dict[str, object] = {}
+        self._fields: Optional[List[str]] = None
+
+    def __getitem__(self, key: str):
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        if "__" in key or "poll" in key:
+            raise KeyError(key)
+        if self._is_stale is not None and self._is_stale():
+            raise RuntimeError(f"Snapshot was overwritten by a later poll before {key} was read")
+        try:
+            value = self._values[key] = getattr(self._stat, key)
+        except AttributeError:
+            raise KeyError(key) from None
+        return value
+
+    def __contains__(self, key) -> bool:
+        return key in self._values or key in list(self)
+
+    def __iter__(self) -> Iterator[str]:
+        if self._fields is None:
+            self._fields = stat_fields(self._stat)
+        return iter(self._fields)
+
+    def __len__(self) -> int:
+        return len(list(iter(self)))
+
+    @property
+    def decoded(self) -> List[str]:
+        """Fields read so far"""
+        return list(self._values)
+
+
+class SnapshotPoller:
+    """
+    Polls into a small ring of stat objects and hands out LazySnapshots
+    A snapshot stays readable until its stat object comes round again
+    """
+
+    def __init__(self, stat_factory: Callable[[], object], buffers: int = 2):
+        """
+        :param stat_factory: Creates a stat object, normally linuxcnc.stat
+        :param buffers: Number of stat objects, and so of snapshots that can be alive at once
+        """
+        self._stats = [stat_factory() for _ in range(buffers)]
+        self._generations = [0] * buffers
+        self._index = -1
+
+    def poll(self) -> LazySnapshot:
+        """
+        Poll the next stat object in the ring
+        :return: LazySnapshot of the poll result
+        """
+        self._index = (self._index + 1) % len(self._stats)
+        index = self._index
+        stat = self._stats[index]
+        stat.poll()
+        self._generations[index] += 1
+        generation = self._generations[index]
+        return LazySnapshot(stat, lambda: self._generations[index] != generation)
+
+
+def parse_field(path: str) -> Tuple[str, Optional[int]]:
+    """
+    Split a field path like "ain[3]" into its attribute and index
+    :param path: Attribute name, optionally followed by [index]
+    :return: (attribute, index) where index is None for whole fields
+    """
+    if path.endswith("]") and "[" in path:
+        name, index = path[:-1].split("[", 1)
+        return name, int(index)
+    return path, None
+
+
+def _field_value(snapshot: Dict[str, object], name: str, index: Optional[int]):
+    value = snapshot.get(name)
+    if index is None or value is None:
+        return value
+    return value[index]
+
+
+class StatusSubscriptions:
+    """
+    Field level change callbacks for a polled stat object
+    Each dispatch reads only the subscribed fields and diffs them once
+    """
+
+    def __init__(self):
+        self._callbacks: Dict[str, List[Callable[[str, object, object], None]]] = {}
+        self._fields: Dict[str, Tuple[str, Optional[int]]] = {}
+        self._last: Dict[str, object] = {}
+
+    def subscribe(self, path: str, callback: Callable[[str, object, object], None]) -> None:
+        """
+        Register a callback for a field
+        :param path: Field to watch, e.g. "task_state" or "ain[3]"
+        :param callback: Called as callback(path, old, new), old is None on the first dispatch
+        """
+        self._fields[path] = parse_field(path)
+        self._callbacks.setdefault(path, []).append(callback)
+
+    def unsubscribe(self, path: str, callback: Callable[[str, object, object], None]) -> None:
+        """
+        Remove a callback registered with subscribe
+        :param path: Field the callback was registered for
+        :param callback: Callback to remove
+        """
+        callbacks = self._callbacks.get(path, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+        if not callbacks:
+            self._callbacks.pop(path, None)
+            self._fields.pop(path, None)
+
+    def reset(self) -> None:
+        """Forget the last values, so every subscriber fires on the next dispatch"""
+        self._last = {}
+
+    def dispatch(self, stat) -> Dict[str, Tuple[object, object]]:
+        """
+        Read the subscribed fields and call back for the ones that changed
+        :param stat: linuxcnc.stat object, already polled
+        :return: Dictionary of path to (old, new) for every callback that fired
+        """
+        names = {name for name, _ in self._fields.values()}
+        snapshot = take_snapshot(stat, names)
+        modified = {name for name in names if name not in self._last}
+        modified.update(diff_snapshots(self._last, snapshot))
+
+        fired = {}
+        for path, (name, index) in list(self._fields.items()):
+            if name not in modified:
+                continue
+            old = _field_value(self._last, name, index)
+            new = _field_value(snapshot, name, index)
+            if name in self._last and old == new:
+                continue
+            fired[path] = (old, new)
+            for callback in list(self._callbacks.get(path, [])):
+                callback(path, old, new)
+
+        self._last = snapshot
+        return fired
@@ -0,0 +1,336 @@
+"""
+  lcnc_timing.py - Event driven waits and state propagation latency statistics
+
+  wait_for() polls until a condition holds and returns how long it took, so
+  tests can record real transition times instead of sleeping a fixed guess.
+  Waits go through a clock, the wall clock by default, or a VirtualClock
+  shared with the simulated controller so waits take no real time.
+
+"""
+
+import contextlib
+import heapq
+import itertools
+import math
+import statistics
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+# Seconds between polls in wait_for
+WAIT_INTERVAL = 0.001
+
+# Suggested timeout is the p99 latency times this margin
+TIMEOUT_MARGIN = 2.0
+
+
+class RealClock:
+    """Wall clock time"""
+
+    @staticmethod
+    def monotonic() -> float:
+        """Seconds from an arbitrary start"""
+        return time.perf_counter()
+
+    @staticmethod
+    def time() -> float:
+        """Seconds since the epoch"""
+        return time.time()
+
+    @staticmethod
+    def sleep(seconds: float) -> None:
+        """Block for seconds"""
+        time.sleep(seconds)
+
+
+class VirtualClock:
+    """
+    Clock that only moves when slept on or advanced, sleeping returns at once
+    Shared by the simulated controller and the wait helpers, so ordering holds without real waiting
+    Periodic callbacks run at their exact times, on the thread that advances the clock past them
+    """
+
+    def __init__(self, start: float = 0.0, epoch: float = 1.6e9):
+        """
+        :param start: Initial monotonic time
+        :param epoch: time() at monotonic time 0
+        """
+        self.now = start
+        self.epoch = epoch
+        self.lock = threading.RLock()
+        self.periodic: List[list] = []
+        self.order = itertools.count()
+        self.ticking = False
+
+    def monotonic(self) -> float:
+        """Current virtual time"""
+        return self.now
+
+    def time(self) -> float:
+        """Virtual seconds since the epoch"""
+        return self.epoch + self.now
+
+    # Lets the clock stand in for the time module of a test
+    perf_counter = monotonic
+
+    def sleep(self, seconds: float) -> None:
+        """Advance the clock instead of blocking"""
+        self.advance(seconds)
+
+    def advance(self, seconds: float) -> None:
+        """
+        Move forward, running periodic callbacks that fall due in time order
+        Ignored from inside a periodic callback, time stands still while it samples
+        :param seconds: Time to move forward, negative values are ignored
+        """
+        self.advance_to(self.now + max(0.0, seconds))
+
+    def advance_to(self, target: float) -> None:
+        """
+        Move forward to exactly target, so events scheduled at target are due
+        :param target: Monotonic time, ignored if already past
+        """
+        with self.lock:
+            if self.ticking:
+                return
+            while self.periodic and self.periodic[0][0] <= target:
+                entry = heapq.heappop(self.periodic)
+                due, _, start, interval, count, callback = entry
+                self.now = max(self.now, due)
+                self.ticking = True
+                try:
+                    callback()
+                finally:
+                    self.ticking = False
+                # Due times are multiples of the interval from the start, so they do not drift
+                entry[0] = start + (count + 1) * interval
+                entry[4] = count + 1
+                heapq.heappush(self.periodic, entry)
+            self.now = max(self.now, target)
+
+    def every(self, interval: float, callback: Callable[[], None]) -> list:
+        """
+        :param interval: Seconds between calls, the first is one interval from now
+        :param callback: Called with the clock at its due time
+        :return: Handle for cancel
+        """
+        with self.lock:
+            entry = [self.now + interval, next(self.order), self.now, interval, 1, callback]
+            heapq.heappush(self.periodic, entry)
+            return entry
+
+    def cancel(self, handle: list) -> None:
+        """Stop a callback registered with every"""
+        with self.lock:
+            if handle in self.periodic:
+                self.periodic.remove(handle)
+                heapq.heapify(self.periodic)
+
+
+# Clock used by wait_for when none is given, see set_clock
+CLOCK = RealClock()
+
+# Period of a PeriodicSampler asking for 0 (as fast as possible) under a VirtualClock, twice per servo period
+VIRTUAL_SAMPLE_INTERVAL = 0.0005
+
+
+def set_clock(clock) -> None:
+    """
+    Replace the default clock of the wait helpers, e.g. with the simulator's VirtualClock
+    :param clock: RealClock or VirtualClock
+    """
+    global CLOCK  # pylint: disable=global-statement
+    CLOCK = clock
+
+
+def now() -> float:
+    """Monotonic time of the default clock, virtual while the simulator runs on a VirtualClock"""
+    return CLOCK.monotonic()
+
+
+def timestamp() -> float:
+    """Seconds since the epoch on the default clock"""
+    return CLOCK.time()
+
+
+def sleep(seconds: float) -> None:
+    """Sleep on the default clock"""
+    CLOCK.sleep(seconds)
+
+
+class PeriodicSampler:
+    """
+    Calls a function every interval until stopped
+    On the wall clock from a background thread, under a VirtualClock as a periodic callback of the
+    clock, so samples land at exact virtual times in order with the commands of the test
+    """
+
+    def __init__(self, callback: Callable[[], None], interval: float = 0.0, clock=None):
+        """
+        :param callback: Takes one sample
+        :param interval: Seconds between samples, 0 for as fast as possible
+        :param clock: Clock to run on, CLOCK if None
+        """
+        self.callback = callback
+        self.interval = interval
+        self.clock = clock
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._handle = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.callback()
+            if self.interval:
+                self._stop.wait(self.interval)
+
+    def start(self) -> None:
+        """Take the first sample and keep sampling"""
+        clock = CLOCK if self.clock is None else self.clock
+        self._stop.clear()
+        if isinstance(clock, VirtualClock):
+            self.clock = clock
+            self.callback()
+            self._handle = clock.every(self.interval or VIRTUAL_SAMPLE_INTERVAL, self.callback)
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop sampling, waiting for the thread"""
+        self._stop.set()
+        if self._handle is not None:
+            self.clock.cancel(self._handle)
+            self._handle = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+# Categories of test time kept by Breakdown
+CATEGORIES = ("wait", "poll", "command")
+
+
+class Breakdown:
+    """Seconds spent per category by the current test, measured on the clock the waits sleep on"""
+
+    def __init__(self):
+        self.totals: Dict[str, float] = dict.fromkeys(CATEGORIES, 0.0)
+
+    def reset(self) -> None:
+        """Start a new test"""
+        self.totals = dict.fromkeys(CATEGORIES, 0.0)
+
+    def add(self, category: str, seconds: float) -> None:
+        """
+        :param category: One of CATEGORIES
+        :param seconds: Time to add
+        """
+        self.totals[category] += seconds
+
+    @contextlib.contextmanager
+    def time(self, category: str):
+        """
+        Time the body of a with statement
+        :param category: One of CATEGORIES
+        """
+        start = now()
+        try:
+            yield
+        finally:
+            self.add(category, now() - start)
+
+
+# Filled by the test helpers, stored per test by lcnc_results.py
+BREAKDOWN = Breakdown()
+
+
+def wait_for(stat, condition: Callable[[object], bool], timeout: float,
+             interval: float = WAIT_INTERVAL, clock=None) -> Optional[float]:
+    """
+    Poll until condition(stat) is true
+    :param stat: linuxcnc.stat object, polled before every check
+    :param condition: Called with the polled stat
+    :param timeout: Seconds to wait
+    :param interval: Seconds between polls
+    :param clock: Clock to measure and sleep with, CLOCK if None
+    :return: Seconds until the condition held, None on timeout
+    """
+    clock = CLOCK if clock is None else clock
+    start = clock.monotonic()
+    while True:
+        with BREAKDOWN.time("poll"):
+            stat.poll()
+        elapsed = clock.monotonic() - start
+        if condition(stat):
+            return elapsed
+        if elapsed > timeout:
+            return None
+        with BREAKDOWN.time("wait"):
+            clock.sleep(interval)
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """
+    Nearest rank percentile
+    :param samples: Values, in any order
+    :param fraction: 0.99 for p99
+    :return: Smallest sample with at least fraction of the samples at or below it
+    """
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class LatencyStats:
+    """Latency samples grouped by transition name"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.timeouts: Dict[str, int] = {}
+
+    def add(self, name: str, seconds: Optional[float]) -> None:
+        """
+        Record one transition
+        :param name: Transition name, e.g. "state 2"
+        :param seconds: Latency from wait_for, None counts as a timeout
+        """
+        if seconds is None:
+            self.timeouts[name] = self.timeouts.get(name, 0) + 1
+        else:
+            self.samples.setdefault(name, []).append(seconds)
+
+    def summary(self, name: str) -> Dict[str, float]:
+        """
+        :param name: Transition name
+        :return: count, timeouts, min, median, p99, max and suggested timeout, in seconds
+        """
+        samples = self.samples.get(name, [])
+        result = {"count": float(len(samples)), "timeouts": float(self.timeouts.get(name, 0))}
+        if samples:
+            p99 = percentile(samples, 0.99)
+            result.update({
+                "min": min(samples),
+                "median": statistics.median(samples),
+                "p99": p99,
+                "max": max(samples),
+                "suggested": math.ceil(p99 * TIMEOUT_MARGIN * 1000) / 1000,
+            })
+        return result
+
+    def report(self) -> str:
+        """
+        :return: One line per transition, times in milliseconds
+        """
+        lines = []
+        for name in sorted(self.samples.keys() | self.timeouts.keys()):
+            summary = self.summary(name)
+            line = f"{name}: n={summary['count']:.0f} timeouts={summary['timeouts']:.0f}"
+            if "min" in summary:
+                line += "".join(f" {key}={summary[key] * 1000:.1f}ms"
+                                for key in ["min", "median", "p99", "max", "suggested"])
+            lines.append(line)
+        return "\n".join(lines)
+
+
+# Shared by the status tests and reported at the end of the session by conftest.py
+LATENCIES = LatencyStats()
@@ -0,0 +1,179 @@
+"""
+  lcnc_tooltable.py - Tool table generator, streaming parser and validator
+
+  Lines look like "T1 P1 X0 Y0 Z0.5 D0.25 I0 J0 Q0 ;comment", one tool per line.
+
+"""
+
+import os
+import random
+import shutil
+import tempfile
+from typing import Iterator, List, NamedTuple, Optional
+
+OFFSET_WORDS = "XYZABCUVW"
+
+# Highest pocket number linuxcnc accepts, CANON_POCKETS_MAX - 1
+MAX_POCKET = 1000
+
+# Directory name prefix of the configuration copies made by write_temp_config
+TEMP_CONFIG_PREFIX = "lcnc_tools_"
+
+
+class ToolEntry(NamedTuple):
+    """One line of a tool table"""
+    tool: int
+    pocket: int
+    offsets: tuple = (0.0,) * len(OFFSET_WORDS)
+    diameter: float = 0.0
+    frontangle: float = 0.0
+    backangle: float = 0.0
+    orientation: int = 0
+    comment: str = ""
+
+
+def parse_line(line: str) -> Optional[ToolEntry]:
+    """
+    Parse one tool table line
+    :param line: Line from tool.tbl
+    :return: ToolEntry, or None for blank and comment only lines
+    :raises ValueError: On unknown words, bad numbers or a missing T/P word
+    """
+    text, _, comment = line.partition(";")
+    words = text.split()
+    if not words:
+        return None
+
+    tool = pocket = None
+    offsets = [0.0] * len(OFFSET_WORDS)
+    values = {"D": 0.0, "I": 0.0, "J": 0.0, "Q": 0}
+    for word in words:
+        letter, number = word[0].upper(), word[1:]
+        if letter == "T":
+            tool = int(number)
+        elif letter == "P":
+            pocket = int(number)
+        elif letter in OFFSET_WORDS:
+            offsets[OFFSET_WORDS.index(letter)] = float(number)
+        elif letter == "Q":
+            values["Q"] = int(number)
+        elif letter in values:
+            values[letter] = float(number)
+        else:
+            raise ValueError(f"Unknown word {word}")
+    if tool is None or pocket is None:
+        raise ValueError("Missing T or P word")
+
+    return ToolEntry(tool, pocket, tuple(offsets), values["D"], values["I"], values["J"], values["Q"],
+                     comment.strip())
+
+
+def iter_tool_table(path: str) -> Iterator[ToolEntry]:
+    """
+    Read a tool table one line at a time
+    :param path: tool.tbl path
+    :raises ValueError: On the first malformed line, with its line number
+    """
+    with open(path, encoding="utf8") as table:
+        for number, line in enumerate(table, 1):
+            try:
+                entry = parse_line(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{number}: {e}") from None
+            if entry is not None:
+                yield entry
+
+
+def validate_tool_table(path: str) -> List[str]:
+    """
+    Check a tool table without stopping at the first problem
+    :param path: tool.tbl path
+    :return: List of problems, empty if the table is valid
+    """
+    errors = []
+    tools = {}
+    pockets = {}
+    with open(path, encoding="utf8") as table:
+        for number, line in enumerate(table, 1):
+            try:
+                entry = parse_line(line)
+            except ValueError as e:
+                errors.append(f"line {number}: {e}")
+                continue
+            if entry is None:
+                continue
+            if entry.tool in tools:
+                errors.append(f"line {number}: tool {entry.tool} already defined on line {tools[entry.tool]}")
+            tools.setdefault(entry.tool, number)
+            if entry.pocket in pockets:
+                errors.append(f"line {number}: pocket {entry.pocket} already used on line {pockets[entry.pocket]}")
+            pockets.setdefault(entry.pocket, number)
+            if not 0 <= entry.pocket <= MAX_POCKET:
+                errors.append(f"line {number}: pocket {entry.pocket} out of range")
+            if not 0 <= entry.orientation <= 9:
+                errors.append(f"line {number}: orientation {entry.orientation} out of range")
+            if entry.diameter < 0:
+                errors.append(f"line {number}: negative diameter")
+    return errors
+
+
+def format_entry(entry: ToolEntry) -> str:
+    """
+    Format a ToolEntry as a tool table line
+    :param entry: Tool to write
+    :return: Line without the trailing newline
+    """
+    words = [f"T{entry.tool}", f"P{entry.pocket}"]
+    words += [f"{letter}{value:+.6f}" for letter, value in zip(OFFSET_WORDS, entry.offsets) if value]
+    words += [f"D{entry.diameter:+.6f}", f"I{entry.frontangle:+.6f}", f"J{entry.backangle:+.6f}",
+              f"Q{entry.orientation}"]
+    if entry.comment:
+        words.append(f";{entry.comment}")
+    return " ".join(words)
+
+
+def generate_tool_table(path: str, count: int, seed: Optional[int] = None) -> List[ToolEntry]:
+    """
+    Write a tool table of count random tools in pockets 1..count
+    :param path: File to write
+    :param count: Number of tools, at most MAX_POCKET
+    :param seed: Random seed, for repeatable tables
+    :return: The written entries
+    """
+    if count > MAX_POCKET:
+        raise ValueError(f"At most {MAX_POCKET} tools fit in a tool table")
+    rng = random.Random(seed)
+    entries = [
+        ToolEntry(tool, tool,
+                  (rng.uniform(-1, 1), 0.0, rng.uniform(0, 5)) + (0.0,) * (len(OFFSET_WORDS) - 3),
+                  diameter=rng.uniform(0.01, 1.0), comment=f"generated tool {tool}")
+        for tool in range(1, count + 1)
+    ]
+    with open(path, "w", encoding="utf8") as table:
+        for entry in entries:
+            table.write(format_entry(entry) + "\n")
+    return entries
+
+
+def write_temp_config(count: int, source: str = "configs", seed: Optional[int] = None,
+                      parent: Optional[str] = None) -> str:
+    """
+    Copy a configuration to a temporary directory with a generated tool table
+    :param count: Number of tools
+    :param source: Configuration directory to copy, it must use tool.tbl
+    :param seed: Random seed, for repeatable tables
+    :param parent: Directory to create the copy in, the system temporary directory if None, the caller removes it
+    :return: Path of the copied basic.ini, for "linuxcnc <ini>"
+    """
+    directory = tempfile.mkdtemp(prefix=TEMP_CONFIG_PREFIX, dir=parent)
+    shutil.copytree(source, directory, dirs_exist_ok=True)
+    generate_tool_table(os.path.join(directory, "tool.tbl"), count, seed)
+    return os.path.join(directory, "basic.ini")
+
+
+def is_temp_config(path: str) -> bool:
+    """
+    :param path: File of a configuration, e.g. its ini or tool table
+    :return: True for a copy made by write_temp_config, whose tool table tests may overwrite
+    """
+    return os.path.basename(os.path.dirname(os.path.abspath(path))).startswith(TEMP_CONFIG_PREFIX)
@@ -0,0 +1,128 @@
+"""
+  lcnc_trace.py - Structured per-step test trace
+
+  Commands and the status changes they cause are kept as events in a
+  bounded in-memory ring buffer, and written out as JSON Lines only when
+  a test fails or a dump is asked for.
+
+  A change's latency is the time from its command to the first poll that
+  showed it, as wait_for measured it and settled() noted, not the time
+  until the change was recorded, which includes any fixed waits.
+
+"""
+
+import json
+import os
+import time
+from collections import deque
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# Events kept per test, older ones are dropped
+TRACE_SIZE = 10000
+
+
+class TraceEvent(NamedTuple):
+    """
+    One status change, or one command when field is None
+    latency is seconds from the command to the first poll showing the change, None if not measured
+    """
+    time: float
+    test: Optional[str]
+    step: int
+    command: Optional[str]
+    field: Optional[str]
+    old: object
+    new: object
+    latency: Optional[float]
+
+
+class TraceBuffer:
+    """Ring buffer of TraceEvents for the test currently running"""
+
+    def __init__(self, size: int = TRACE_SIZE):
+        """
+        :param size: Maximum number of events kept
+        """
+        self.events = deque(maxlen=size)
+        self.test: Optional[str] = None
+        self.step = 0
+        self.current_command: Optional[str] = None
+        self._latency: Optional[float] = None
+
+    def begin(self, test: str) -> None:
+        """
+        Start tracing a new test, dropping the events of the last one
+        :param test: Test name or pytest node id
+        """
+        self.events.clear()
+        self.test = test
+        self.step = 0
+        self.current_command = None
+        self._latency = None
+
+    def command(self, command: str) -> None:
+        """
+        Start a new step, later changes are attributed to this command
+        :param command: Description of the command, e.g. "state 2"
+        """
+        self.step += 1
+        self.current_command = command
+        self._latency = None
+        self.events.append(TraceEvent(time.time(), self.test, self.step, command, None, None, None, None))
+
+    def settled(self, latency: Optional[float]) -> Optional[float]:
+        """
+        Note how long the current command took to show in status, changes recorded for it carry this latency
+        :param latency: Result of the wait_for started right after sending the command, None on timeout
+        :return: latency, so the call can wrap wait_for
+        """
+        self._latency = latency
+        return latency
+
+    def record(self, field: str, old, new, latency: Optional[float] = None) -> None:
+        """
+        Record a status change
+        :param field: Status field, e.g. "estop" or "ain[3]"
+        :param old: Value before
+        :param new: Value after
+        :param latency: Seconds from the command to the first poll showing the change, the settled() one if None
+        """
+        self.events.append(TraceEvent(time.time(), self.test, self.step, self.current_command,
+                                      field, old, new, self._latency if latency is None else latency))
+
+    def record_diff(self, modified: Dict[str, Tuple[object, object]]) -> None:
+        """
+        Record every change of a diff, all with the latency settled() noted for the command
+        :param modified: Dictionary of field to (old, new), as from dict_compare or diff_snapshots
+        """
+        for field in sorted(modified):
+            old, new = modified[field]
+            self.record(field, old, new)
+
+    def changes(self, field: Optional[str] = None) -> List[TraceEvent]:
+        """
+        :param field: Only return changes of this field, all changes if None
+        :return: Recorded status changes, without the command events
+        """
+        return [event for event in self.events
+                if event.field is not None and (field is None or event.field == field)]
+
+    def flush(self, path: str) -> int:
+        """
+        Append the buffered events to a JSON Lines file and clear the buffer
+        :param path: Output file, its directory is created if needed
+        :return: Number of events written
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        count = len(self.events)
+        with open(path, "a", encoding="utf8") as output:
+            for event in self.events:
+                output.write(json.dumps(event._asdict(), default=repr) + "\n")
+        self.events.clear()
+        return count
+
+
+# Shared by the test helpers and the pytest hooks in conftest.py
+TRACE = TraceBuffer()
@@ -0,0 +1,130 @@
+"""
+  lcnc_watchdog.py - Connection state machine for a restarting LinuxCNC
+
+  Polls through a watchdog that drops the stat and command channels after
+  repeated failures and recreates them with exponential backoff, instead of
+  polling a dead channel forever.
+
+  CONNECTED -> DEGRADED on a failed poll -> DISCONNECTED after FAILURE_LIMIT
+  failed polls in a row -> RECONNECTING when the backoff delay has passed ->
+  CONNECTED, or back to DISCONNECTED with a doubled delay.
+
+"""
+
+import time
+from typing import Callable, List, Optional, Tuple
+
+CONNECTED = "connected"
+DEGRADED = "degraded"
+DISCONNECTED = "disconnected"
+RECONNECTING = "reconnecting"
+
+# Failed polls in a row before the channels are dropped
+FAILURE_LIMIT = 3
+
+# Seconds before the first reconnect attempt, doubled after every failed attempt
+BACKOFF_START = 0.5
+BACKOFF_MAX = 16.0
+
+
+class ConnectionWatchdog:
+    """Owns the stat and command channels and recreates them when LinuxCNC comes back"""
+
+    def __init__(self, factory: Callable[[], Tuple[object, object]],
+                 on_change: Optional[Callable[[str, str], None]] = None,
+                 failure_limit: int = FAILURE_LIMIT, backoff_start: float = BACKOFF_START,
+                 backoff_max: float = BACKOFF_MAX, clock: Callable[[], float] = time.monotonic):
+        """
+        :param factory: Returns new (stat, command) objects, raises if LinuxCNC is not running
+        :param on_change: Called with (old state, new state) on every transition
+        :param failure_limit: Failed polls in a row before disconnecting
+        :param backoff_start: Seconds before the first reconnect attempt
+        :param backoff_max: Longest delay between reconnect attempts
+        :param clock: Time source in seconds
+        """
+        self.factory = factory
+        self.on_change = on_change
+        self.failure_limit = failure_limit
+        self.backoff_start = backoff_start
+        self.backoff_max = backoff_max
+        self.clock = clock
+
+        self.state = DISCONNECTED
+        self.status = None
+        self.command = None
+        self.failures = 0
+        self.attempts = 0
+        self.next_attempt = clock()
+        self.last_error: Optional[BaseException] = None
+        self.lost_at: Optional[float] = None
+        # Seconds from the first failed poll to the next good one, per outage
+        self.recoveries: List[float] = []
+        self.last_recovery: Optional[float] = None
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            old, self.state = self.state, state
+            if self.on_change is not None:
+                self.on_change(old, state)
+
+    def delay(self) -> float:
+        """
+        :return: Seconds between the current and the next reconnect attempt
+        """
+        return min(self.backoff_max, self.backoff_start * 2 ** self.attempts)
+
+    def tick(self) -> bool:
+        """
+        Poll, or try to reconnect once the backoff delay has passed
+        :return: True if status was polled successfully this tick
+        """
+        now = self.clock()
+        if self.state == DISCONNECTED:
+            if now < self.next_attempt:
+                return False
+            return self._reconnect(now)
+        try:
+            self.status.poll()
+        except Exception as error:  # pylint: disable=broad-except
+            self._poll_failed(now, error)
+            return False
+        self._recovered(now)
+        return True
+
+    def _reconnect(self, now: float) -> bool:
+        self._set_state(RECONNECTING)
+        try:
+            self.status, self.command = self.factory()
+            self.status.poll()
+        except Exception as error:  # pylint: disable=broad-except
+            self.last_error = error
+            self.status = self.command = None
+            self.attempts += 1
+            self.next_attempt = now + self.delay()
+            self._set_state(DISCONNECTED)
+            return False
+        self._recovered(now)
+        return True
+
+    def _poll_failed(self, now: float, error: BaseException) -> None:
+        self.last_error = error
+        if self.failures == 0:
+            self.lost_at = now
+        self.failures += 1
+        if self.failures < self.failure_limit:
+            self._set_state(DEGRADED)
+            return
+        self.status = self.command = None
+        self.attempts = 0
+        self.next_attempt = now + self.delay()
+        self._set_state(DISCONNECTED)
+
+    def _recovered(self, now: float) -> None:
+        self.last_recovery = None if self.lost_at is None else now - self.lost_at
+        if self.last_recovery is not None:
+            self.recoveries.append(self.last_recovery)
+        self.lost_at = None
+        self.failures = 0
+        self.attempts = 0
+        self.last_error = None
+        self._set_state(CONNECTED)
@@ -0,0 +1,62 @@
+#! /usr/bin/python3
+"""
+ test_arrays.py Testing the NumPy status views
+    Runs without Linuxcnc, using plain objects in place of a polled stat
+
+"""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from lcnc_arrays import StatArrays, assert_allclose, assert_masked_equal
+
+
+def make_stat():
+    """
+    Build an object with the array fields of a polled stat
+    :return: Stat like namespace
+    """
+    return SimpleNamespace(
+        ain=(0.0,) * 64,
+        aout=(0.0,) * 64,
+        din=(0,) * 63 + (1,),
+        dout=(0,) * 64,
+        actual_position=(1.0, 2.0, -3.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0),
+        joint_actual_position=(1.0,) + (0.0,) * 15,
+        tool_table=[(i, 0.0, 0.0, i / 10, 0, 0, 0, 0, 0, 0, 0.25, 0, 0, 0) for i in range(100)],
+    )
+
+
+def test_stat_arrays():
+    """
+    Every array field converts with its dtype and is read only
+    """
+    arrays = StatArrays(make_stat())
+    assert arrays.ain.shape == (64,)
+    assert arrays.din.dtype == np.int8
+    assert arrays.tool_table["id"][-1] == 99
+    assert_allclose(arrays.tool_table["zoffset"], np.arange(100) / 10)
+    with pytest.raises(ValueError):
+        arrays.ain[0] = 1
+
+
+def test_assert_allclose():
+    """
+    Tolerance, broadcasting and masks
+    """
+    arrays = StatArrays(make_stat(), ["actual_position"])
+    assert_allclose(arrays.actual_position[:3], [1.0, 2.0, -3.00005])
+    with pytest.raises(AssertionError, match="1 of 3 values differ"):
+        assert_allclose(arrays.actual_position[:3], [1.0, 2.0, 3.0])
+    assert_allclose(arrays.actual_position, 0, mask=np.arange(9) >= 3)
+
+
+def test_assert_masked_equal():
+    """
+    Exact comparison over all 64 pins in one call
+    """
+    arrays = StatArrays(make_stat(), ["din"])
+    with pytest.raises(AssertionError, match=r"\[63\] 1 != 0"):
+        assert_masked_equal(arrays.din, 0)
+    assert_masked_equal(arrays.din, 0, mask=np.arange(64) < 63)
@@ -0,0 +1,89 @@
+#! /usr/bin/python3
+"""
+ test_async.py Testing the asyncio wrappers
+    Runs without Linuxcnc, against the simulator on a VirtualClock installed as linuxcnc
+
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+import lcnc_timing
+from lcnc_async import AsyncCommand
+from lcnc_checkpoint import setup
+from lcnc_sim import INTERP_IDLE, MODE_MDI, RCS_DONE, STATE_ESTOP, STATE_ESTOP_RESET, SimController, sim_module
+from lcnc_timing import VirtualClock, wait_for
+
+BASIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs", "basic.ini")
+
+
+@pytest.fixture
+def sim(monkeypatch):
+    """Simulator on a VirtualClock that is also the default clock, installed as linuxcnc"""
+    clock = VirtualClock()
+    module = sim_module(SimController(BASIC_INI, clock))
+    monkeypatch.setattr(lcnc_timing, "CLOCK", clock)
+    monkeypatch.setitem(sys.modules, "linuxcnc", module)
+    return module
+
+
+@pytest.fixture
+def mdi(sim):
+    """Homed machine on in MDI mode, returns the simulator module"""
+    com, stat = sim.command(), sim.stat()
+    setup(com, stat)
+    com.mode(MODE_MDI)
+    com.wait_complete()
+    return sim
+
+
+def test_mdi_async(mdi):
+    """
+    An MDI move returns once the interpreter is idle again, at the target
+    """
+    async def move():
+        a_com = AsyncCommand()
+        return await a_com.mdi_async("G0 X2", timeout=5.0)
+
+    snap = asyncio.run(move())
+    assert snap["interp_state"] == INTERP_IDLE
+    assert snap["actual_position"][0] == pytest.approx(2.0)
+
+
+def test_interp_idle_timeout(mdi):
+    """
+    Waiting for idle during a long move raises asyncio.TimeoutError, the move goes on
+    """
+    com, stat = mdi.command(), mdi.stat()
+    com.mdi("G0 X400")
+    assert wait_for(stat, lambda s: s.interp_state != INTERP_IDLE, 1.0) is not None
+
+    async def wait_idle():
+        await AsyncCommand(com).interp_idle(timeout=0.05)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(wait_idle())
+    stat.poll()
+    assert stat.interp_state != INTERP_IDLE
+
+
+def test_stream_changes(sim):
+    """
+    A stream yields a snapshot per interval, showing a state command taking effect
+    """
+    com = sim.command()
+
+    async def watch():
+        a_com = AsyncCommand(com)
+        states = []
+        async for snap in a_com.stat.stream(interval=0, fields=["task_state"]):
+            states.append(snap["task_state"])
+            if len(states) == 1:
+                assert await a_com.state_async(STATE_ESTOP_RESET) == RCS_DONE
+            elif snap["task_state"] == STATE_ESTOP_RESET:
+                break
+        return states
+
+    assert asyncio.run(asyncio.wait_for(watch(), 5.0)) == [STATE_ESTOP, STATE_ESTOP_RESET]
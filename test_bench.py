@@ -0,0 +1,84 @@
+#! /usr/bin/python3
+"""
+ test_bench.py Testing the program throughput report and the benchmark programs
+    Runs without Linuxcnc, on synthetic samples or the simulator of a three axis machine on a VirtualClock
+
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import lcnc_timing
+from lcnc_bench import PROGRAM_AXES, PROGRAMS, REPORT_UNITS, missing_axes, run_benchmark, starvation_intervals, \
+    throughput_report
+from lcnc_checkpoint import setup
+from lcnc_ini import load_ini, machine_axes
+from lcnc_sim import SimController, sim_module
+from lcnc_timing import VirtualClock
+
+XYZ_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs", "xyz.ini")
+
+# Samples 0.1 s apart: idle, two busy stretches with a gap, a one sample gap, then idle again
+TIMES = np.arange(10) * 0.1
+QUEUE = np.array([0, 2, 1, 0, 0, 3, 0, 1, 0, 0])
+
+
+@pytest.fixture
+def sim(monkeypatch):
+    """Three axis simulator on a VirtualClock that is also the default clock, installed as linuxcnc"""
+    clock = VirtualClock()
+    module = sim_module(SimController(XYZ_INI, clock))
+    monkeypatch.setattr(lcnc_timing, "CLOCK", clock)
+    monkeypatch.setitem(sys.modules, "linuxcnc", module)
+    return module
+
+
+def test_starvation_intervals():
+    """
+    Only the empty stretches between the first and last busy sample count, from their first empty sample
+    """
+    assert np.allclose(starvation_intervals(TIMES, QUEUE), [(0.3, 0.5), (0.6, 0.7)])
+    assert starvation_intervals(TIMES, np.zeros(10)) == []
+    assert starvation_intervals(TIMES, np.ones(10)) == []
+
+
+def test_throughput_report():
+    """
+    Rates and queue figures cover the busy samples, every value has a unit for the results database
+    """
+    columns = {"queue": QUEUE, "queue_full": np.array([0, 1, 0, 0, 0, 1, 0, 0, 0, 0]),
+               "active_queue": np.minimum(QUEUE, 1), "motion_line": np.arange(10),
+               "read_line": np.arange(10) + np.array([0, 3, 2, 0, 0, 4, 0, 1, 0, 0]),
+               "current_line": np.arange(10)}
+    sampler = SimpleNamespace(times=TIMES, column=columns.__getitem__)
+    report = throughput_report(sampler, 12)
+    assert set(report) == set(REPORT_UNITS)
+    assert report["run_time"] == pytest.approx(0.6)
+    assert report["segments_per_second"] == pytest.approx(20.0)
+    assert report["queue_mean"] == 1.75 and report["queue_max"] == 3
+    assert report["queue_full_fraction"] == pytest.approx(0.2) and report["active_queue_max"] == 1
+    assert report["read_ahead_mean"] == 2.5 and report["read_ahead_max"] == 4
+    assert report["starvations"] == 2 and report["starved_time"] == pytest.approx(0.3)
+
+    idle = {field: np.zeros(10) for field in columns}
+    report = throughput_report(SimpleNamespace(times=TIMES, column=idle.__getitem__), 12)
+    assert report["run_time"] == report["segments_per_second"] == report["queue_mean"] == 0
+
+
+@pytest.mark.parametrize("name, count", [("segments", 200), ("arcs", 100), ("canned cycles", 50)])
+def test_program_benchmark(sim, name, count):
+    """
+    Every benchmark program runs on a machine with the axes it needs, the simulator plans it all up front
+    """
+    com, stat = sim.command(), sim.stat()
+    setup(com, stat)
+    axes = machine_axes(load_ini(stat.ini_filename))
+    assert missing_axes(PROGRAM_AXES[name], axes) == ""
+    generate, per_item = PROGRAMS[name]
+    report = run_benchmark(com, stat, generate(count, axes), count * per_item)
+    assert report["segments_per_second"] > 0
+    assert report["queue_max"] > 0 and report["read_ahead_max"] > 0
+    assert report["starvations"] == 0
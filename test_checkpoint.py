@@ -0,0 +1,94 @@
+#! /usr/bin/python3
+"""
+ test_checkpoint.py Testing checkpoint comparison and the restore commands
+    Runs without Linuxcnc, using a namespace in place of linuxcnc.stat
+
+"""
+from types import SimpleNamespace
+
+import json
+
+from lcnc_checkpoint import INCH_UNITS, Checkpoint, load, needs_homing, restore_commands, save
+
+ZERO = (0.0,) * 9
+
+
+def checkpoint(**changes):
+    """Homed three axis machine at X1 Y2 Z-1 in G54 with tool 1"""
+    values = dict(ini_filename="/tmp/basic.ini", task_state=4, task_mode=3, homed=(1, 1, 1),
+                  position=(1.0, 2.0, -1.0) + ZERO[3:], g5x_index=1, g5x_offset=ZERO, g92_offset=ZERO,
+                  tool_in_spindle=1, tool_offset=(0.0, 0.0, 1.5) + ZERO[3:])
+    values.update(changes)
+    return Checkpoint(**values)
+
+
+def stat_from(state: Checkpoint, **changes):
+    """Stat like namespace in a checkpoint's state, on a mm machine running a mm program"""
+    values = dict(linear_units=1.0, program_units=2,
+                  joints=len(state.homed), homed=state.homed + (0,) * 13, actual_position=state.position,
+                  g5x_index=state.g5x_index, g5x_offset=state.g5x_offset, g92_offset=state.g92_offset,
+                  tool_in_spindle=state.tool_in_spindle, tool_offset=state.tool_offset)
+    values.update(changes)
+    return SimpleNamespace(**values)
+
+
+def test_nothing_to_restore():
+    """
+    A machine already in the checkpoint state needs no commands and no homing
+    """
+    state = checkpoint()
+    assert restore_commands(state, stat_from(state), "XYZ") == []
+    assert not needs_homing(state, stat_from(state))
+
+
+def test_restore_commands():
+    """
+    Tool, offsets, coordinate system and position are restored in that order, in machine units
+    """
+    state = checkpoint(g92_offset=(0.5,) + ZERO[1:])
+    stat = stat_from(state, tool_in_spindle=0, tool_offset=ZERO, g5x_index=2,
+                     g5x_offset=(3.0,) + ZERO[1:], g92_offset=ZERO, actual_position=ZERO)
+    assert restore_commands(state, stat, "XYZ") == [
+        "G21",
+        "M61 Q1",
+        "G43",
+        "G10 L2 P1 X0.000000 Y0.000000 Z0.000000",
+        "G54",
+        "G92.1",
+        "G52 X0.500000 Y0.000000 Z0.000000",
+        "G53 G0 X1.000000 Y2.000000 Z-1.000000",
+    ]
+
+
+def test_restore_units():
+    """
+    An inch machine is restored in G20 and a mm program gets G21 back, a cm machine's values are given in mm
+    """
+    state = checkpoint()
+    stat = stat_from(state, linear_units=INCH_UNITS, actual_position=ZERO)
+    assert restore_commands(state, stat, "XYZ") == ["G20", "G53 G0 X1.000000 Y2.000000 Z-1.000000", "G21"]
+    assert restore_commands(state, stat_from(state, linear_units=INCH_UNITS, program_units=1, actual_position=ZERO),
+                            "X") == ["G20", "G53 G0 X1.000000"]
+    stat = stat_from(state, linear_units=0.1, program_units=3, actual_position=ZERO)
+    assert restore_commands(state, stat, "X") == ["G21", "G53 G0 X10.000000"]
+
+
+def test_needs_homing():
+    """
+    Homing is needed only when a joint homed in the checkpoint lost its flag
+    """
+    state = checkpoint()
+    assert needs_homing(state, stat_from(state, homed=(1, 0, 1) + (0,) * 13))
+    assert not needs_homing(checkpoint(homed=(1, 0, 1)), stat_from(state))
+
+
+def test_save_load(tmp_path):
+    """
+    Checkpoints survive a round trip through JSON, fields of older checkpoints are ignored
+    """
+    state = checkpoint()
+    path = tmp_path / "checkpoint.json"
+    save(state, str(path))
+    assert load(str(path)) == state
+    path.write_text(json.dumps(dict(state._asdict(), position_file="0.0\n")))
+    assert load(str(path)) == state
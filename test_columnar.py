@@ -0,0 +1,132 @@
+#! /usr/bin/python3
+"""
+ test_columnar.py Testing the columnar status recording format
+    Runs without Linuxcnc
+
+"""
+import numpy as np
+import pytest
+
+from lcnc_columnar import ColumnarReader, ColumnarRecorder, ColumnarWriter, column_type, main
+
+
+def snapshot(row):
+    """Status like sample, current_vel ramps, gcodes change every 100 rows"""
+    return {"current_vel": row / 10,
+            "estop": row % 2,
+            "gcodes": (row // 100, 10, 170),
+            "file": f"/tmp/{row // 500}.ngc"}
+
+
+@pytest.fixture
+def recording(tmp_path):
+    """1000 samples, 0.01 s apart, in chunks of 128"""
+    path = str(tmp_path / "run.lcol")
+    with ColumnarWriter(path, chunk_rows=128) as writer:
+        for row in range(1000):
+            writer.append(100.0 + row / 100, snapshot(row))
+    return path
+
+
+def test_column_type():
+    """
+    Numeric fields get a dtype and shape, others are stored as JSON
+    """
+    assert column_type(1.5) == {"dtype": "float64", "shape": []}
+    assert column_type((1, 2, 3)) == {"dtype": "int64", "shape": [3]}
+    assert column_type("text")["dtype"] == "json"
+
+
+def test_query(recording):
+    """
+    Time ranges read only the chunks they overlap
+    """
+    with ColumnarReader(recording) as reader:
+        assert reader.rows == 1000
+        assert len(reader.chunks) == 8
+        result = reader.query(["gcodes", "current_vel"], start=102.0, end=103.0)
+        assert set(result) == {"time", "gcodes", "current_vel"}
+        assert len(result["time"]) == 101
+        assert result["gcodes"].shape == (101, 3)
+        np.testing.assert_allclose(result["current_vel"], np.arange(200, 301) / 10)
+        assert result["gcodes"][0].tolist() == [2, 10, 170]
+
+        blocks = []
+        read_block = reader._read_block  # pylint: disable=protected-access
+        reader._read_block = lambda location: blocks.append(location) or read_block(location)
+        list(reader.iter_chunks(["current_vel"], start=102.0, end=103.0))
+        # Chunk 1 and 2 overlap the range, one time block and one column block each
+        assert len(blocks) == 4
+
+        files = reader.query(["file"])["file"]
+        assert files[0] == "/tmp/0.ngc" and files[-1] == "/tmp/1.ngc"
+        assert len(reader.query(["estop"], start=200.0)["estop"]) == 0
+        with pytest.raises(KeyError):
+            reader.query(["missing"])
+
+
+def test_cli(recording, tmp_path, capsys):
+    """
+    fields lists the columns, slice prints CSV, export writes CSV and npz
+    """
+    assert main(["fields", recording]) == 0
+    assert "gcodes: int64[3]" in capsys.readouterr().out
+    main(["slice", recording, "--fields", "gcodes,current_vel", "--start", "0", "--end", "0.015"])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == "time,gcodes[0],gcodes[1],gcodes[2],current_vel"
+    assert len(lines) == 3
+    main(["export", recording, str(tmp_path / "out.npz"), "--fields", "current_vel,gcodes,file", "--start", "1"])
+    arrays = np.load(tmp_path / "out.npz")
+    assert arrays["current_vel"].shape == (900,) and arrays["gcodes"].shape == (900, 3)
+    np.testing.assert_allclose(arrays["time"], 101.0 + np.arange(900) / 100)
+    assert arrays["gcodes"][-1].tolist() == [9, 10, 170]
+    assert arrays["file"][0] == '"/tmp/0.ngc"' and arrays["file"][-1] == '"/tmp/1.ngc"'
+    main(["export", recording, str(tmp_path / "out.csv"), "--start", "9"])
+    assert len((tmp_path / "out.csv").read_text().splitlines()) == 101
+
+
+def test_unclosed(tmp_path):
+    """
+    A recording that was never closed is indexed from its chunk headers, a chunk cut off midway is left out
+    """
+    path = tmp_path / "run.lcol"
+    writer = ColumnarWriter(str(path), chunk_rows=128)
+    for row in range(300):
+        writer.append(100.0 + row / 100, snapshot(row))
+    writer.file.close()
+    data = path.read_bytes()
+    with ColumnarReader(str(path)) as reader:
+        assert not reader.complete
+        assert reader.rows == 256 and list(reader.columns) == list(snapshot(0))
+        np.testing.assert_allclose(reader.query(["current_vel"])["current_vel"], np.arange(256) / 10)
+    path.write_bytes(data[:-10])
+    with ColumnarReader(str(path)) as reader:
+        assert reader.rows == 128
+        assert reader.query(["gcodes"])["gcodes"][-1].tolist() == [1, 10, 170]
+
+
+class FakeStat:
+    """Stat like object whose estop counts polls"""
+
+    def __init__(self):
+        self.estop = 0
+
+    def poll(self):
+        """Next sample"""
+        self.estop += 1
+
+    def __dir__(self):
+        return ["estop", "poll"]
+
+
+def test_recorder(tmp_path):
+    """
+    The background recorder closes a readable file
+    """
+    path = str(tmp_path / "run.lcol")
+    with ColumnarRecorder(path, stat=FakeStat(), interval=0.001, chunk_rows=16):
+        pass
+    with ColumnarReader(path) as reader:
+        assert reader.complete
+        estop = reader.query(["estop"])["estop"]
+        assert estop.tolist() == list(range(1, len(estop) + 1))
@@ -0,0 +1,99 @@
+#! /usr/bin/python3
+"""
+ test_errors.py Testing the error channel drain
+    Runs without Linuxcnc, against the simulator on a VirtualClock or a list standing in for the channel
+
+"""
+import os
+
+import pytest
+
+import lcnc_timing
+from lcnc_errors import ERROR_INTERVAL, OPERATOR_ERROR, OPERATOR_TEXT, ErrorDrain, ErrorEvent, format_error, track
+from lcnc_events import ERROR_FIELD, EventIndexer
+from lcnc_sim import COMMAND_DELAY, SimController, sim_module
+from lcnc_timing import VirtualClock
+
+BASIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs", "basic.ini")
+
+
+class ListChannel:
+    """error_channel returning queued messages"""
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+
+    def poll(self):
+        return self.messages.pop(0) if self.messages else None
+
+
+@pytest.fixture
+def sim(monkeypatch):
+    """Simulator module on a VirtualClock that is also the default clock"""
+    clock = VirtualClock()
+    monkeypatch.setattr(lcnc_timing, "CLOCK", clock)
+    return sim_module(SimController(BASIC_INI, clock))
+
+
+def test_drain_latency(sim):
+    """
+    A rejected command's error is drained in the background and attributed to it, no polling in the test
+    """
+    drain = ErrorDrain(sim.error_channel())
+    drain.start()
+    com = track(sim.command(), drain)
+    com.mdi("G0 X1")
+    error = drain.wait_error(lambda event: event.is_error, timeout=1.0)
+    drain.stop()
+    assert error.kind == OPERATOR_ERROR and error.kind_name == "OPERATOR_ERROR"
+    assert error.command == "mdi G0 X1"
+    assert COMMAND_DELAY <= error.latency <= COMMAND_DELAY + ERROR_INTERVAL + 1e-9
+    assert drain.wait_error(timeout=0.5) is None
+    assert drain.received == 1 and drain.last == error
+
+
+def test_attribution_window(monkeypatch):
+    """
+    An error is credited to the newest command sent within the window before it, otherwise to none
+    """
+    clock = VirtualClock()
+    monkeypatch.setattr(lcnc_timing, "CLOCK", clock)
+    channel = ListChannel([])
+    drain = ErrorDrain(channel, attribution=0.5)
+    assert drain.drain() == []
+    drain.command_sent("mdi G0 X1")
+    clock.sleep(0.2)
+    drain.command_sent("mdi G0 X2")
+    clock.sleep(0.1)
+    channel.messages.append((OPERATOR_ERROR, "soon"))
+    event = drain.drain()[0]
+    assert event.command == "mdi G0 X2" and event.latency == pytest.approx(0.1)
+    clock.sleep(1.0)
+    channel.messages.append((OPERATOR_ERROR, "much later"))
+    event = drain.drain()[0]
+    assert event.command is None and event.latency is None
+    assert format_error(event) == "OPERATOR_ERROR: much later"
+
+
+def test_bounded_queue():
+    """
+    A full queue drops the oldest errors and counts them, the indexer still sees every one
+    """
+    indexer = EventIndexer()
+    drain = ErrorDrain(ListChannel([(OPERATOR_ERROR, f"error {number}") for number in range(5)]), size=3,
+                       indexer=indexer)
+    assert len(drain.drain()) == 5
+    assert drain.dropped == 2 and drain.received == 5
+    assert [event.text for event in drain.take()] == ["error 2", "error 3", "error 4"]
+    assert drain.take() == []
+    assert len(indexer.index.between(fields=[ERROR_FIELD])) == 5
+
+
+def test_format_error():
+    """
+    The status bar line names the kind, and the command and latency when known
+    """
+    event = ErrorEvent(0.0, 0.0, OPERATOR_TEXT, "hello", None, None)
+    assert format_error(event) == "OPERATOR_TEXT: hello" and not event.is_error
+    event = event._replace(kind=OPERATOR_ERROR, command="mdi G0 X1", latency=0.012)
+    assert format_error(event) == "OPERATOR_ERROR: hello (12 ms after mdi G0 X1)"
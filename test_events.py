@@ -0,0 +1,103 @@
+#! /usr/bin/python3
+"""
+ test_events.py Testing the status transition index
+    Runs without Linuxcnc
+
+"""
+from lcnc_columnar import ColumnarReader, ColumnarWriter
+from lcnc_events import MODAL_GROUPS, Event, EventIndex, EventIndexer, event_paths, index_recording, load_or_build, \
+    main
+
+
+def snapshot(row):
+    """estop toggles every 250 rows, the motion modal group every 100, line numbers every row"""
+    return {"estop": (row // 250) % 2,
+            "task_state": 4,
+            "current_vel": row / 10,
+            "gcodes": (row, 0 if row < 100 else 10, 170),
+            "mcodes": (row, 5)}
+
+
+def record(path, rows=1000, chunk_rows=64, start=0.0):
+    """Columnar recording of rows samples, one per second from start, returns the live indexer of the same samples"""
+    indexer = EventIndexer()
+    with ColumnarWriter(path, chunk_rows=chunk_rows) as writer:
+        for row in range(rows):
+            writer.append(start + row, snapshot(row))
+            indexer.observe(start + row, snapshot(row))
+    return indexer
+
+
+def test_index_lookup():
+    """
+    between, previous, next and value_at by bisection, out of order events stay sorted
+    """
+    index = EventIndex([Event(1.0, "estop", None, 1), Event(5.0, "estop", 1, 0), Event(3.0, "task_state", None, 4)])
+    index.add(Event(2.0, "task_mode", None, 1))
+    assert [event.time for event in index.events] == [1.0, 2.0, 3.0, 5.0]
+    assert index.fields == ["estop", "task_mode", "task_state"]
+    assert index.between(2.0, 4.0) == [Event(2.0, "task_mode", None, 1), Event(3.0, "task_state", None, 4)]
+    assert index.between(fields=["estop"])[1].new == 0
+    assert index.previous("estop", 4.9).time == 1.0
+    assert index.next("estop", 1.0).time == 5.0
+    assert index.next("estop", 5.0) is None
+    assert index.value_at("estop", 0.5) is None
+    assert index.value_at("estop", 5.0) == 0
+
+
+def test_live_and_recorded_match(tmp_path):
+    """
+    Indexing while recording and indexing the recording afterwards give the same events
+    """
+    path = str(tmp_path / "run.lcol")
+    indexer = record(path)
+    with ColumnarReader(path) as reader:
+        index = index_recording(reader)
+    assert index.events == indexer.index.events
+    assert index.fields == ["estop", "motion", "non_modal", "stopping", "task_state"]
+    assert [event.time for event in index.between(fields=["estop"])] == [0.0, 250.0, 500.0, 750.0]
+    assert index.between(fields=["motion"]) == [Event(0.0, "motion", None, 0), Event(100.0, "motion", 0, 10)]
+    assert index.between(1.0, fields=MODAL_GROUPS) == [Event(100.0, "motion", 0, 10)]
+    assert index.value_at("estop", 600.0) == 0
+
+
+def test_modal_groups():
+    """
+    Every gcodes and mcodes slot but the line number and the unused gcodes[12] is watched by its group's name
+    """
+    paths = event_paths({"estop": 0, "gcodes": (0,) * 17, "mcodes": (0,) * 10})
+    assert paths[0] == "estop" and paths[1:] == MODAL_GROUPS
+    assert len(MODAL_GROUPS) == 15 + 8
+    indexer = EventIndexer(paths=["coordinate_system", "coolant_flood", "gcodes[12]"])
+    indexer.observe(0.0, {"gcodes": (1, 0, -1, 170, 400, 200, 900, 940, 540, 490, 990, 640, -1, 970, 911, 80, -1),
+                          "mcodes": (1, -1, 5, -1, 9, 8, 48, -1, -1, -1)})
+    assert [(event.field, event.new) for event in indexer.index.events] == [
+        ("coordinate_system", 540), ("coolant_flood", 8), ("gcodes[12]", -1)]
+
+
+def test_errors():
+    """
+    Error channel messages are events of their own field
+    """
+    indexer = EventIndexer()
+    assert indexer.observe_error(1.0, None) is None
+    indexer.observe_error(2.0, (11, "joint 0 following error"))
+    assert indexer.index.between(fields=["error"])[0].new == [11, "joint 0 following error"]
+
+
+def test_saved_index(tmp_path, capsys):
+    """
+    The index is saved next to the recording and reused by the CLI
+    """
+    path = str(tmp_path / "run.lcol")
+    record(path, start=1000.0)
+    assert main(["build", path]) == 0
+    assert load_or_build(path).events == EventIndex.load(path + ".events").events
+    capsys.readouterr()
+    main(["list", path, "--field", "estop", "--start", "200", "--end", "600"])
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 2
+    assert lines[0].split()[:2] == ["250.000", "estop"] and "0 -> 1" in lines[0]
+    main(["list", path, "--modal", "--start", "1"])
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1 and lines[0].split()[:2] == ["100.000", "motion"]
@@ -0,0 +1,113 @@
+#! /usr/bin/python3
+"""
+ test_fuzz.py Testing the command sequence fuzzer against the simulator
+    Runs without Linuxcnc, every connect() builds a fresh simulated controller on a shared VirtualClock
+
+"""
+import os
+import random
+import time
+
+import pytest
+
+import lcnc_timing
+from lcnc_fuzz import STATES, MachineModel, Mismatch, Step, fuzz, generate, run_sequence, shrink
+from lcnc_ini import load_ini
+from lcnc_sim import STATE_ESTOP, STATE_ESTOP_RESET, STATE_OFF, STATE_ON, SimController, sim_module
+from lcnc_timing import VirtualClock
+
+BASIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs", "basic.ini")
+
+
+@pytest.fixture
+def connect(monkeypatch):
+    """Returns a fresh simulator module on each call, all on the default VirtualClock"""
+    clock = VirtualClock()
+    monkeypatch.setattr(lcnc_timing, "CLOCK", clock)
+    return lambda: sim_module(SimController(BASIC_INI, clock))
+
+
+class OffModel(MachineModel):
+    """Wrong model, expects STATE_OFF after turning the machine off"""
+
+    def state(self, state: int) -> None:
+        super().state(state)
+        if state == STATE_OFF and self.task_state == STATE_ESTOP_RESET:
+            self.task_state = STATE_OFF
+
+
+def test_generate_seeded():
+    """
+    The same seed gives the same sequence, with every command and MDI moves inside the range
+    """
+    config = load_ini(BASIC_INI)
+    steps = generate(random.Random(7), 500, config)
+    assert steps == generate(random.Random(7), 500, config)
+    assert {step.command for step in steps} == {"state", "mode", "home", "mdi", "abort"}
+    assert {step.argument for step in steps if step.command == "state"} == set(STATES)
+    for step in steps:
+        if step.command == "mdi":
+            assert abs(float(step.argument.split()[-1][1:])) <= 1.0
+    assert str(Step("state", "STATE_ON")) == "state(STATE_ON)" and str(Step("abort", None)) == "abort()"
+    assert str(Step("mdi", "G4 P0.01")) == "mdi('G4 P0.01')"
+
+
+def test_fuzz_matches_model(connect):
+    """
+    Thousands of random steps agree with the model, in far less real time than a minute
+    """
+    start = time.perf_counter()
+    result = fuzz(connect, count=3000, seed=1)
+    assert time.perf_counter() - start < 30.0
+    assert result.failure is None, f"{result.failure} after {[str(step) for step in result.sequence]}"
+    assert result.steps_run == 3000
+
+
+def test_fuzz_finds_and_shrinks(connect):
+    """
+    A wrong model is caught and the failing sequence shrinks to the two steps that show it
+    """
+    result = fuzz(connect, count=500, seed=3, model=OffModel)
+    assert result.failure is not None and result.failure.field == "task_state"
+    assert result.failure.expected == STATE_OFF and result.failure.actual == STATE_ESTOP_RESET
+    assert result.sequence[-1] == Step("state", "STATE_OFF")
+    assert len(result.sequence) == 2 and result.original_length == 500
+    assert run_sequence(connect, result.sequence, OffModel)[1] == result.failure
+
+
+def test_verified_only(connect):
+    """
+    Live runs skip STATE_ESTOP_RESET while the machine is on, the one transition the model was not checked on
+    """
+    steps = [Step("state", "STATE_ESTOP_RESET"), Step("state", "STATE_ON"), Step("state", "STATE_ESTOP_RESET"),
+             Step("state", "STATE_OFF")]
+    module = connect()
+    stat = module.stat()
+    stat.poll()
+    model = MachineModel.from_stat(module, stat)
+    assert model.argument(steps[1]) == STATE_ON and model.verified(steps[2])
+    model.task_state = STATE_ON
+    assert not model.verified(steps[2]) and model.verified(steps[3])
+    assert run_sequence(connect, steps, verified_only=True) == (4, None)
+    assert fuzz(connect, count=300, seed=1, verified_only=True).failure is None
+
+
+def test_shrink_chunks():
+    """
+    Shrinking keeps only the steps the failure needs, in order
+    """
+    needed = [Step("state", "STATE_ESTOP_RESET"), Step("state", "STATE_ON")]
+    filler = Step("abort", None)
+    steps = [filler] * 5 + needed[:1] + [filler] * 7 + needed[1:] + [filler]
+
+    def replay(candidate):
+        wanted = list(needed)
+        for index, step in enumerate(candidate):
+            if step == wanted[0]:
+                wanted.pop(0)
+                if not wanted:
+                    return Mismatch(index, step, "task_state", STATE_ESTOP, STATE_ON)
+        return None
+
+    sequence, mismatch = shrink(steps, replay)
+    assert sequence == needed and mismatch.index == 1
@@ -0,0 +1,71 @@
+#! /usr/bin/python3
+"""
+ test_hal.py Testing the HAL pin parser and status cross-validation
+    Runs without Linuxcnc, using captured halcmd output
+
+"""
+from types import SimpleNamespace
+
+from lcnc_hal import Mismatch, cross_validate, field_value, parse_show_pin
+
+SHOW_PIN = """\
+    10  bit   OUT          TRUE  iocontrol.0.user-enable-out
+    10  bit   OUT         FALSE  iocontrol.0.coolant-flood
+    10  bit   OUT         FALSE  iocontrol.0.coolant-mist
+    10  bit   OUT          TRUE  iocontrol.0.lube
+     4  float IN         0.0000  joint.0.pos-fb ==> J0pos
+     4  float OUT             0  motion.analog-out-00
+     4  float IN              1  motion.analog-in-00
+     4  float IN              0  motion.analog-in-01
+     4  bit   IN          FALSE  motion.digital-in-00
+     4  bit   OUT          TRUE  motion.motion-enabled
+     4  s32   OUT            -3  motion.program-line
+     4  u32   IN     0x0000000A  motion.feed-inhibit-count
+"""
+
+
+def make_stat(**changes):
+    """
+    Build a stat snapshot agreeing with SHOW_PIN
+    :param changes: Fields to override
+    :return: Stat like namespace
+    """
+    fields = dict(estop=0, enabled=True, flood=0, mist=0, lube=1, joint_actual_position=(0.0,) * 16,
+                  din=(0,) * 64, dout=(0,) * 64, ain=(1.0, 0.0) + (0.0,) * 62, aout=(0.0,) * 64,
+                  spindle=({"enabled": 0},))
+    fields.update(changes)
+    return SimpleNamespace(**fields)
+
+
+def test_parse_show_pin():
+    """
+    Values convert by pin type, signal arrows are ignored
+    """
+    pins = parse_show_pin(SHOW_PIN)
+    assert pins["iocontrol.0.user-enable-out"] is True
+    assert pins["joint.0.pos-fb"] == 0.0
+    assert pins["motion.program-line"] == -3
+    assert pins["motion.feed-inhibit-count"] == 10
+    assert len(pins) == 12
+
+
+def test_field_value():
+    """
+    Attribute, index and key paths
+    """
+    stat = make_stat()
+    assert field_value(stat, "ain[0]") == 1.0
+    assert field_value(stat, "spindle[0][enabled]") == 0
+    assert field_value({"estop": 1}, "estop") == 1
+
+
+def test_cross_validate():
+    """
+    Only pins present in the batch are checked, and disagreements are reported
+    """
+    pins = parse_show_pin(SHOW_PIN)
+    assert cross_validate(make_stat(), pins) == []
+    assert cross_validate(make_stat(estop=1, ain=(0.0,) * 64), pins) == [
+        Mismatch("estop", "iocontrol.0.user-enable-out", 1, 0),
+        Mismatch("ain[0]", "motion.analog-in-00", 0.0, 1.0),
+    ]
@@ -0,0 +1,75 @@
+#! /usr/bin/python3
+"""
+ test_ini.py Testing the ini model against configs/basic.ini
+    Runs without Linuxcnc, using a snapshot dict in place of linuxcnc.stat
+
+"""
+import os
+
+import pytest
+
+from lcnc_ini import check_status, expected_status, load_ini, machine_axes, parse_ini
+
+BASIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs", "basic.ini")
+
+
+def test_parse_ini():
+    """
+    Repeated keys keep every value, comment lines are skipped
+    """
+    sections = parse_ini("# comment\n[HAL]\nHALFILE = a.hal\n; other\nHALFILE=b.hal\n[TRAJ]\nAXES = 3\n")
+    assert sections == {"HAL": {"HALFILE": ["a.hal", "b.hal"]}, "TRAJ": {"AXES": ["3"]}}
+
+
+def test_load_basic():
+    """
+    Typed sections of the test configuration, parsed once
+    """
+    config = load_ini(BASIC_INI)
+    assert load_ini(BASIC_INI) is config
+    assert config.traj.coordinates == "X"
+    assert config.traj.linear_units == "inch"
+    assert config.kins.joints == 1
+    assert config.joints[0].max_limit == 500.0004
+    assert config.joints[0].home_sequence == 1
+    assert config.axes["X"].max_acceleration == 60.0
+    assert config.servo_period == 0.001
+    assert config.task.cycle_time == 0.001
+    assert config.tool_table.endswith(os.path.join("configs", "tool.tbl"))
+    assert config.hal_files[0].endswith("basic.hal")
+    assert config.hal_references["[EMCMOT]SERVO_PERIOD"] == "1000000"
+    assert config.find("EMCIO", "TOOL_TABLE") == "tool.tbl"
+    assert machine_axes(config) == "X"
+    assert machine_axes(config._replace(traj=config.traj._replace(coordinates="XYZZ"))) == "XYZ"
+
+
+def basic_snapshot():
+    """Snapshot dict of the stat values basic.ini should produce"""
+    return {
+        "linear_units": 1 / 25.4,
+        "angular_units": 1.0,
+        "axis_mask": 1,
+        "joints": 1,
+        "spindles": 1,
+        "cycle_time": 0.001,
+        "joint": ({"jointType": 1, "min_position_limit": -0.0004, "max_position_limit": 500.0004,
+                   "backlash": 0.0, "max_ferror": 0.05, "min_ferror": 0.01},),
+        "axis": ({"min_position_limit": 0.0, "max_position_limit": 500.0},),
+    }
+
+
+def test_expected_status():
+    """
+    Every reflection check runs against one snapshot, mismatches name the ini entry
+    """
+    expected = expected_status(load_ini(BASIC_INI))
+    assert len(expected) == 14
+    snapshot = basic_snapshot()
+    assert check_status(snapshot, expected) == []
+    snapshot["linear_units"] = 1.0
+    snapshot["joint"][0]["max_position_limit"] = 10.0
+    mismatches = check_status(snapshot, expected)
+    assert [(mismatch.field, mismatch.source) for mismatch in mismatches] == [
+        ("linear_units", "[TRAJ]LINEAR_UNITS"),
+        ("joint[0][max_position_limit]", "[JOINT_0]MAX_LIMIT")]
+    assert mismatches[0].ini_value == pytest.approx(0.03937, abs=1e-5)
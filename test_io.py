@@ -0,0 +1,69 @@
+#! /usr/bin/python3
+"""
+ test_io.py Testing the I/O sweep patterns and comparisons
+    Runs without Linuxcnc
+
+"""
+from types import SimpleNamespace
+
+import numpy as np
+
+import lcnc_io
+from lcnc_hal import setp_script
+from lcnc_io import DIN_PIN, IoPattern, io_sweep, pattern_errors, pattern_pins, random_patterns
+
+
+def test_random_patterns():
+    """
+    Fixed corner patterns first, then repeatable random ones
+    """
+    patterns = random_patterns(20, 4, 3, seed=5)
+    assert len(patterns) == 20
+    assert patterns[0].din.tolist() == [1, 1, 1, 1]
+    assert patterns[1].ain.tolist() == [0, 0, 0]
+    again = random_patterns(20, 4, 3, seed=5)
+    assert all((a.ain == b.ain).all() and (a.din == b.din).all() for a, b in zip(patterns, again))
+
+
+def test_pattern_script():
+    """
+    One setp line per pin, bits as 0/1
+    """
+    script = setp_script(pattern_pins(IoPattern(np.array([1, 0], dtype=np.int8), np.array([2.5]))))
+    assert script == ("setp motion.digital-in-00 1\n"
+                      "setp motion.digital-in-01 0\n"
+                      "setp motion.analog-in-00 2.5\n")
+
+
+def test_pattern_errors():
+    """
+    Only the first len(pattern) pins are compared, mismatches are returned by index
+    """
+    pattern = IoPattern(np.array([1, 0, 1], dtype=np.int8), np.array([1.5, -2.0]))
+    stat = SimpleNamespace(din=(1, 0, 1) + (0,) * 61, ain=(1.5, -2.0) + (0.0,) * 62)
+    din_errors, ain_errors = pattern_errors(stat, pattern)
+    assert len(din_errors) == 0 and len(ain_errors) == 0
+
+    stat = SimpleNamespace(din=(1, 1, 0) + (0,) * 61, ain=(1.5, -2.1) + (0.0,) * 62)
+    din_errors, ain_errors = pattern_errors(stat, pattern)
+    assert din_errors.tolist() == [1, 2]
+    assert ain_errors.tolist() == [1]
+
+
+def test_sweep_keeps_observed(monkeypatch):
+    """
+    Each result carries the inputs status showed for its pattern, not what a later write left
+    """
+    stat = SimpleNamespace(din=[0] * 64, ain=[0.0] * 64, poll=lambda: None)
+
+    def write_pins(values):
+        # Input 1 is stuck low
+        for index in range(3):
+            stat.din[index] = int(values[DIN_PIN.format(index=index)]) if index != 1 else 0
+
+    monkeypatch.setattr(lcnc_io, "write_pins", write_pins)
+    patterns = [IoPattern(np.array([1, 1, 0], dtype=np.int8), np.zeros(0)),
+                IoPattern(np.array([0, 0, 1], dtype=np.int8), np.zeros(0))]
+    first, second = io_sweep(stat, patterns, timeout=0.01)
+    assert first.latency is None and first.din_errors.tolist() == [1] and first.din.tolist() == [1, 0, 0]
+    assert second.latency is not None and second.din.tolist() == [0, 0, 1]
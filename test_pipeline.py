@@ -0,0 +1,104 @@
+#! /usr/bin/python3
+"""
+ test_pipeline.py Testing pipelined commands and their serial number tracking
+    Runs without Linuxcnc, against the simulator on a VirtualClock or a stat that never echoes
+
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+import lcnc_timing
+from lcnc_checkpoint import setup
+from lcnc_pipeline import RCS_DONE, RCS_ERROR, CommandPipeline
+from lcnc_sim import COMMAND_DELAY, MODE_MANUAL, MODE_MDI, STATE_ESTOP, STATE_ESTOP_RESET, SimController, sim_module
+from lcnc_timing import VirtualClock
+
+BASIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs", "basic.ini")
+
+
+class CountingCommand:
+    """linuxcnc.command numbering what it is sent, for a controller that never answers"""
+
+    def __init__(self):
+        self.serial = 0
+        self.sent = []
+
+    def state(self, state):
+        self.serial += 1
+        self.sent.append(state)
+
+
+@pytest.fixture
+def sim(monkeypatch):
+    """Simulator on a VirtualClock that is also the default clock, installed as linuxcnc"""
+    clock = VirtualClock()
+    module = sim_module(SimController(BASIC_INI, clock))
+    monkeypatch.setattr(lcnc_timing, "CLOCK", clock)
+    monkeypatch.setitem(sys.modules, "linuxcnc", module)
+    return module
+
+
+def test_state_batch(sim):
+    """
+    State commands complete one after the other at the controller's pace, each with its own round trip
+    """
+    com, stat = sim.command(), sim.stat()
+    pipe = CommandPipeline(com, stat)
+    start = sim.controller.clock.now
+    futures = pipe.batch([("state", STATE_ESTOP_RESET), ("state", STATE_ESTOP)] * 5)
+    assert not any(future.done() for future in futures)
+    results = pipe.wait_all()
+    assert [result.serial for result in results] == list(range(1, 11))
+    assert [future.result() for future in futures] == results
+    assert all(result.status == RCS_DONE and not result.superseded for result in results)
+    for result in results:
+        assert COMMAND_DELAY <= result.latency <= COMMAND_DELAY + 2 * pipe.interval
+    assert sim.controller.clock.now - start <= 10 * (COMMAND_DELAY + 2 * pipe.interval)
+    stat.poll()
+    assert stat.task_state == STATE_ESTOP
+
+
+def test_mdi_batch_and_rejection(sim):
+    """
+    Each MDI resolves with its own status once its move is done, an error in the middle of a batch included
+    A deeper pipeline lets a later echo pass a running MDI, which is then superseded without a status
+    """
+    com, stat = sim.command(), sim.stat()
+    setup(com, stat)
+    pipe = CommandPipeline(com, stat)
+    futures = pipe.batch([("mode", MODE_MDI), ("mdi", "G0 X1"), ("mdi", "G0 X600"), ("mdi", "G0 X3")])
+    results = pipe.wait_all()
+    assert [result.status for result in results] == [RCS_DONE, RCS_DONE, RCS_ERROR, RCS_DONE]
+    assert not any(result.superseded for result in results)
+    assert results[2].command == "mdi G0 X600" and futures[2].result() == results[2]
+    assert results[2].latency <= COMMAND_DELAY + 2 * pipe.interval < results[1].latency
+    stat.poll()
+    assert stat.actual_position[0] == pytest.approx(3.0)
+
+    deep = CommandPipeline(com, stat, depth=2)
+    first, second = deep.batch([("mdi", "G0 X1"), ("mdi", "G0 X2")])
+    deep.wait_all()
+    assert first.result().superseded and first.result().status is None and first.result().latency is None
+    assert second.result().status == RCS_DONE and second.result().latency > 0
+    deep.submit("mode", MODE_MANUAL)
+    assert deep.wait_all()[0].status == RCS_DONE
+
+
+def test_depth_and_timeout():
+    """
+    Nothing is sent past the depth until the controller echoes, unanswered commands time out
+    """
+    com = CountingCommand()
+    stat = SimpleNamespace(echo_serial_number=0, state=RCS_DONE, poll=lambda: None)
+    pipe = CommandPipeline(com, stat, depth=2, timeout=0.05)
+    futures = pipe.batch([("state", state) for state in (1, 2, 3)])
+    assert com.sent == [1, 2]
+    stat.echo_serial_number = 1
+    pipe.pump()
+    assert com.sent == [1, 2, 3] and futures[0].result().status == RCS_DONE
+    with pytest.raises(TimeoutError):
+        pipe.wait_all()
+    assert isinstance(futures[1].exception(), TimeoutError)
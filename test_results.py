@@ -0,0 +1,114 @@
+#! /usr/bin/python3
+"""
+ test_results.py Testing the results database and the time breakdown
+    Runs without Linuxcnc
+
+"""
+
+import sqlite3
+
+import pytest
+
+from lcnc_results import ResultsDb, main
+from lcnc_timing import Breakdown, sleep
+
+
+def make_db(path):
+    """
+    Database with two runs, test_b slowed down and the benchmark rate dropped
+    :param path: SQLite file
+    :return: ResultsDb, old run id, new run id
+    """
+    database = ResultsDb(str(path))
+    breakdown = {"wait": 0.5, "poll": 0.1, "command": 0.01}
+    old_run = database.start_run("old")
+    database.add_test(old_run, "test_a", "passed", 1.0, breakdown)
+    database.add_test(old_run, "test_b", "passed", 1.0, breakdown)
+    database.add_benchmark(old_run, "test_a", "rate", 100.0, "1/s")
+    database.finish_run(old_run)
+    new_run = database.start_run("new")
+    database.add_test(new_run, "test_a", "passed", 1.1, breakdown)
+    database.add_test(new_run, "test_b", "failed", 2.0, breakdown)
+    database.add_benchmark(new_run, "test_a", "rate", 50.0, "1/s")
+    database.finish_run(new_run)
+    return database, old_run, new_run
+
+
+def test_compare(tmp_path):
+    """
+    Only changes over the threshold are reported, durations and benchmarks apart
+    """
+    database, old_run, new_run = make_db(tmp_path / "results.sqlite")
+    assert database.compare(old_run, new_run) == [("duration", "test_b", 1.0, 2.0, 1.0, True),
+                                                  ("benchmark", "test_a rate", 100.0, 50.0, -0.5, True)]
+    assert [change.regression for change in database.compare(old_run, new_run, threshold=0.05)] == [True] * 3
+    assert [run[-1] for run in database.runs()] == [2, 2]
+    database.close()
+
+
+def test_benchmark_direction(tmp_path):
+    """
+    Benchmarks regress in their worse direction, from the unit or the flag they were recorded with
+    """
+    database = ResultsDb(str(tmp_path / "results.sqlite"))
+    runs = [database.start_run(), database.start_run()]
+    for run, scale in zip(runs, (1.0, 0.5)):
+        database.add_benchmark(run, "test_a", "period", scale, "s")
+        database.add_benchmark(run, "test_a", "rate", 10 * scale, "Hz")
+        database.add_benchmark(run, "test_a", "margin", scale, "mm", better=True)
+    assert {change.name: change.regression for change in database.compare(*runs)} == {
+        "test_a margin": True, "test_a period": False, "test_a rate": True}
+    database.close()
+
+
+def test_old_database(tmp_path):
+    """
+    A database written before benchmarks had a direction gets the column, its rows go by their unit
+    """
+    path = str(tmp_path / "results.sqlite")
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE benchmarks (run_id INTEGER, nodeid TEXT, name TEXT, value REAL, unit TEXT)")
+    connection.execute("INSERT INTO benchmarks VALUES (1, 'test_a', 'rate', 100.0, '1/s')")
+    connection.commit()
+    connection.close()
+    database = ResultsDb(path)
+    database.add_benchmark(2, "test_a", "rate", 50.0, "1/s")
+    assert database.benchmarks(1) == {"test_a rate": (100.0, "1/s", True)}
+    assert database.compare(1, 2)[0].regression
+    database.close()
+
+
+def test_main(tmp_path, capsys):
+    """
+    compare exits 1 on slower tests or worse benchmarks, runs lists every run, one run id is an error
+    """
+    path = tmp_path / "results.sqlite"
+    database = make_db(path)[0]
+    assert main(["--db", str(path), "compare"]) == 1
+    for rate in (100.0, 50.0):
+        database.add_benchmark(database.start_run(), "test_a", "rate", rate, "1/s")
+    database.close()
+    assert main(["--db", str(path), "compare"]) == 1
+    assert "REGRESSION" in capsys.readouterr().out
+    assert main(["--db", str(path), "compare", "1", "2", "--threshold", "2"]) == 0
+    assert main(["--db", str(path), "runs"]) == 0
+    assert "new" in capsys.readouterr().out
+    assert main(["--db", str(tmp_path / "missing.sqlite"), "runs"]) == 2
+    with pytest.raises(SystemExit):
+        main(["--db", str(path), "compare", "5"])
+    assert "compare takes OLD_RUN NEW_RUN or no runs" in capsys.readouterr().err
+
+
+def test_breakdown():
+    """
+    Time is added per category and reset per test
+    """
+    breakdown = Breakdown()
+    with breakdown.time("wait"):
+        sleep(0.01)
+    breakdown.add("poll", 0.5)
+    # Under --sim the sleep is virtual, the difference of two large clock readings may round below 0.01
+    assert breakdown.totals["wait"] >= 0.01 - 1e-9
+    assert breakdown.totals["poll"] == 0.5
+    breakdown.reset()
+    assert breakdown.totals == {"wait": 0.0, "poll": 0.0, "command": 0.0}
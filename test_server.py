@@ -0,0 +1,175 @@
+#! /usr/bin/python3
+"""
+ test_server.py Testing the status broadcast server and client
+    Runs without Linuxcnc, using a fake stat object on a unix socket
+
+"""
+import os
+import socket
+import time
+
+import pytest
+
+from lcnc_server import StatusClient, StatusServer, parse_address
+from lcnc_shm import ShmReader
+from lcnc_status import StatusSubscriptions
+
+
+class FakeStat:
+    """Stat like object with a few fields, counts its polls"""
+
+    polls = 0
+
+    def __init__(self):
+        self.estop = 1
+        self.gcodes = (0, 10, 170)
+        self.spindle = ({"enabled": 0},)
+
+    def poll(self):
+        """Count the poll"""
+        FakeStat.polls += 1
+
+    def __dir__(self):
+        return ["estop", "gcodes", "spindle", "poll"]
+
+
+@pytest.fixture
+def server(tmp_path):
+    """Server on a unix socket in the test directory, stepped by hand"""
+    FakeStat.polls = 0
+    stat = FakeStat()
+    status_server = StatusServer(f"unix:{tmp_path / 'status.sock'}", lambda: (stat, None))
+    status_server.stat = stat
+    yield status_server
+    status_server.close()
+
+
+def test_parse_address():
+    """
+    Unix paths and host:port pairs
+    """
+    assert parse_address("unix:/tmp/a.sock")[1] == "/tmp/a.sock"
+    assert parse_address("localhost:5007")[1] == ("localhost", 5007)
+    assert parse_address(":5007")[1] == ("localhost", 5007)
+
+
+def test_broadcast(server):
+    """
+    Clients get the full snapshot, then deltas, while the controller is polled once per step
+    """
+    server.step()
+    clients = [StatusClient(server.address) for _ in range(5)]
+    server.step()
+    for client in clients:
+        client.poll()
+        assert client.estop == 1
+        assert client.gcodes == (0, 10, 170)
+        assert client.state == "connected"
+
+    server.stat.estop = 0
+    server.stat.spindle = ({"enabled": 1},)
+    server.step()
+    for client in clients:
+        client.poll()
+        assert client.estop == 0
+        assert client.spindle[0]["enabled"] == 1
+        assert client.deltas == 1
+    assert FakeStat.polls == server.polls == 3
+
+    # Quiet steps send nothing
+    server.step()
+    clients[0].poll()
+    assert clients[0].deltas == 1
+
+    clients[1].close()
+    server.stat.estop = 1
+    server.step()
+    server.step()
+    assert len(server.clients) == 4
+    for client in clients:
+        client.close()
+
+
+def test_client_subscriptions(server):
+    """
+    StatusClient works wherever a polled stat is expected
+    """
+    server.step()
+    client = StatusClient(server.address)
+    server.step()
+    changes = []
+    subscriptions = StatusSubscriptions()
+    subscriptions.subscribe("estop", lambda *change: changes.append(change))
+    client.poll()
+    subscriptions.dispatch(client)
+    server.stat.estop = 0
+    server.step()
+    client.poll()
+    subscriptions.dispatch(client)
+    assert changes == [("estop", None, 1), ("estop", 1, 0)]
+
+    server.close()
+    with pytest.raises(ConnectionError):
+        client.poll()
+    client.close()
+
+
+def test_client_does_not_block(server):
+    """
+    Polls before the first snapshot return at once, only a snapshot later than the timeout fails
+    """
+    client = StatusClient(server.address)
+    start = time.monotonic()
+    client.poll()
+    assert time.monotonic() - start < 0.1
+    assert client.snapshot == {} and client.state is None
+    server.step()
+    client.poll()
+    assert client.estop == 1 and client.state == "connected"
+    client.close()
+
+    late = StatusClient(server.address, timeout=0.0)
+    with pytest.raises(TimeoutError):
+        late.poll()
+    late.close()
+
+
+def test_socket_in_use(server, tmp_path):
+    """
+    A second server refuses a socket that still answers, and replaces one left behind by a dead server
+    """
+    with pytest.raises(OSError, match="already listening"):
+        StatusServer(server.address, lambda: (FakeStat(), None))
+
+    path = str(tmp_path / "stale.sock")
+    dead = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    dead.bind(path)
+    dead.close()
+    replacement = StatusServer(f"unix:{path}", lambda: (FakeStat(), None))
+    replacement.step()
+    client = StatusClient(replacement.address)
+    replacement.step()
+    client.poll()
+    assert client.estop == 1
+    client.close()
+    replacement.close()
+
+
+def test_shm_mirror(tmp_path):
+    """
+    The server also publishes every poll to shared memory when asked to
+    """
+    stat = FakeStat()
+    name = f"lcnc-server-test-{os.getpid()}"
+    status_server = StatusServer(f"unix:{tmp_path / 'status.sock'}", lambda: (stat, None), shm=name)
+    try:
+        status_server.step()
+        reader = ShmReader(name)
+        stat.estop = 0
+        status_server.step()
+        reader.poll()
+        assert reader.estop == 0
+        assert reader.gcodes == (0, 10, 170)
+        reader.close()
+    finally:
+        status_server.close()
@@ -0,0 +1,121 @@
+#! /usr/bin/python3
+"""
+ test_shm.py Testing the shared memory status mirror
+    Runs without Linuxcnc, using a fake stat object
+
+"""
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from lcnc_shm import ShmReader, ShmWriter, field_format, make_layout, reader_throughput
+
+
+class FakeStat:
+    """Stat like object with scalar, array and variable fields"""
+
+    def __init__(self, value=0):
+        self.estop = value % 2
+        self.enabled = bool(value % 2)
+        self.feedrate = value / 10
+        self.ain = (float(value),) * 64
+        self.din = (value,) * 64
+        self.file = "/tmp/program.ngc"
+        self.spindle = ({"enabled": 0},)
+
+    def poll(self):
+        """Nothing to do"""
+
+    def __dir__(self):
+        return ["estop", "enabled", "feedrate", "ain", "din", "file", "spindle", "poll"]
+
+
+@pytest.fixture
+def segment_name():
+    """Unique segment name per test"""
+    return f"lcnc-test-{os.getpid()}"
+
+
+def test_layout():
+    """
+    Fixed size fields only, packed one after the other
+    """
+    assert field_format(True) == "?"
+    assert field_format((1, 2, 3)) == "3q"
+    assert field_format((1, 2.5)) == "2d"
+    assert field_format("text") is None
+    assert field_format(({"enabled": 0},)) is None
+    layout = make_layout(FakeStat())
+    assert [field for field, _, _ in layout] == ["ain", "din", "enabled", "estop", "feedrate"]
+    assert layout[1] == ("din", "64q", 64 * 8)
+
+
+def test_publish_read(segment_name):
+    """
+    Readers see the last publish, as tuples like linuxcnc.stat
+    """
+    writer = ShmWriter(segment_name, FakeStat(1))
+    reader = ShmReader(segment_name)
+    reader.poll()
+    assert reader.estop == 1
+    assert reader.enabled is True
+    assert reader.ain == (1.0,) * 64
+    writer.publish(FakeStat(4))
+    assert reader.read(["feedrate", "din"]) == {"feedrate": 0.4, "din": (4,) * 64}
+    assert reader.sequence == 4
+    with pytest.raises(AttributeError):
+        _ = reader.file
+    reader.close()
+    writer.close()
+
+
+def read_consistent(name, count, queue):
+    """Reader process, counts torn reads where ain and din come from different publishes"""
+    reader = ShmReader(name)
+    torn = 0
+    for _ in range(count):
+        values = reader.read(["ain", "din"])
+        if len(set(values["ain"])) != 1 or values["ain"][0] != values["din"][0]:
+            torn += 1
+    queue.put((torn, reader.retries))
+    reader.close()
+
+
+def test_concurrent_reader(segment_name, record_benchmark):
+    """
+    A reader in another process never sees half of a publish
+    :param record_benchmark: Stores the reader's retries in the results database
+    """
+    stats = [FakeStat(value) for value in range(100)]
+    writer = ShmWriter(segment_name, stats[0])
+    try:
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=read_consistent, args=(segment_name, 20000, queue))
+        process.start()
+        while process.is_alive() and queue.empty():
+            for stat in stats:
+                writer.publish(stat)
+                time.sleep(0)
+        torn, retries = queue.get(timeout=5)
+        process.join()
+    finally:
+        writer.close()
+    record_benchmark("concurrent reader retries", retries)
+    assert torn == 0
+
+
+def test_reader_throughput(segment_name, record_benchmark):
+    """
+    The benchmark reports a positive rate
+    :param record_benchmark: Stores the read rate in the results database
+    """
+    writer = ShmWriter(segment_name, FakeStat(1))
+    try:
+        result = reader_throughput(segment_name, duration=0.1)
+    finally:
+        writer.close()
+    record_benchmark("reads_per_second", result["reads_per_second"], "1/s")
+    assert result["reads"] > 0
+    assert result["reads_per_second"] > 1000
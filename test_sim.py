@@ -0,0 +1,192 @@
+#! /usr/bin/python3
+"""
+ test_sim.py Testing the simulated controller and the virtual clock
+    Runs without Linuxcnc, the simulator is installed as linuxcnc only inside each test
+
+"""
+import os
+import sys
+import time
+
+import pytest
+
+import lcnc_timing
+from lcnc_checkpoint import capture, restore, setup
+from lcnc_sim import (AUTO_RUN, HOME_TIME, INTERP_IDLE, MODE_AUTO, MODE_MDI, OPERATOR_ERROR, RCS_DONE, RCS_ERROR,
+                      STATE_ESTOP_RESET, STATE_ON, SimController, sim_module)
+from lcnc_timing import PeriodicSampler, VirtualClock, wait_for
+
+BASIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs", "basic.ini")
+
+
+@pytest.fixture
+def sim(monkeypatch):
+    """Simulator on a fresh VirtualClock, installed as linuxcnc and as the default clock"""
+    clock = VirtualClock()
+    module = sim_module(SimController(BASIC_INI, clock))
+    monkeypatch.setitem(sys.modules, "linuxcnc", module)
+    monkeypatch.setattr(lcnc_timing, "CLOCK", clock)
+    return module
+
+
+def run_session(module):
+    """Enable, home, move and restore, returning what a test would observe"""
+    com, stat = module.command(), module.stat()
+    checkpoint = setup(com, stat)
+    com.mode(MODE_MDI)
+    com.wait_complete()
+    for command in ["G0 X20", "G10 L2 P1 X5", "G0 X1"]:
+        com.mdi(command)
+        com.wait_complete()
+    stat.poll()
+    moved = (stat.actual_position[0], stat.g5x_offset[0])
+    report = restore(com, stat, checkpoint)
+    stat.poll()
+    return checkpoint, moved, report.commands, stat.actual_position[0], module.controller.clock.now
+
+
+def test_virtual_clock_periodic():
+    """
+    Periodic callbacks run at exact multiples of their interval and in order, sleeping takes no real time
+    """
+    clock = VirtualClock()
+    calls = []
+    fast = clock.every(0.25, lambda: calls.append(("fast", clock.now)))
+    clock.every(1.0, lambda: calls.append(("slow", clock.now)))
+    start = time.perf_counter()
+    clock.sleep(1.0)
+    assert time.perf_counter() - start < 0.1
+    assert calls == [("fast", 0.25), ("fast", 0.5), ("fast", 0.75), ("fast", 1.0), ("slow", 1.0)]
+    clock.cancel(fast)
+    clock.sleep(1.0)
+    assert calls[-1] == ("slow", 2.0) and len(calls) == 6
+
+
+def test_periodic_sampler_virtual():
+    """
+    Under a VirtualClock a sampler takes its samples at virtual times instead of from a thread
+    """
+    clock = VirtualClock()
+    times = []
+    sampler = PeriodicSampler(lambda: times.append(clock.now), 0.1, clock)
+    sampler.start()
+    clock.sleep(0.35)
+    sampler.stop()
+    clock.sleep(1.0)
+    assert times == pytest.approx([0.0, 0.1, 0.2, 0.3])
+
+
+def test_homing_in_virtual_time(sim):
+    """
+    Enabling and homing take simulated seconds and no real ones
+    """
+    start = time.perf_counter()
+    checkpoint = setup(sim.command(), sim.stat())
+    assert time.perf_counter() - start < 1.0
+    assert checkpoint.homed == (1,) and checkpoint.task_state == STATE_ON
+    assert sim.controller.clock.now >= HOME_TIME
+
+
+def test_status_after_poll(sim):
+    """
+    A new stat has no status until it is polled, as linuxcnc.stat is not filled in before poll()
+    """
+    stat = sim.stat()
+    with pytest.raises(AttributeError, match="poll"):
+        _ = stat.task_state
+    assert dir(stat) == ["poll"]
+    stat.poll()
+    assert stat.task_state == sim.STATE_ESTOP and "task_state" in dir(stat)
+
+
+def test_wait_for_timeout(sim):
+    """
+    A wait that never succeeds times out after its full virtual timeout, at once
+    """
+    stat = sim.stat()
+    start = time.perf_counter()
+    assert wait_for(stat, lambda s: s.task_state == STATE_ON, 30.0) is None
+    assert time.perf_counter() - start < 5.0
+    assert sim.controller.clock.now >= 30.0
+
+
+def test_command_delay_ordering(sim):
+    """
+    State commands take effect in the order sent, after the NML delay
+    """
+    com, stat = sim.command(), sim.stat()
+    com.state(STATE_ESTOP_RESET)
+    com.state(STATE_ON)
+    stat.poll()
+    assert stat.task_state != STATE_ON
+    assert com.wait_complete() == RCS_DONE
+    stat.poll()
+    assert stat.task_state == STATE_ON and stat.echo_serial_number == com.serial
+
+
+def test_mdi_move_profile(sim):
+    """
+    A G0 takes as long as its trapezoidal profile under [AXIS_X] limits, rejected commands reach the error channel
+    """
+    com, stat, errors = sim.command(), sim.stat(), sim.error_channel()
+    setup(com, stat)
+    com.mdi("G0 X20")
+    assert com.wait_complete() == RCS_ERROR
+    assert errors.poll() == (OPERATOR_ERROR, "Must be in MDI mode to issue MDI command")
+
+    com.mode(MODE_MDI)
+    com.wait_complete()
+    start = sim.controller.clock.now
+    com.mdi("G0 X20")
+    wait_for(stat, lambda s: s.current_vel > 0, 1.0)
+    assert 0 < stat.current_vel <= 25.0
+    assert com.wait_complete() == RCS_DONE
+    ramp = 25.0 / 60.0
+    assert sim.controller.clock.now - start == pytest.approx(2 * ramp + (20 - 25.0 * ramp) / 25.0, abs=0.01)
+    stat.poll()
+    assert stat.actual_position[0] == pytest.approx(20.0) and stat.current_vel == 0
+
+    com.mdi("G0 X600")
+    assert com.wait_complete() == RCS_ERROR
+    assert "limit" in errors.poll()[1]
+
+
+def test_restore_and_determinism(sim):
+    """
+    Restore brings back position and offsets, and the same session gives the same results every run
+    """
+    checkpoint, moved, commands, position, elapsed = run_session(sim)
+    assert moved == (pytest.approx(6.0), 5.0)
+    assert commands == ["G20", "G10 L2 P1 X0.000000", "G53 G0 X0.000000"]
+    assert position == pytest.approx(checkpoint.position[0])
+    assert capture(sim.stat()).g5x_offset == checkpoint.g5x_offset
+
+    clock = VirtualClock()
+    lcnc_timing.CLOCK = clock
+    again = sim_module(SimController(BASIC_INI, clock))
+    sys.modules["linuxcnc"] = again
+    assert run_session(again) == (checkpoint, moved, commands, position, elapsed)
+
+
+def test_unconfigured_axis(sim, tmp_path):
+    """
+    Words for axes outside [TRAJ]COORDINATES are rejected in MDI and stop a program
+    """
+    com, stat, errors = sim.command(), sim.stat(), sim.error_channel()
+    setup(com, stat)
+    com.mode(MODE_MDI)
+    com.wait_complete()
+    com.mdi("G0 X1 Y1")
+    assert com.wait_complete() == RCS_ERROR
+    assert "Cannot use axis Y" in errors.poll()[1]
+
+    program = tmp_path / "yz.ngc"
+    program.write_text("G0 X5\nG0 X2 Z-1\nM2\n")
+    com.mode(MODE_AUTO)
+    com.wait_complete()
+    com.program_open(str(program))
+    com.auto(AUTO_RUN)
+    assert com.wait_complete() == RCS_ERROR
+    assert errors.poll()[1].startswith("Near line 2")
+    assert wait_for(stat, lambda s: s.interp_state == INTERP_IDLE and s.current_vel == 0, 1.0) is not None
+    assert stat.actual_position[0] < 5.0
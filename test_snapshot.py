@@ -0,0 +1,100 @@
+#! /usr/bin/python3
+"""
+ test_snapshot.py Testing the snapshot, diff and subscription helpers
+    Runs without Linuxcnc, using a counting object in place of linuxcnc.stat
+
+"""
+import pytest
+
+from lcnc_status import LazySnapshot, SnapshotPoller, StatusSubscriptions, diff_snapshots, take_snapshot
+
+
+class CountingStat:
+    """Stat like object that counts attribute reads, the status changes on every poll"""
+
+    # Polls so far across every instance, like one controller shared by many stat objects
+    ticks = 0
+
+    def __init__(self):
+        self.polls = 0
+        self.reads = []
+
+    def poll(self):
+        """Advance to the next status"""
+        CountingStat.ticks += 1
+        self.polls = CountingStat.ticks
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name not in ("estop", "task_state", "ain", "tool_table"):
+            raise AttributeError(name)
+        self.reads.append(name)
+        return {"estop": self.polls % 2,
+                "task_state": 1,
+                "ain": (0.0, float(self.polls >= 3)),
+                "tool_table": ((0,) * 14,) * 100}[name]
+
+    def __dir__(self):
+        return ["estop", "task_state", "ain", "tool_table", "poll"]
+
+
+def test_diff_snapshots():
+    """
+    Only changed fields are reported, optionally only the requested ones
+    """
+    old = {"estop": 1, "task_state": 1}
+    new = {"estop": 0, "task_state": 1}
+    assert diff_snapshots(old, new) == {"estop": (1, 0)}
+    assert diff_snapshots(old, new, ["task_state"]) == {}
+
+
+def test_lazy_snapshot():
+    """
+    Fields are read on demand, once
+    """
+    CountingStat.ticks = 0
+    stat = CountingStat()
+    stat.poll()
+    snap = LazySnapshot(stat)
+    assert snap["estop"] == 1
+    assert snap["estop"] == 1
+    assert stat.reads == ["estop"]
+    assert "tool_table" in snap
+    assert set(snap) == {"estop", "task_state", "ain", "tool_table"}
+    assert take_snapshot(stat, ["task_state"]) == {"task_state": 1}
+    with pytest.raises(KeyError):
+        snap["poll"]  # pylint: disable=pointless-statement
+
+
+def test_snapshot_poller():
+    """
+    Snapshots from the ring diff against each other and detect reuse
+    """
+    CountingStat.ticks = 0
+    poller = SnapshotPoller(CountingStat, buffers=2)
+    first = poller.poll()
+    second = poller.poll()
+    assert diff_snapshots(first, second, ["estop", "task_state"]) == {"estop": (1, 0)}
+    assert first.decoded == ["estop", "task_state"]
+
+    poller.poll()
+    assert first["estop"] == 1  # Already decoded, still readable
+    with pytest.raises(RuntimeError):
+        first["ain"]  # pylint: disable=pointless-statement
+
+
+def test_subscriptions():
+    """
+    Callbacks fire on the first dispatch and then only on change
+    """
+    CountingStat.ticks = 0
+    stat = CountingStat()
+    subscriptions = StatusSubscriptions()
+    changes = []
+    subscriptions.subscribe("task_state", lambda *change: changes.append(change))
+    subscriptions.subscribe("ain[1]", lambda *change: changes.append(change))
+
+    for _ in range(4):
+        stat.poll()
+        subscriptions.dispatch(stat)
+    assert changes == [("task_state", None, 1), ("ain[1]", None, 0.0), ("ain[1]", 0.0, 1.0)]
+    assert "tool_table" not in stat.reads
@@ -4,29 +4,54 @@
     Written by Chad A. Woitas
     
 """
+import asyncio
 import functools
-import math
 import os
 import random
 from typing import List, Dict, Optional
 import time
 import inspect
 import linuxcnc
+import pytest
 import sys
 import traceback
 
 from subprocess import run
-from lcnc import LcncWindow
+from lcnc import SERVER_WAIT, LcncWindow
+from lcnc_arrays import StatArrays, assert_allclose, assert_masked_equal
+from lcnc_async import AsyncCommand, AsyncStat
+from lcnc_bench import PROGRAM_AXES, PROGRAMS, REPORT_UNITS, missing_axes, run_benchmark
+from lcnc_checkpoint import restore, setup
+from lcnc_columnar import ColumnarReader, ColumnarRecorder
+from lcnc_fuzz import fuzz, reset
+from lcnc_hal import read_pins, validate_status
+from lcnc_ini import AXIS_LETTERS, load_ini, machine_axes, validate_ini
+from lcnc_io import input_pin_counts, io_sweep, random_patterns, reset_inputs
+from lcnc_motion import (TrajectoryRecorder, axis_limits, benchmark_sampler, find_violations, motion_profile,
+                         random_waypoints, run_program, verify_waypoints, waypoint_program, write_program)
+from lcnc_pipeline import CommandPipeline
+from lcnc_server import StatusServer
+from lcnc_shm import ShmReader, ShmWriter, reader_throughput
+from lcnc_status import SnapshotPoller, StatusSubscriptions
+from lcnc_timing import BREAKDOWN, LATENCIES, wait_for
+from lcnc_tooltable import generate_tool_table, is_temp_config
+from lcnc_trace import TRACE
 
 # Seconds between tests
 TEST_FREQ = 0.01
 TEST_TIMEOUT = 250
 JOG_TIMEOUT = 2.0
+FUZZ_STEPS = 300
 EPS = 0.0001
 
 
-LCNC = os.popen("linuxcnc -l")
-time.sleep(5)
+# pytest --sim installs lcnc_sim as linuxcnc, nothing to start then
+if not getattr(linuxcnc, "SIMULATED", False):
+    LCNC = os.popen("linuxcnc -l")
+    time.sleep(5)
+
+# Shared by the helpers, which only decode the one or two fields they check
+STATUS = SnapshotPoller(linuxcnc.stat)
 
 def dict_compare(orig_stat, new_stat) -> [set, set, set, set]:
     """
@@ -58,6 +83,7 @@ def dict_compare(orig_stat, new_stat) -> [set, set, set, set]:
     added = d2_keys - d1_keys
     removed = d1_keys - d2_keys
     modified = {o: (d1[o], d2[o]) for o in shared_keys if d1[o] != d2[o]}
+    TRACE.record_diff(modified)
     same = set(o for o in shared_keys if d1[o] == d2[o])
     return added, removed, modified, same
 
@@ -69,11 +95,13 @@ def set_estop_ready() -> bool:
     :return: True if successful
     """
     com = linuxcnc.command()
-    stat = linuxcnc.stat()
-    com.state(linuxcnc.STATE_ESTOP_RESET)
-    time.sleep(0.1)  # TODO should this be a qtbot.wait call?
-    stat.poll()
-    return stat.estop == 0
+    TRACE.command("state STATE_ESTOP_RESET")
+    with BREAKDOWN.time("command"):
+        com.state(linuxcnc.STATE_ESTOP_RESET)
+    with BREAKDOWN.time("wait"):
+        time.sleep(0.1)  # TODO should this be a qtbot.wait call?
+    with BREAKDOWN.time("poll"):
+        return STATUS.poll()["estop"] == 0
 
 
 # TODO: validate
@@ -83,11 +111,13 @@ def set_machine_enabled() -> bool:
     :return: True if successful
     """
     com = linuxcnc.command()
-    stat = linuxcnc.stat()
-    com.state(linuxcnc.STATE_ON)
-    time.sleep(0.1)  # TODO should this be a qtbot.wait call?
-    stat.poll()
-    return stat.task_state == linuxcnc.STATE_ON
+    TRACE.command("state STATE_ON")
+    with BREAKDOWN.time("command"):
+        com.state(linuxcnc.STATE_ON)
+    with BREAKDOWN.time("wait"):
+        time.sleep(0.1)  # TODO should this be a qtbot.wait call?
+    with BREAKDOWN.time("poll"):
+        return STATUS.poll()["task_state"] == linuxcnc.STATE_ON
 
 
 def test_code_base():
@@ -108,6 +138,66 @@ def test_code_base():
     # TODO: Test poll somewhere in here?
 
 
+def test_window_startup(qtbot):
+    """
+    The monitor window paints and shows its first data well under a second after construction
+    :param qtbot: Test Suite Control for pytest-qt
+    """
+    window_test = LcncWindow(drain_errors=False)
+    window_test.show()
+    qtbot.addWidget(window_test)
+    qtbot.waitUntil(lambda: "first_data" in window_test.startup, timeout=1000)
+    assert window_test.startup["first_data"] - window_test.startup["init"] < 1.0
+    assert len(window_test.status_labels) > 0
+
+
+def test_error_channel(qtbot):
+    """
+    A rejected MDI reaches the window's error drain and status bar with its command and latency, without polling
+    The only window of the suite draining the error channel, a second one would take errors from it
+    :param qtbot: Test Suite Control for pytest-qt
+    """
+    window_test = LcncWindow()
+    window_test.show()
+    qtbot.addWidget(window_test)
+    qtbot.waitUntil(lambda: window_test.errors is not None, timeout=1000)
+    window_test.command.state(linuxcnc.STATE_ESTOP)
+    window_test.command.wait_complete()
+    window_test.errors.clear()
+
+    window_test.command.mdi("G0 X0")
+    error = window_test.errors.wait_error(lambda e: e.is_error, JOG_TIMEOUT)
+    assert error is not None
+    assert error.command == "mdi G0 X0" and 0 <= error.latency < JOG_TIMEOUT
+    LATENCIES.add("error channel", error.latency)
+    qtbot.waitUntil(lambda: error.text in window_test.ui.statusbar.currentMessage(), timeout=2000)
+
+
+def test_window_client(qtbot, tmp_path):
+    """
+    In client mode the window reports the status server's connection to LinuxCNC, and waiting for the server
+    never blocks its timer
+    :param qtbot: Test Suite Control for pytest-qt
+    :param tmp_path: Directory for the server socket
+    """
+    server = StatusServer(f"unix:{tmp_path / 'status.sock'}", lambda: (linuxcnc.stat(), linuxcnc.command()))
+    try:
+        window_test = LcncWindow(server=server.address)
+        window_test.show()
+        qtbot.addWidget(window_test)
+        qtbot.waitUntil(lambda: window_test.connection == SERVER_WAIT, timeout=2000)
+        assert SERVER_WAIT in window_test.ui.statusbar.currentMessage()
+
+        def served():
+            server.step()
+            return window_test.connection == "connected"
+        qtbot.waitUntil(served, timeout=2000)
+        assert window_test.ui.statusbar.currentMessage().startswith("Linuxcnc detected")
+        qtbot.waitUntil(lambda: "first_data" in window_test.startup, timeout=2000)
+    finally:
+        server.close()
+
+
 def initialize_test(func):
     """
     Decorator to set up test state
@@ -117,7 +207,7 @@ def initialize_test(func):
     @functools.wraps(func)
     def wrapper(**kwargs):
 
-        window_test = LcncWindow()
+        window_test = LcncWindow(drain_errors=False)
         window_test.show()
         kwargs["qtbot"].addWidget(window_test)
         kwargs["qtbot"].wait(TEST_TIMEOUT)
@@ -127,6 +217,28 @@ def initialize_test(func):
     return wrapper
 
 
+@pytest.fixture(scope="session")
+def machine_checkpoint():
+    """
+    Enable and home the machine once per session
+    :return: Checkpoint of the homed machine
+    """
+    return setup(linuxcnc.command(), linuxcnc.stat())
+
+
+@pytest.fixture
+def homed_machine(machine_checkpoint):
+    """
+    Restore the homed machine before a motion test, homing again only if the homed flags were lost
+    :param machine_checkpoint: Session checkpoint
+    :return: RestoreReport of what had to be done
+    """
+    report = restore(linuxcnc.command(), linuxcnc.stat(), machine_checkpoint)
+    TRACE.command(f"restore checkpoint: rehomed={report.rehomed} {'; '.join(report.commands)}")
+    LATENCIES.add("checkpoint restore", report.elapsed)
+    return report
+
+
 def requires_machine_enabled(func):
     """
     Decorator to enable the machine before a test
@@ -137,7 +249,7 @@ def requires_machine_enabled(func):
     @functools.wraps(func)
     def wrapper(**kwargs):
 
-        window_test = LcncWindow()
+        window_test = LcncWindow(drain_errors=False)
         window_test.show()
         kwargs["qtbot"].addWidget(window_test)
         kwargs["qtbot"].wait(TEST_TIMEOUT)
@@ -174,7 +286,9 @@ def test_estop(qtbot):
               [linuxcnc.STATE_ESTOP_RESET, 0, 0, 3, linuxcnc.STATE_ESTOP_RESET, 0],
               ]
 
+    TRACE.command("state STATE_ESTOP_RESET")
     com.state(linuxcnc.STATE_ESTOP_RESET)
+    TRACE.settled(wait_for(stat1, lambda s: s.estop == 0, JOG_TIMEOUT))
     qtbot.wait(TEST_TIMEOUT)
     stat1.poll()
     added, removed, modified, same = dict_compare(stat, stat1)
@@ -183,15 +297,14 @@ def test_estop(qtbot):
     assert stat1.estop == 0
 
     for idx, check in enumerate(groups):
-        print(f"Commanding {idx}")
-
         stat.poll()
+        TRACE.command(f"group {idx}: state {check[0]}")
         com.state(check[0])
+        LATENCIES.add(f"state {check[0]}", TRACE.settled(wait_for(
+            stat1, lambda s: s.task_state == check[4] and s.estop == check[5], JOG_TIMEOUT)))
         qtbot.wait(TEST_TIMEOUT)
         stat1.poll()
         added, removed, modified, same = dict_compare(stat, stat1)
-        print("Changed Values:")
-        print(modified.keys())
         assert len(added) == check[1]
         assert len(removed) == check[2]
         assert len(modified) == check[3]
@@ -217,21 +330,25 @@ def test_machine_enable(qtbot):
     #  Lube enables from ESTOP_RESET to STATE_ON Issue #4
     #  Need to right a test to compare joints
 
+    # Motion starts in free mode and switches to coordinated on the first enable only,
+    # a repeated run (--repeat-count) starts coordinated and sees one field less change
+    first_enable = int(stat.motion_mode != linuxcnc.TRAJ_MODE_COORD)
+
     #          COMMAND, ADDED, REMOVED, MODIFIED, TASKSTATE, ESTOP
-    groups = [[linuxcnc.STATE_ON, 0, 0, 5, linuxcnc.STATE_ON, 0],
+    groups = [[linuxcnc.STATE_ON, 0, 0, 4 + first_enable, linuxcnc.STATE_ON, 0],
               [linuxcnc.STATE_OFF, 0, 0, 4, linuxcnc.STATE_ESTOP_RESET, 0],
               [linuxcnc.STATE_ON, 0, 0, 4, linuxcnc.STATE_ON, 0],
               ]
     for idx, check in enumerate(groups):
-        print(f"Commanding {idx}")
         qtbot.wait(TEST_TIMEOUT)
         stat.poll()
+        TRACE.command(f"group {idx}: state {check[0]}")
         com.state(check[0])
+        LATENCIES.add(f"state {check[0]}", TRACE.settled(wait_for(
+            stat1, lambda s: s.task_state == check[4] and s.estop == check[5], JOG_TIMEOUT)))
         qtbot.wait(TEST_TIMEOUT)
         stat1.poll()
         added, removed, modified, same = dict_compare(stat, stat1)
-        print("Changed Values:")
-        print(modified.keys())
         assert len(added) == check[1]
         assert len(removed) == check[2]
         assert len(modified) == check[3]
@@ -239,6 +356,141 @@ def test_machine_enable(qtbot):
         assert stat1.estop == check[5]
 
 
+@initialize_test
+def test_async_state(qtbot):
+    """
+    Wait on estop and task_state concurrently through the asyncio wrappers
+    :param qtbot: Test Suite Control for pytest-qt
+    """
+
+    async def run_states():
+        a_stat = AsyncStat()
+        a_com = AsyncCommand(stat=a_stat)
+
+        await a_com.state_async(linuxcnc.STATE_ESTOP)
+        baseline = await a_stat.poll(["estop", "task_state"])
+        await a_com.state_async(linuxcnc.STATE_ESTOP_RESET)
+        return await asyncio.gather(
+            a_stat.changed(["estop"], baseline=baseline, timeout=JOG_TIMEOUT),
+            a_stat.changed(["task_state"], baseline=baseline, timeout=JOG_TIMEOUT),
+        )
+
+    estop_change, state_change = asyncio.run(run_states())
+    assert estop_change["estop"] == (1, 0)
+    assert state_change["task_state"] == (linuxcnc.STATE_ESTOP, linuxcnc.STATE_ESTOP_RESET)
+
+
+@initialize_test
+def test_command_fuzz(qtbot, record_benchmark):
+    """
+    Random state/mode/home/mdi/abort sequences match the task state model, a failure reports its shrunk sequence
+    Only transitions the model was checked on against LinuxCNC are sent
+    :param qtbot: Test Suite Control for pytest-qt
+    :param record_benchmark: Stores steps per second with the run
+    """
+    result = fuzz(lambda: reset(linuxcnc), count=FUZZ_STEPS, verified_only=True)
+    if result.elapsed > 0:
+        record_benchmark("fuzz steps_per_second", result.steps_run / result.elapsed, "1/s")
+    assert result.failure is None, (f"seed {result.seed}: {result.failure} after "
+                                    f"{', '.join(str(step) for step in result.sequence)}")
+
+
+@pytest.mark.no_sim
+@initialize_test
+def test_hal_cross_validation(qtbot):
+    """
+    Every mapped stat field agrees with its HAL pin, in estop and with the machine on
+    :param qtbot: Test Suite Control for pytest-qt
+    """
+    com = linuxcnc.command()
+    for state in [linuxcnc.STATE_ESTOP, linuxcnc.STATE_ESTOP_RESET, linuxcnc.STATE_ON]:
+        com.state(state)
+        com.wait_complete()
+        qtbot.wait(TEST_TIMEOUT)
+        mismatches = validate_status(linuxcnc.stat())
+        assert mismatches == [], f"state {state}"
+
+
+@initialize_test
+def test_ini_reflection(qtbot):
+    """
+    Units, axis mask, joints, spindles, cycle time and joint/axis limits reflect the ini, checked on one poll
+    :param qtbot: Test Suite Control for pytest-qt
+    """
+    assert validate_ini(linuxcnc.stat()) == []
+
+
+@pytest.mark.no_sim
+@requires_machine_enabled
+def test_subscriptions(qtbot):
+    """
+    Field callbacks fire only for the fields that changed
+    :param qtbot: Test Suite Control for pytest-qt
+    """
+    stat = linuxcnc.stat()
+    subscriptions = StatusSubscriptions()
+    changes = []
+    for field in ["task_state", "estop", "ain[3]"]:
+        subscriptions.subscribe(field, lambda path, old, new: changes.append((path, old, new)))
+
+    stat.poll()
+    subscriptions.dispatch(stat)
+    assert len(changes) == 3
+    changes.clear()
+
+    stat.poll()
+    subscriptions.dispatch(stat)
+    assert len(changes) == 0
+
+    run(["halcmd", "setp", "motion.analog-in-03", "1"])
+    qtbot.wait(100)
+    stat.poll()
+    subscriptions.dispatch(stat)
+    run(["halcmd", "setp", "motion.analog-in-03", "0"])
+    assert changes == [("ain[3]", 0, 1)]
+
+
+@initialize_test
+def test_tool_table_load(qtbot, record_benchmark):
+    """
+    Benchmark: time for stat.tool_table to reflect large generated tool tables,
+    and how poll() plus reading tool_table scales with the table size
+    Overwrites the tool table, so it only runs on a configuration copied by lcnc_tooltable.write_temp_config
+    :param qtbot: Test Suite Control for pytest-qt
+    :param record_benchmark: Stores the timings in the results database
+    """
+    com = linuxcnc.command()
+    stat = linuxcnc.stat()
+    stat.poll()
+    table_path = load_ini(stat.ini_filename).tool_table
+    if not is_temp_config(table_path):
+        pytest.skip(f"{table_path} is not a write_temp_config copy, its tool table is not overwritten")
+
+    with open(table_path, encoding="utf8") as table:
+        original = table.read()
+    try:
+        for count in [10, 100, 500]:
+            generate_tool_table(table_path, count, seed=count)
+            TRACE.command(f"load_tool_table {count} tools")
+            com.load_tool_table()
+            load_time = TRACE.settled(wait_for(
+                stat, lambda s: len([tool for tool in s.tool_table if tool.id > 0]) == count, JOG_TIMEOUT))
+            assert load_time is not None
+
+            start = time.perf_counter()
+            for _ in range(100):
+                stat.poll()
+                _ = stat.tool_table
+            poll_time = (time.perf_counter() - start) / 100
+            record_benchmark(f"load {count} tools", load_time, "s")
+            record_benchmark(f"poll {count} tools", poll_time, "s")
+    finally:
+        with open(table_path, "w", encoding="utf8") as table:
+            table.write(original)
+        com.load_tool_table()
+        com.wait_complete()
+
+
 # def test_acceleration(qtbot):
 #     """
 #         acceleration
@@ -271,7 +523,7 @@ def test_machine_enable(qtbot):
 #     assert set_machine_enabled()
 
 @requires_machine_enabled
-def test_actual_position(qtbot):
+def test_actual_position(qtbot, homed_machine):
     """
     (returns tuple of floats) - current trajectory position, (x y z a b c u v w) in machine units.
     """
@@ -284,31 +536,205 @@ def test_actual_position(qtbot):
     stat1 = linuxcnc.stat()
     stat1.poll()
 
-    com.mode(linuxcnc.MODE_MANUAL)
-    com.home(-1)
-
-    # TODO need a homing fixture.
-    qtbot.wait(5000)
+    # Z moves down, the other configured axes up
+    axes = machine_axes(load_ini(stat.ini_filename))
+    signs = [-1 if axis == "Z" else 1 for axis in axes]
+    columns = [AXIS_LETTERS.index(axis) for axis in axes]
 
     com.mode(linuxcnc.MODE_MDI)
-    com.mdi("G0 X0Y0Z0")  # TODO Refine this after to more axis
+    com.mdi("G0 " + " ".join(f"{axis}0" for axis in axes))
 
     com.wait_complete()
     stat.poll()
-    for i in stat.actual_position:
-        assert abs(i) < EPS
+    assert_allclose(StatArrays(stat, ["actual_position"]).actual_position, 0, eps=EPS)
 
     spots = [random.randint(0, 10)/10 for i in range(10)]
 
     for i in spots:
         qtbot.wait(TEST_TIMEOUT)
-        com.mdi(f"G0 X{i}Y{i}Z-{i}")
+        words = " ".join(f"{axis}{sign * i}" for axis, sign in zip(axes, signs))
+        TRACE.command(f"mdi G0 {words}")
+        com.mdi(f"G0 {words}")
         com.wait_complete()
-        print(i)
         stat.poll()
-        assert math.isclose(stat.actual_position[0], i, abs_tol=EPS)
-        assert math.isclose(stat.actual_position[1], i, abs_tol=EPS)
-        assert math.isclose(stat.actual_position[2], -1 * i, abs_tol=EPS)
+        TRACE.record("actual_position", None, stat.actual_position)
+        assert_allclose(StatArrays(stat, ["actual_position"]).actual_position[columns], [sign * i for sign in signs],
+                        eps=EPS)
+
+
+@requires_machine_enabled
+def test_actual_position_bulk(qtbot, homed_machine, record_benchmark):
+    """
+    Run hundreds of random moves as one program and check every waypoint in the recorded trajectory
+    :param record_benchmark: Stores the recorder's sample rate in the results database
+    """
+    assert set_estop_ready()
+    assert set_machine_enabled()
+
+    com = linuxcnc.command()
+    stat = linuxcnc.stat()
+
+    stat.poll()
+    axes = machine_axes(load_ini(stat.ini_filename))
+    waypoints = random_waypoints(200, axes, low=[-1 if axis == "Z" else 0 for axis in axes],
+                                 high=[0 if axis == "Z" else 1 for axis in axes])
+    program = write_program(waypoint_program(waypoints, axes))
+    try:
+        with TrajectoryRecorder() as recorder:
+            assert run_program(com, stat, program)
+    finally:
+        os.remove(program)
+
+    record_benchmark("trajectory samples_per_second",
+                     (len(recorder.times) - 1) / (recorder.times[-1] - recorder.times[0]), "1/s")
+    columns = [AXIS_LETTERS.index(axis) for axis in axes]
+    assert verify_waypoints(recorder.positions[:, columns], waypoints, eps=EPS) == []
+
+
+def test_command_pipeline(qtbot, homed_machine, record_benchmark):
+    """
+    A batch of X moves is sent without a wait per command, each completes with its own status and round trip
+    :param qtbot: Test Suite Control for pytest-qt
+    :param homed_machine: Restored homed machine
+    :param record_benchmark: Stores commands per second with the run
+    """
+    stat = linuxcnc.stat()
+    pipe = CommandPipeline(linuxcnc.command(), stat)
+    spots = [random.randint(0, 10) / 10 for _ in range(10)]
+    commands = [("mode", linuxcnc.MODE_MDI)] + [("mdi", f"G0 X{i}") for i in spots]
+
+    start = time.perf_counter()
+    futures = pipe.batch(commands)
+    results = pipe.wait_all(JOG_TIMEOUT * len(commands))
+    elapsed = time.perf_counter() - start
+    assert sorted(results, key=lambda result: result.serial) == [future.result() for future in futures]
+    assert all(result.status == linuxcnc.RCS_DONE and not result.superseded for result in results)
+    for result in results:
+        LATENCIES.add(f"pipeline {result.command.split()[0]}", result.latency)
+    record_benchmark("pipeline commands_per_second", len(commands) / elapsed, "1/s")
+
+    assert wait_for(stat, lambda s: s.interp_state == linuxcnc.INTERP_IDLE, JOG_TIMEOUT * len(spots)) is not None
+    assert abs(stat.actual_position[0] - spots[-1]) <= EPS
+
+
+@requires_machine_enabled
+def test_trajectory_limits(qtbot, homed_machine, record_benchmark):
+    """
+    current_vel and the velocity/acceleration of long X moves stay within the [AXIS_X] and [TRAJ] limits
+    :param record_benchmark: Stores the peak velocity and acceleration in the results database
+    """
+    assert set_estop_ready()
+    assert set_machine_enabled()
+
+    com = linuxcnc.command()
+    stat = linuxcnc.stat()
+    stat.poll()
+    limits = axis_limits(stat.ini_filename, "X")
+
+    waypoints = [[20.0], [0.0], [40.0], [5.0]]
+    program = write_program(waypoint_program(waypoints, "X", dwell=0))
+    try:
+        with TrajectoryRecorder() as recorder:
+            assert run_program(com, stat, program)
+    finally:
+        os.remove(program)
+
+    profile = motion_profile(recorder.times, recorder.positions[:, :1])
+    record_benchmark("X peak velocity", abs(profile.velocity).max(), "units/s", better=True)
+    record_benchmark("X peak acceleration", abs(profile.acceleration).max(), "units/s^2", better=True)
+    assert abs(profile.velocity).max() > 0
+    assert find_violations(profile, limits, "X") == []
+    assert recorder.velocities.max() <= limits["X"][0] * 1.05
+
+
+@requires_machine_enabled
+@pytest.mark.parametrize("name, count", [("segments", 2000), ("arcs", 500), ("canned cycles", 200)])
+def test_program_throughput(qtbot, homed_machine, record_benchmark, name, count):
+    """
+    Benchmark: dense segment, arc and canned cycle programs, sampling queue, queue_full,
+    active_queue, read_line, current_line and motion_line while they run
+    Programs needing axes the configuration does not have are skipped, test_bench runs every one on the XYZ simulator
+    :param qtbot: Test Suite Control for pytest-qt
+    :param record_benchmark: Stores the throughput report in the results database
+    :param name: Program, a key of lcnc_bench.PROGRAMS
+    :param count: Segments, arcs or holes in the program
+    """
+    assert set_estop_ready()
+    assert set_machine_enabled()
+
+    com = linuxcnc.command()
+    stat = linuxcnc.stat()
+    stat.poll()
+    axes = machine_axes(load_ini(stat.ini_filename))
+    missing = missing_axes(PROGRAM_AXES[name], axes)
+    if missing:
+        pytest.skip(f"{name} need axes {missing}, [TRAJ]COORDINATES is {axes}")
+
+    generate, per_item = PROGRAMS[name]
+    report = run_benchmark(com, stat, generate(count, axes), count * per_item)
+    for key, value in report.items():
+        unit, better = REPORT_UNITS[key]
+        record_benchmark(f"{name} {key}", value, unit, better)
+    assert report["segments_per_second"] > 0
+    assert report["queue_max"] > 0
+
+
+@initialize_test
+def test_sampler_rate(qtbot, record_benchmark):
+    """
+    Benchmark: the trajectory recorder keeps up with the servo period, all but the slowest 1% of its samples
+    :param qtbot: Test Suite Control for pytest-qt
+    :param record_benchmark: Stores the sampling periods in the results database
+    """
+    stat = linuxcnc.stat()
+    stat.poll()
+    result = benchmark_sampler(1.0)
+    for key in ("mean_period", "p99_period", "max_period"):
+        record_benchmark(key, result[key], "s")
+    assert result["p99_period"] <= stat.cycle_time
+
+
+@initialize_test
+def test_shm_mirror(qtbot, record_benchmark):
+    """
+    Benchmark: the shared memory mirror matches stat and how fast a reader can take consistent copies
+    :param qtbot: Test Suite Control for pytest-qt
+    :param record_benchmark: Stores the read rate in the results database
+    """
+    stat = linuxcnc.stat()
+    stat.poll()
+    writer = ShmWriter(f"lcnc-status-test-{os.getpid()}", stat)
+    try:
+        reader = ShmReader(writer.shm.name)
+        reader.poll()
+        for field, _, _ in reader.layout:
+            assert getattr(reader, field) == getattr(stat, field), field
+        reader.close()
+        result = reader_throughput(writer.shm.name, duration=1.0)
+    finally:
+        writer.close()
+    record_benchmark("reads_per_second", result["reads_per_second"], "1/s")
+    assert result["reads_per_second"] > 1 / stat.cycle_time
+
+
+@initialize_test
+def test_columnar_recording(qtbot, tmp_path):
+    """
+    A columnar recording of every field reads back one column over a time range
+    :param qtbot: Test Suite Control for pytest-qt
+    :param tmp_path: pytest temporary directory
+    """
+    path = str(tmp_path / "status.lcol")
+    with ColumnarRecorder(path, chunk_rows=32):
+        time.sleep(1.0)
+    with ColumnarReader(path) as reader:
+        assert "current_vel" in reader.columns and "gcodes" in reader.columns
+        middle = (reader.start + reader.end) / 2
+        result = reader.query(["gcodes", "current_vel"], start=middle)
+        assert 0 < len(result["time"]) < reader.rows
+        stat = linuxcnc.stat()
+        stat.poll()
+        assert result["gcodes"].shape[1] == len(stat.gcodes)
 
 #
 # def test_adaptive_feed_enabled(qtbot):
@@ -327,6 +753,7 @@ def test_actual_position(qtbot):
 #
 
 
+@pytest.mark.no_sim
 @requires_machine_enabled
 def test_ain(qtbot):
     """
@@ -334,35 +761,58 @@ def test_ain(qtbot):
     (returns tuple of floats) - current value of the analog input pins.
     """
 
-    get_pins = run(["halcmd", "show", "pin", "motion.analog-in"], capture_output=True, encoding="utf8")
-    num_pins = int(get_pins.stdout.count("motion.analog-in") or 0)
+    num_pins = len(read_pins("motion.analog-in"))
     shuffle_order = [i for i in range(num_pins)]
     random.shuffle(shuffle_order)
-    print(shuffle_order)
 
     stat = linuxcnc.stat()
     com = linuxcnc.command()
     stat.poll()
 
-    print("ain", stat.ain)
-    for i in stat.ain:
-        assert i == 0
+    TRACE.record("ain", None, stat.ain)
+    assert_masked_equal(StatArrays(stat, ["ain"]).ain, 0)
 
     for i in shuffle_order:
         j = str(i).rjust(2,"0")
-        print(f"halcmd setp motion.analog-in-{j}")
+        TRACE.command(f"halcmd setp motion.analog-in-{j} 1")
         run(["halcmd", "setp", f"motion.analog-in-{j}", "1"])
         qtbot.wait(100)
         stat.poll()
-        print(stat.ain[i])
+        TRACE.record(f"ain[{i}]", 0, stat.ain[i])
         assert stat.ain[i] == 1
 
+        TRACE.command(f"halcmd setp motion.analog-in-{j} 0")
         run(["halcmd", "setp", f"motion.analog-in-{j}", "0"])
         qtbot.wait(100)
         stat.poll()
+        TRACE.record(f"ain[{i}]", 1, stat.ain[i])
         assert stat.ain[i] == 0
 
 
+@pytest.mark.no_sim
+@requires_machine_enabled
+def test_io_sweep(qtbot):
+    """
+    din and ain follow randomized patterns written to every motion input pin at once
+    """
+    counts = input_pin_counts()
+    stat = linuxcnc.stat()
+    patterns = random_patterns(100, counts["din"], counts["ain"])
+    try:
+        results = io_sweep(stat, patterns)
+    finally:
+        reset_inputs(counts["din"], counts["ain"])
+
+    for idx, result in enumerate(results):
+        TRACE.command(f"pattern {idx}")
+        for i in result.din_errors:
+            TRACE.record(f"din[{i}]", result.pattern.din[i], result.din[i])
+        for i in result.ain_errors:
+            TRACE.record(f"ain[{i}]", result.pattern.ain[i], result.ain[i])
+        LATENCIES.add("io pattern", result.latency)
+    assert all(result.latency is not None for result in results)
+
+
 #
 # def test_angular_units(qtbot):
 #     """
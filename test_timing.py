@@ -0,0 +1,49 @@
+#! /usr/bin/python3
+"""
+ test_timing.py Testing wait_for and the latency statistics
+    Runs without Linuxcnc
+
+"""
+from lcnc_timing import LatencyStats, now, percentile, wait_for
+
+
+class DelayedStat:
+    """Stat like object whose estop clears a fixed time after its first poll, on the clock wait_for uses"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.ready_at = None
+        self.estop = 1
+
+    def poll(self):
+        """Update estop from the clock, the first poll is inside wait_for's timed region"""
+        if self.ready_at is None:
+            self.ready_at = now() + self.delay
+        self.estop = int(now() < self.ready_at)
+
+
+def test_wait_for():
+    """
+    Returns the elapsed time, or None on timeout
+    """
+    latency = wait_for(DelayedStat(0.02), lambda s: s.estop == 0, timeout=1.0)
+    assert 0.02 <= latency < 0.5
+    assert wait_for(DelayedStat(1.0), lambda s: s.estop == 0, timeout=0.01) is None
+
+
+def test_latency_stats():
+    """
+    Summary values and the suggested timeout
+    """
+    stats = LatencyStats()
+    for ms in range(1, 101):
+        stats.add("state 2", ms / 1000)
+    stats.add("state 2", None)
+    summary = stats.summary("state 2")
+    assert summary["count"] == 100 and summary["timeouts"] == 1
+    assert summary["min"] == 0.001 and summary["max"] == 0.1
+    assert summary["median"] == 0.0505
+    assert summary["p99"] == 0.099
+    assert summary["suggested"] == 0.198
+    assert stats.report().startswith("state 2: n=100 timeouts=1 min=1.0ms")
+    assert percentile([3.0], 0.99) == 3.0
@@ -0,0 +1,78 @@
+#! /usr/bin/python3
+"""
+ test_tooltable.py Testing the tool table generator, parser and validator
+    Runs without Linuxcnc
+
+"""
+import os
+import time
+
+import pytest
+
+from lcnc_tooltable import ToolEntry, generate_tool_table, is_temp_config, iter_tool_table, parse_line, \
+    validate_tool_table, write_temp_config
+
+
+def test_parse_line():
+    """
+    Words, defaults and comments
+    """
+    entry = parse_line("T3 P7 Z+1.5 D0.25 Q2 ;quarter inch endmill\n")
+    assert entry == ToolEntry(3, 7, (0.0, 0.0, 1.5) + (0.0,) * 6, 0.25, 0.0, 0.0, 2, "quarter inch endmill")
+    assert parse_line(";only a comment") is None
+    assert parse_line("   \n") is None
+    with pytest.raises(ValueError):
+        parse_line("T1 Z0")
+    with pytest.raises(ValueError):
+        parse_line("T1 P1 K3")
+
+
+def test_generated_round_trip(tmp_path):
+    """
+    A generated table parses back to the same entries and validates
+    """
+    path = str(tmp_path / "tool.tbl")
+    written = generate_tool_table(path, 200, seed=1)
+    read = list(iter_tool_table(path))
+    assert [entry.tool for entry in read] == list(range(1, 201))
+    assert [entry.offsets[2] for entry in read] == pytest.approx([entry.offsets[2] for entry in written], abs=1e-6)
+    assert validate_tool_table(path) == []
+
+
+def test_validate_tool_table(tmp_path):
+    """
+    Every problem is reported with its line number
+    """
+    path = tmp_path / "tool.tbl"
+    path.write_text("T1 P1\nT1 P2\nT2 P2 Q12\nT3 P3 R1\n")
+    assert validate_tool_table(str(path)) == [
+        "line 2: tool 1 already defined on line 1",
+        "line 3: pocket 2 already used on line 2",
+        "line 3: orientation 12 out of range",
+        "line 4: Unknown word R1",
+    ]
+
+
+def test_write_temp_config(tmp_path):
+    """
+    The copied configuration points at the generated table, and only the copy counts as a temporary config
+    """
+    ini = write_temp_config(5, seed=2, parent=str(tmp_path))
+    assert os.path.dirname(os.path.dirname(ini)) == str(tmp_path)
+    assert os.path.exists(os.path.join(os.path.dirname(ini), "basic.hal"))
+    assert len(list(iter_tool_table(os.path.join(os.path.dirname(ini), "tool.tbl")))) == 5
+    assert is_temp_config(ini) and not is_temp_config(os.path.join("configs", "tool.tbl"))
+
+
+def test_parse_benchmark(tmp_path, record_benchmark):
+    """
+    Benchmark: a full 1000 tool table parses well inside a second
+    :param record_benchmark: Stores the parse time in the results database
+    """
+    path = str(tmp_path / "tool.tbl")
+    generate_tool_table(path, 1000)
+    start = time.perf_counter()
+    assert len(list(iter_tool_table(path))) == 1000
+    elapsed = time.perf_counter() - start
+    record_benchmark("parse 1000 tools", elapsed, "s")
+    assert elapsed < 1.0
@@ -0,0 +1,59 @@
+#! /usr/bin/python3
+"""
+ test_trace.py Testing the structured test trace
+    Runs without Linuxcnc
+
+"""
+import json
+
+from lcnc_trace import TraceBuffer
+
+
+def test_trace_steps():
+    """
+    Changes are attributed to the last command, with the latency noted for it and none before it is noted
+    """
+    trace = TraceBuffer()
+    trace.begin("test_example")
+    trace.command("state 2")
+    assert trace.settled(0.003) == 0.003
+    trace.record_diff({"task_state": (1, 2), "estop": (1, 0)})
+    trace.command("state 4")
+    trace.record("estop", 0, 0)
+    trace.record("task_state", 2, 4, latency=0.25)
+
+    changes = trace.changes()
+    assert [(event.step, event.command, event.field) for event in changes] == [
+        (1, "state 2", "estop"), (1, "state 2", "task_state"), (2, "state 4", "estop"), (2, "state 4", "task_state")]
+    assert changes[0].latency == changes[1].latency == 0.003
+    assert changes[2].latency is None
+    assert trace.changes("task_state")[-1].latency == 0.25
+
+
+def test_trace_ring_buffer():
+    """
+    Only the newest events are kept
+    """
+    trace = TraceBuffer(size=10)
+    trace.begin("test_example")
+    for idx in range(100):
+        trace.record("ain[0]", idx, idx + 1)
+    assert len(trace.events) == 10
+    assert trace.events[0].old == 90
+
+
+def test_trace_flush(tmp_path):
+    """
+    Flushing writes one JSON object per event and empties the buffer
+    """
+    trace = TraceBuffer()
+    trace.begin("test_example")
+    trace.command("mdi G0 X1")
+    trace.record("actual_position", None, (1.0, 0.0, 0.0))
+    path = tmp_path / "traces" / "test_example.jsonl"
+    assert trace.flush(str(path)) == 2
+    assert not trace.events
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert lines[0]["command"] == "mdi G0 X1" and lines[0]["field"] is None
+    assert lines[1]["new"] == [1.0, 0.0, 0.0]
@@ -0,0 +1,110 @@
+#! /usr/bin/python3
+"""
+ test_watchdog.py Testing the connection state machine
+    Runs without Linuxcnc, using a fake controller and clock
+
+"""
+import pytest
+
+from lcnc_watchdog import CONNECTED, DEGRADED, DISCONNECTED, RECONNECTING, ConnectionWatchdog
+
+
+class FakeController:
+    """Stands in for LinuxCNC, stat objects from before a restart stay dead"""
+
+    def __init__(self):
+        self.running = True
+        self.generation = 0
+        self.created = 0
+
+    def restart(self):
+        """Stop, the next start gets a new generation"""
+        self.running = False
+        self.generation += 1
+
+    def factory(self):
+        """Create (stat, command) like ConnectionWatchdog expects"""
+        if not self.running:
+            raise RuntimeError("emcStatusBuffer invalid")
+        self.created += 1
+        return FakeStat(self), object()
+
+
+class FakeStat:
+    """Stat bound to one controller generation"""
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.generation = controller.generation
+
+    def poll(self):
+        """Fails once the controller stopped or restarted"""
+        if not self.controller.running or self.generation != self.controller.generation:
+            raise RuntimeError("emcStatusBuffer invalid")
+
+
+class Clock:
+    """Manually advanced time source"""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_restart_and_recover():
+    """
+    Degrades, disconnects, backs off exponentially and reconnects with new channels
+    """
+    controller, clock, changes = FakeController(), Clock(), []
+    watchdog = ConnectionWatchdog(controller.factory, lambda old, new: changes.append(new),
+                                  failure_limit=2, backoff_start=1.0, backoff_max=4.0, clock=clock)
+    assert watchdog.tick()
+    assert watchdog.state == CONNECTED
+    assert watchdog.recoveries == []
+    first = watchdog.status
+
+    controller.restart()
+    assert not watchdog.tick()
+    assert watchdog.state == DEGRADED
+    clock.now += 0.5
+    assert not watchdog.tick()
+    assert watchdog.state == DISCONNECTED
+    assert watchdog.status is None
+
+    # Attempts 1, 2, 4 and 4 seconds apart, nothing in between
+    attempts = [clock.now]
+    for step in range(1, 120):
+        clock.now = 100.5 + step / 10
+        before = len(changes)
+        watchdog.tick()
+        if RECONNECTING in changes[before:]:
+            attempts.append(clock.now)
+    gaps = [new - old for old, new in zip(attempts, attempts[1:])]
+    assert gaps == pytest.approx([1.0, 2.0, 4.0, 4.0], abs=0.11)
+
+    controller.running = True
+    clock.now = watchdog.next_attempt
+    assert watchdog.tick()
+    assert watchdog.state == CONNECTED
+    assert watchdog.status is not first
+    assert watchdog.recoveries == [clock.now - 100.0]
+    assert watchdog.last_recovery == watchdog.recoveries[0]
+
+
+def test_degraded_recovers():
+    """
+    A single failed poll does not drop the channels
+    """
+    controller, clock = FakeController(), Clock()
+    watchdog = ConnectionWatchdog(controller.factory, clock=clock)
+    watchdog.tick()
+    controller.running = False
+    watchdog.tick()
+    controller.running = True
+    clock.now += 0.25
+    assert watchdog.tick()
+    assert watchdog.state == CONNECTED
+    assert controller.created == 1
+    assert watchdog.recoveries == [0.25]